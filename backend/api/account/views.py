@@ -8,6 +8,7 @@ from api.settings import GENERIC_ERR_RESPONSE
 from api.utils import (
     MessageOutputSerializer,
     api_endpoint,
+    forget_user_sessions,
     require_account_auth,
     validate_json_input,
     validate_output,
@@ -31,6 +32,7 @@ def set_default_name(request):
         with transaction.atomic():
             user.default_display_name = display_name
             user.save()
+            forget_user_sessions(user)
     except DatabaseError as e:
         logger.db_error(e)
         return GENERIC_ERR_RESPONSE
@@ -57,6 +59,7 @@ def remove_default_name(request):
         with transaction.atomic():
             user.default_display_name = None
             user.save()
+            forget_user_sessions(user)
     except DatabaseError as e:
         logger.db_error(e)
         return GENERIC_ERR_RESPONSE
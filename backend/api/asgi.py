@@ -12,5 +12,8 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "api.settings")
+# Without DB_POOL, connections can't be kept open between requests, since sync code runs
+# in threads that aren't reused
+os.environ.setdefault("DB_CONN_MAX_AGE", "0")
 
 application = get_asgi_application()
@@ -19,10 +19,13 @@ from api.auth.serializers import (
     RegisterAccountSerializer,
 )
 from api.auth.utils import list_failed_criteria, validate_password
+from api.availability.utils import invalidate_availability_snapshot
 from api.models import (
     PasswordResetToken,
     UnverifiedUserAccount,
+    UrlCode,
     UserAccount,
+    UserEvent,
     UserLogin,
     UserSession,
 )
@@ -40,7 +43,9 @@ from api.utils import (
     MessageOutputSerializer,
     api_endpoint,
     delete_session_cookie,
-    get_session,
+    forget_sessions,
+    forget_user_sessions,
+    mark_participants_changed,
     rate_limit,
     require_account_auth,
     set_session_cookie,
@@ -252,33 +257,25 @@ def login(request):
     remember_me = request.validated_data.get("remember_me")
 
     # Check if the user is already logged in
-    acct_token = request.COOKIES.get(ACCOUNT_COOKIE_NAME)
-    if acct_token:
-        try:
-            with transaction.atomic():
-                session = get_session(acct_token)
-                if not session:
-                    raise UserSession.DoesNotExist
-                session.save()  # To update last_used to now
-
-            # At this point the account is authenticated
-            logger.info("User %s is already logged in.", session.user_account.email)
-            response = Response(
-                {"error": {"general": ["You are already logged in."]}}, status=400
-            )
-            # Refresh the session token cookie
-            set_session_cookie(
-                response, ACCOUNT_COOKIE_NAME, acct_token, session.is_extended
-            )
-            return response
-        except UserSession.DoesNotExist:
-            logger.info("Account session expired.")
-        except DatabaseError as e:
-            logger.db_error(e)
-            return GENERIC_ERR_RESPONSE
-        except Exception as e:
-            logger.error(e)
-            return GENERIC_ERR_RESPONSE
+    try:
+        session = request.session_auth.account_session
+    except DatabaseError as e:
+        logger.db_error(e)
+        return GENERIC_ERR_RESPONSE
+    except Exception as e:
+        logger.error(e)
+        return GENERIC_ERR_RESPONSE
+
+    if session:
+        logger.info("User %s is already logged in.", session.user_account.email)
+        response = Response(
+            {"error": {"general": ["You are already logged in."]}}, status=400
+        )
+        # Refresh the session token cookie
+        set_session_cookie(
+            response, ACCOUNT_COOKIE_NAME, session.session_token, session.is_extended
+        )
+        return response
 
     BAD_AUTH_RESPONSE = Response(
         {"error": {"general": ["Email or password is incorrect."]}}, status=400
@@ -463,7 +460,8 @@ def reset_password(request):
             user.save()
             reset_token_obj.delete()  # Make sure to remove the reset token after use
 
-            # Remove all active sessions for the user
+            # Remove all active sessions for the user, from the cache once committed
+            forget_user_sessions(user)
             UserSession.objects.filter(user_account=user).delete()
 
     except PasswordResetToken.DoesNotExist:
@@ -491,6 +489,7 @@ def logout(request):
     try:
         if token := request.COOKIES.get(ACCOUNT_COOKIE_NAME):
             UserSession.objects.filter(session_token=token).delete()
+            forget_sessions([token])
         else:
             logger.info("User already logged out.")
     except DatabaseError as e:
@@ -520,7 +519,19 @@ def delete_account(request):
         logger.info("Account deletion failed for %s: Incorrect password.", user.email)
         return Response({"error": {"password": ["Incorrect password."]}}, status=400)
     try:
+        # The user's availability disappears from these events with the account
+        participated_codes = list(
+            UrlCode.objects.filter(
+                user_event__participants__user_account=user
+            ).values_list("url_code", flat=True)
+        )
+        forget_user_sessions(user)
+        mark_participants_changed(
+            UserEvent.objects.filter(participants__user_account=user)
+        )
         user.delete()
+        for event_code in participated_codes:
+            invalidate_availability_snapshot(event_code)
     except DatabaseError as e:
         logger.db_error(e)
         return GENERIC_ERR_RESPONSE
@@ -0,0 +1,133 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import defaultdict
+from contextlib import aclosing
+
+import redis
+import redis.asyncio
+from django.db import transaction
+
+from api.availability.utils import get_timeslot_datetime
+from api.settings import REDIS_CACHE_URL
+
+logger = logging.getLogger("api")
+
+
+class RedisAvailabilityBroker:
+    """
+    Sends availability changes through Redis pub/sub, so subscribers in every process
+    receive them.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel, message):
+        self.client.publish(channel, message)
+
+    async def listen(self, channel, timeout):
+        # Every subscriber needs its own connection while it is subscribed
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            await pubsub.subscribe(channel)
+            while True:
+                message = await pubsub.get_message(timeout=timeout)
+                yield message["data"].decode() if message else None
+        finally:
+            await pubsub.aclose()
+            await client.aclose()
+
+
+class LocalAvailabilityBroker:
+    """
+    Sends availability changes in memory when Redis isn't configured (like in development
+    and tests). Only subscribers in the same process receive them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+        # Publishing happens in the request's thread, so the message is handed over to
+        # each subscriber's event loop
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # The subscriber's event loop is already closed
+                pass
+
+    async def listen(self, channel, timeout):
+        queue = asyncio.Queue()
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self.lock:
+            self.subscribers[channel].add(subscriber)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout)
+                except TimeoutError:
+                    yield None
+        finally:
+            with self.lock:
+                self.subscribers[channel].discard(subscriber)
+                if not self.subscribers[channel]:
+                    del self.subscribers[channel]
+
+
+availability_broker = (
+    RedisAvailabilityBroker(REDIS_CACHE_URL)
+    if REDIS_CACHE_URL
+    else LocalAvailabilityBroker()
+)
+
+
+def get_availability_channel(event_code):
+    return f"availability:{event_code}"
+
+
+def get_timeslot_keys(event, timeslots, indexes):
+    """
+    Returns the timeslots at the given indexes into `timeslots` in ISO format, the same
+    way they are keyed in the "get-all" endpoint.
+    """
+    return [
+        get_timeslot_datetime(event, timeslots[i]).isoformat() for i in sorted(indexes)
+    ]
+
+
+def publish_availability_change(event_code, change):
+    """
+    Sends a change to an event's availability to everyone streaming it.
+
+    `change` is a dictionary with at least a "type". When called inside a transaction,
+    this only happens after the transaction commits.
+    """
+    message = json.dumps(change)
+
+    def publish():
+        try:
+            availability_broker.publish(get_availability_channel(event_code), message)
+        except Exception as e:
+            logger.warning("Failed to publish availability change: %s", e)
+
+    transaction.on_commit(publish)
+
+
+async def listen_for_availability_changes(event_code, timeout):
+    """
+    Yields the changes published for an event as they arrive, or `None` whenever
+    `timeout` seconds pass without one.
+    """
+    messages = availability_broker.listen(get_availability_channel(event_code), timeout)
+    # Closed explicitly so the subscription ends as soon as the stream does
+    async with aclosing(messages):
+        async for message in messages:
+            yield json.loads(message) if message is not None else None
@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from api.utils import TimeZoneField
+from api.utils import TimeslotListField, TimeZoneField
 
 
 class EventCodeSerializer(serializers.Serializer):
@@ -16,11 +16,7 @@ class DisplayNameCheckSerializer(EventCodeSerializer, DisplayNameSerializer):
 
 
 class AvailabilitySerializer(serializers.Serializer):
-    availability = serializers.ListField(
-        child=serializers.DateTimeField(required=True),
-        required=True,
-        min_length=1,
-    )
+    availability = TimeslotListField(required=True, allow_empty=False)
 
 
 class AvailabilityAddSerializer(
@@ -29,6 +25,26 @@ class AvailabilityAddSerializer(
     time_zone = TimeZoneField(required=True)
 
 
+class AvailabilityRangeSerializer(serializers.Serializer):
+    start = serializers.DateTimeField(required=True)
+    end = serializers.DateTimeField(required=True)
+    action = serializers.ChoiceField(required=True, choices=["add", "remove"])
+
+    def validate(self, attrs):
+        if attrs["start"] >= attrs["end"]:
+            raise serializers.ValidationError({"end": ["End must be after start."]})
+        return super().validate(attrs)
+
+
+class AvailabilityUpdateSerializer(EventCodeSerializer):
+    ranges = serializers.ListField(
+        child=AvailabilityRangeSerializer(),
+        required=True,
+        min_length=1,
+        max_length=100,
+    )
+
+
 class AvailableDatesSerializer(DisplayNameSerializer):
     available_dates = serializers.ListField(
         child=serializers.DateTimeField(required=True), required=True
@@ -36,7 +52,13 @@ class AvailableDatesSerializer(DisplayNameSerializer):
     time_zone = TimeZoneField(required=True)
 
 
-class EventAvailabilitySerializer(serializers.Serializer):
+class EventAvailabilityQuerySerializer(EventCodeSerializer):
+    encoding = serializers.ChoiceField(
+        required=False, choices=["names", "indexed", "compact"], default="names"
+    )
+
+
+class EventParticipantsSerializer(serializers.Serializer):
     user_display_name = serializers.CharField(
         allow_null=True, max_length=25, required=True
     )
@@ -44,6 +66,9 @@ class EventAvailabilitySerializer(serializers.Serializer):
         child=serializers.CharField(required=True, max_length=25),
         required=True,
     )
+
+
+class EventAvailabilitySerializer(EventParticipantsSerializer):
     availability = serializers.DictField(
         child=serializers.ListField(
             child=serializers.CharField(required=True, max_length=25),
@@ -52,3 +77,33 @@ class EventAvailabilitySerializer(serializers.Serializer):
         required=True,
         allow_empty=False,
     )
+
+
+class IndexedEventAvailabilitySerializer(EventParticipantsSerializer):
+    availability = serializers.DictField(
+        child=serializers.ListField(
+            child=serializers.IntegerField(required=True, min_value=0),
+            required=True,
+        ),
+        required=True,
+        allow_empty=False,
+    )
+
+
+class TimeslotRunListField(serializers.ListField):
+    """
+    A list of `[offset, length]` runs of consecutive timeslots.
+    """
+
+    child = serializers.ListField(
+        child=serializers.IntegerField(min_value=0), min_length=2, max_length=2
+    )
+
+
+class CompactEventAvailabilitySerializer(EventParticipantsSerializer):
+    start = serializers.DateTimeField(required=True, allow_null=True)
+    timeslot_minutes = serializers.IntegerField(required=True)
+    timeslots = TimeslotRunListField(required=True)
+    availability = serializers.ListField(
+        child=TimeslotRunListField(required=True), required=True
+    )
@@ -1,13 +1,30 @@
-from datetime import datetime
+import logging
+import time
+from datetime import datetime, timedelta
 
+from django.core.cache import caches
+from django.db import transaction
 from django.db.models import Q
 
 from api.models import (
+    AvailabilityStatus,
+    EventDateAvailability,
     EventDateTimeslot,
     EventParticipant,
+    EventWeekdayAvailability,
     EventWeekdayTimeslot,
     UserEvent,
 )
+from api.settings import (
+    AVAILABILITY_AGGREGATION_ENGINE,
+    AVAILABILITY_BITMAP_STORAGE,
+    AVAILABILITY_SNAPSHOT_TTL_SECONDS,
+)
+
+logger = logging.getLogger("api")
+
+TIMESLOT_MINUTES = 15
+TIMESLOT_DELTA = timedelta(minutes=TIMESLOT_MINUTES)
 
 
 def get_timeslots(event):
@@ -24,6 +41,16 @@ def get_timeslots(event):
     return timeslots
 
 
+def get_availability_model(event):
+    """
+    Returns the availability model for an event's type, along with the name of its
+    timeslot foreign key column.
+    """
+    if event.date_type == UserEvent.EventType.SPECIFIC:
+        return EventDateAvailability, "event_date_timeslot_id"
+    return EventWeekdayAvailability, "event_weekday_timeslot_id"
+
+
 def check_name_available(event, user, display_name):
     if user:
         existing_participant = EventParticipant.objects.filter(
@@ -41,3 +68,447 @@ def check_name_available(event, user, display_name):
 
 def get_weekday_date(weekday, timeslot):
     return datetime(2012, 1, weekday + 1, timeslot.hour, timeslot.minute)
+
+
+def get_timeslot_datetime(event, timeslot):
+    """
+    Returns the datetime that a timeslot object is represented by in the API.
+
+    For 'week' events, this is a date in the week of `get_weekday_date`.
+    """
+    if event.date_type == UserEvent.EventType.SPECIFIC:
+        return timeslot.utc_timeslot
+    return get_weekday_date(timeslot.weekday, timeslot.local_timeslot)
+
+
+def encode_bitmap(indexes, length):
+    """
+    Encodes timeslot indexes into an availability bitmap with `length` bits.
+
+    Bit `i` is set (least significant bit of each byte first) if the participant is
+    available for the timeslot at index `i` of the event's ordered timeslots.
+    """
+    bitmap = bytearray((length + 7) // 8)
+    for index in indexes:
+        bitmap[index >> 3] |= 1 << (index & 7)
+    return bytes(bitmap)
+
+
+def decode_bitmap(bitmap):
+    """
+    Decodes an availability bitmap into a sorted list of the set timeslot indexes.
+    """
+    indexes = []
+    if not bitmap:
+        return indexes
+    for byte_index, byte in enumerate(bytes(bitmap)):
+        base = byte_index << 3
+        while byte:
+            low_bit = byte & -byte
+            indexes.append(base + low_bit.bit_length() - 1)
+            byte ^= low_bit
+    return indexes
+
+
+def remap_availability_bitmaps(event, old_timeslot_datetimes):
+    """
+    Re-encodes the availability bitmaps of every participant in an event after its
+    timeslots were edited.
+
+    `old_timeslot_datetimes` must be the event's ordered timeslot datetimes (from
+    `get_timeslot_datetime`) from before the edit. Availability for removed timeslots is
+    dropped.
+    """
+    new_timeslot_datetimes = [
+        get_timeslot_datetime(event, ts) for ts in get_timeslots(event)
+    ]
+    new_indexes = {ts: i for i, ts in enumerate(new_timeslot_datetimes)}
+
+    participants = list(
+        EventParticipant.objects.filter(
+            user_event=event, availability_bitmap__isnull=False
+        ).only("event_participant_id", "availability_bitmap")
+    )
+    for participant in participants:
+        indexes = []
+        for old_index in decode_bitmap(participant.availability_bitmap):
+            if old_index >= len(old_timeslot_datetimes):
+                continue
+            new_index = new_indexes.get(old_timeslot_datetimes[old_index])
+            if new_index is not None:
+                indexes.append(new_index)
+        participant.availability_bitmap = encode_bitmap(
+            indexes, len(new_timeslot_datetimes)
+        )
+    EventParticipant.objects.bulk_update(participants, ["availability_bitmap"])
+
+
+def get_participant_timeslot_indexes(event, participant, timeslots):
+    """
+    Returns the set of indexes into `timeslots` (as returned by `get_timeslots`) that the
+    participant is available for.
+    """
+    if AVAILABILITY_BITMAP_STORAGE:
+        return {
+            i
+            for i in decode_bitmap(participant.availability_bitmap)
+            if i < len(timeslots)
+        }
+
+    timeslot_indexes = {ts.pk: i for i, ts in enumerate(timeslots)}
+    model, timeslot_field = get_availability_model(event)
+    timeslot_ids = model.objects.filter(event_participant=participant).values_list(
+        timeslot_field, flat=True
+    )
+    return {timeslot_indexes[pk] for pk in timeslot_ids if pk in timeslot_indexes}
+
+
+def save_participant_timeslot_indexes(
+    event, participant, timeslots, indexes, existing=None
+):
+    """
+    Stores the participant's availability as the given set of indexes into `timeslots`.
+
+    With row storage, only the rows for timeslots that were removed or added are written.
+    `existing` can be passed if the participant's current indexes are already known.
+    With bitmap storage, the bitmap is updated on the participant, which must be saved
+    afterwards.
+    """
+    if AVAILABILITY_BITMAP_STORAGE:
+        participant.availability_bitmap = encode_bitmap(indexes, len(timeslots))
+        return
+
+    if existing is None:
+        existing = get_participant_timeslot_indexes(event, participant, timeslots)
+    model, timeslot_field = get_availability_model(event)
+
+    to_delete = [timeslots[i].pk for i in existing - indexes]
+    to_add = [
+        model(
+            event_participant=participant,
+            status=AvailabilityStatus.AVAILABLE,
+            **{timeslot_field: timeslots[i].pk},
+        )
+        for i in sorted(indexes - existing)
+    ]
+    if to_delete:
+        model.objects.filter(
+            event_participant=participant, **{f"{timeslot_field}__in": to_delete}
+        ).delete()
+    if to_add:
+        model.objects.bulk_create(to_add)
+
+
+def get_set_bits(mask):
+    """
+    Returns the positions of the set bits in an integer bitmask, in ascending order.
+    """
+    positions = []
+    while mask:
+        low_bit = mask & -mask
+        positions.append(low_bit.bit_length() - 1)
+        mask ^= low_bit
+    return positions
+
+
+def get_participant_masks(event, participants, timeslots):
+    """
+    Returns one bitmask per timeslot (in the order of `timeslots`), where bit `j` is set
+    if `participants[j]` is available for that timeslot.
+
+    Availability is read from the participants' bitmaps, or with a single `values_list`
+    query when stored as rows. No availability model objects are created.
+    """
+    masks = [0] * len(timeslots)
+
+    if AVAILABILITY_BITMAP_STORAGE:
+        for j, participant in enumerate(participants):
+            bit = 1 << j
+            for i in decode_bitmap(participant.availability_bitmap):
+                if i >= len(masks):
+                    logger.error(
+                        f"Timeslot index {i} out of range for event {event.pk}"
+                    )
+                    break
+                masks[i] |= bit
+        return masks
+
+    timeslot_indexes = {ts.pk: i for i, ts in enumerate(timeslots)}
+    participant_bits = {p.pk: 1 << j for j, p in enumerate(participants)}
+    model, timeslot_field = get_availability_model(event)
+    rows = model.objects.filter(
+        event_participant_id__in=participant_bits.keys()
+    ).values_list(timeslot_field, "event_participant_id")
+    for timeslot_id, participant_id in rows:
+        masks[timeslot_indexes[timeslot_id]] |= participant_bits[participant_id]
+    return masks
+
+
+def aggregate_availability_array(event, participants, timeslots):
+    """
+    Builds the "get-all" availability dictionary from per-timeslot participant bitmasks.
+
+    Display names in each timeslot are sorted alphabetically, in the database's collation
+    order like the "loop" engine.
+    """
+    # Sorting in Python would order mixed-case names differently than the database
+    name_order = EventParticipant.objects.filter(
+        pk__in=[p.pk for p in participants]
+    ).order_by("display_name")
+    positions = {pk: i for i, pk in enumerate(name_order.values_list("pk", flat=True))}
+    participants = sorted(participants, key=lambda p: positions[p.pk])
+    names = [p.display_name for p in participants]
+    masks = get_participant_masks(event, participants, timeslots)
+    return {
+        get_timeslot_datetime(event, ts).isoformat(): [
+            names[j] for j in get_set_bits(mask)
+        ]
+        for ts, mask in zip(timeslots, masks)
+    }
+
+
+def aggregate_availability_loop(event, participants, timeslots):
+    """
+    Builds the "get-all" availability dictionary by loading every availability row as a
+    model object.
+
+    This is the original implementation, kept for comparison with the array engine. It
+    does not support bitmap storage.
+    """
+    availability_dict = {
+        get_timeslot_datetime(event, ts).isoformat(): [] for ts in timeslots
+    }
+    if event.date_type == UserEvent.EventType.SPECIFIC:
+        availabilities = (
+            EventDateAvailability.objects.filter(event_participant__in=participants)
+            .select_related("event_date_timeslot", "event_participant")
+            .order_by(
+                "event_date_timeslot__utc_timeslot",
+                "event_participant__display_name",
+            )
+        )
+    else:
+        availabilities = (
+            EventWeekdayAvailability.objects.filter(event_participant__in=participants)
+            .select_related("event_weekday_timeslot", "event_participant")
+            .order_by(
+                "event_weekday_timeslot__weekday",
+                "event_weekday_timeslot__local_timeslot",
+                "event_participant__display_name",
+            )
+        )
+    for t in availabilities:
+        if event.date_type == UserEvent.EventType.SPECIFIC:
+            timeslot = t.event_date_timeslot.utc_timeslot.isoformat()
+        else:
+            timeslot = get_weekday_date(
+                t.event_weekday_timeslot.weekday,
+                t.event_weekday_timeslot.local_timeslot,
+            ).isoformat()
+        if timeslot not in availability_dict:
+            logger.error(
+                f"Timeslot {timeslot} not found in availability dict for event {event.pk}"
+            )
+            continue
+        availability_dict[timeslot].append(t.event_participant.display_name)
+    return availability_dict
+
+
+AGGREGATION_ENGINES = {
+    "array": aggregate_availability_array,
+    "loop": aggregate_availability_loop,
+}
+
+
+def aggregate_availability(event, participants, timeslots, engine="array"):
+    """
+    Builds the "get-all" availability dictionary, mapping each timeslot (in ISO format)
+    to the display names of the participants available for it.
+
+    The "loop" engine is only used with row storage, since it cannot read bitmaps.
+    """
+    if AVAILABILITY_BITMAP_STORAGE:
+        engine = "array"
+    return AGGREGATION_ENGINES[engine](event, participants, timeslots)
+
+
+def encode_runs(offsets):
+    """
+    Groups ascending timeslot offsets into `[offset, length]` runs of consecutive
+    timeslots.
+    """
+    runs = []
+    for offset in offsets:
+        if runs and runs[-1][0] + runs[-1][1] == offset:
+            runs[-1][1] += 1
+        else:
+            runs.append([offset, 1])
+    return runs
+
+
+def build_compact_availability(event, participants, timeslots):
+    """
+    Encodes an event's availability with timeslots as offsets from its first timeslot, in
+    units of `TIMESLOT_MINUTES`, grouped into `[offset, length]` runs.
+
+    Returns the runs of the event's timeslots, and the runs each participant (in the order
+    of `participants`) is available for.
+    """
+    if not timeslots:
+        return {
+            "start": None,
+            "timeslot_minutes": TIMESLOT_MINUTES,
+            "timeslots": [],
+            "availability": [[] for _ in participants],
+        }
+
+    datetimes = [get_timeslot_datetime(event, ts) for ts in timeslots]
+    start = datetimes[0]
+    offsets = [(dt - start) // TIMESLOT_DELTA for dt in datetimes]
+
+    participant_offsets = [[] for _ in participants]
+    if participants:
+        masks = get_participant_masks(event, participants, timeslots)
+        for offset, mask in zip(offsets, masks):
+            for j in get_set_bits(mask):
+                participant_offsets[j].append(offset)
+
+    return {
+        "start": start.isoformat(),
+        "timeslot_minutes": TIMESLOT_MINUTES,
+        "timeslots": encode_runs(offsets),
+        "availability": [encode_runs(o) for o in participant_offsets],
+    }
+
+
+def build_indexed_availability(event, participants, timeslots):
+    """
+    Builds the "get-all" availability dictionary with each timeslot (in ISO format)
+    mapped to the indexes of the available participants in `participants`.
+    """
+    if participants:
+        masks = get_participant_masks(event, participants, timeslots)
+    else:
+        masks = [0] * len(timeslots)
+    return {
+        get_timeslot_datetime(event, ts).isoformat(): get_set_bits(mask)
+        for ts, mask in zip(timeslots, masks)
+    }
+
+
+def build_availability_snapshot(event, encoding="names"):
+    """
+    Builds the part of the "get-all" availability response that is the same for every
+    user (in the given encoding), along with the display names of participants by user
+    account ID.
+    """
+    participants = list(event.participants.all().order_by("created_at"))
+    timeslots = list(get_timeslots(event))
+
+    data = {"participants": [p.display_name for p in participants]}
+    if encoding == "compact":
+        data.update(build_compact_availability(event, participants, timeslots))
+    elif encoding == "indexed":
+        data["availability"] = build_indexed_availability(
+            event, participants, timeslots
+        )
+    elif participants:
+        data["availability"] = aggregate_availability(
+            event, participants, timeslots, AVAILABILITY_AGGREGATION_ENGINE
+        )
+    else:
+        data["availability"] = {
+            get_timeslot_datetime(event, ts).isoformat(): [] for ts in timeslots
+        }
+
+    return {
+        "data": data,
+        "display_names": {p.user_account_id: p.display_name for p in participants},
+    }
+
+
+def get_snapshot_version_key(event_code):
+    return f"version:{event_code}"
+
+
+def get_snapshot_key(event_code, version, encoding):
+    return f"snapshot:{event_code}:{version}:{encoding}"
+
+
+def get_availability_version(event_code):
+    """
+    Returns the current availability version of an event, which changes whenever its
+    availability or timeslots do. Returns `None` if the cache is unavailable.
+    """
+    cache = caches["availability"]
+    version_key = get_snapshot_version_key(event_code)
+    try:
+        version = cache.get(version_key)
+        if version is None:
+            # Start from the current time so an old snapshot can never be picked up if
+            # the version was evicted from the cache
+            cache.add(version_key, time.time_ns(), AVAILABILITY_SNAPSHOT_TTL_SECONDS)
+            version = cache.get(version_key)
+        return version
+    except Exception as e:
+        logger.warning("Availability snapshot cache unavailable: %s", e)
+        return None
+
+
+def get_availability_snapshot(event_code, encoding="names"):
+    """
+    Returns the current snapshot version of an event and its cached availability
+    snapshot in the given encoding, or `None` for the snapshot if it has not been cached
+    yet.
+
+    The version must be read before building a new snapshot, so that a snapshot built
+    from data that changes in the meantime is stored under an outdated version.
+    """
+    version = get_availability_version(event_code)
+    if version is None:
+        return None, None
+    try:
+        snapshot = caches["availability"].get(
+            get_snapshot_key(event_code, version, encoding)
+        )
+    except Exception as e:
+        logger.warning("Availability snapshot cache unavailable: %s", e)
+        return None, None
+    return version, snapshot
+
+
+def set_availability_snapshot(event_code, version, snapshot, encoding="names"):
+    if version is None:
+        return
+    try:
+        caches["availability"].set(
+            get_snapshot_key(event_code, version, encoding),
+            snapshot,
+            AVAILABILITY_SNAPSHOT_TTL_SECONDS,
+        )
+    except Exception as e:
+        logger.warning("Availability snapshot cache unavailable: %s", e)
+
+
+def invalidate_availability_snapshot(event_code):
+    """
+    Invalidates the cached availability snapshot of an event by bumping its version.
+
+    When called inside a transaction, this only happens after the transaction commits.
+    """
+
+    def bump_version():
+        cache = caches["availability"]
+        version_key = get_snapshot_version_key(event_code)
+        try:
+            try:
+                cache.incr(version_key)
+            except ValueError:
+                # The version doesn't exist (anymore), so no snapshot can be current
+                cache.add(
+                    version_key, time.time_ns(), AVAILABILITY_SNAPSHOT_TTL_SECONDS
+                )
+        except Exception as e:
+            logger.error("Failed to invalidate availability snapshot: %s", e)
+
+    transaction.on_commit(bump_version)
@@ -1,29 +1,70 @@
+import json
 import logging
+import time
+from bisect import bisect_left
+from contextlib import aclosing
 
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
 from django.db import DatabaseError, transaction
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from rest_framework.response import Response
 from rest_framework.throttling import AnonRateThrottle
 
+from api.availability.live import (
+    get_timeslot_keys,
+    listen_for_availability_changes,
+    publish_availability_change,
+)
 from api.availability.serializers import (
     AvailabilityAddSerializer,
+    AvailabilityUpdateSerializer,
     AvailableDatesSerializer,
+    CompactEventAvailabilitySerializer,
     DisplayNameCheckSerializer,
+    EventAvailabilityQuerySerializer,
     EventAvailabilitySerializer,
     EventCodeSerializer,
+    IndexedEventAvailabilitySerializer,
+)
+from api.availability.utils import (
+    build_availability_snapshot,
+    check_name_available,
+    decode_bitmap,
+    get_availability_snapshot,
+    get_availability_version,
+    get_participant_timeslot_indexes,
+    get_timeslot_datetime,
+    get_timeslots,
+    get_weekday_date,
+    invalidate_availability_snapshot,
+    save_participant_timeslot_indexes,
+    set_availability_snapshot,
 )
-from api.availability.utils import check_name_available, get_timeslots, get_weekday_date
 from api.models import (
-    AvailabilityStatus,
     EventDateAvailability,
     EventParticipant,
     EventWeekdayAvailability,
+    UrlCode,
     UserEvent,
 )
-from api.settings import GENERIC_ERR_RESPONSE
+from api.routers import read_from_primary
+from api.settings import (
+    AVAILABILITY_BITMAP_STORAGE,
+    AVAILABILITY_STREAM_KEEPALIVE_SECONDS,
+    AVAILABILITY_STREAM_MAX_SECONDS,
+    GENERIC_ERR_RESPONSE,
+)
+from api.touches import record_touch
 from api.utils import (
     MessageOutputSerializer,
     api_endpoint,
     check_auth,
+    etag,
+    get_metadata,
+    make_etag,
+    mark_participants_changed,
     rate_limit,
     require_auth,
     validate_json_input,
@@ -38,10 +79,43 @@ class AvailabilityAddThrottle(AnonRateThrottle):
     scope = "availability_add"
 
 
+class AvailabilityUpdateThrottle(AnonRateThrottle):
+    scope = "availability_update"
+
+
 class InvalidTimeslotError(Exception):
     pass
 
 
+def publish_participant_change(
+    event_code,
+    event,
+    timeslots,
+    change_type,
+    display_name,
+    added,
+    removed,
+    previous_display_name=None,
+):
+    """
+    Publishes the timeslots a participant was added to and removed from, as indexes into
+    `timeslots`, to the event's availability stream.
+    """
+    renamed = previous_display_name and previous_display_name != display_name
+    if change_type == "participant_updated" and not (added or removed or renamed):
+        return
+
+    change = {
+        "type": change_type,
+        "display_name": display_name,
+        "added": get_timeslot_keys(event, timeslots, added),
+        "removed": get_timeslot_keys(event, timeslots, removed),
+    }
+    if renamed:
+        change["previous_display_name"] = previous_display_name
+    publish_availability_change(event_code, change)
+
+
 @api_endpoint("POST")
 @rate_limit(
     AvailabilityAddThrottle,
@@ -81,62 +155,56 @@ def add_availability(request):
                     status=400,
                 )
 
-            timeslots = get_timeslots(user_event)
-
-            participant, new = EventParticipant.objects.get_or_create(
+            # Locked so concurrent updates from the same user don't overwrite each other
+            participants = EventParticipant.objects.select_for_update()
+            participant, new = participants.get_or_create(
                 user_event=user_event,
                 user_account=user,
                 defaults={"time_zone": time_zone, "display_name": display_name},
             )
+            # Read after the lock, which an edit that moves the availability bitmaps to
+            # the new timeslots holds until it commits
+            timeslots = list(get_timeslots(user_event))
+            previous_display_name = participant.display_name
             if not new:
                 participant.time_zone = time_zone
                 participant.display_name = display_name
                 participant.save()
 
-            # Remove existing availability
-            if user_event.date_type == UserEvent.EventType.SPECIFIC:
-                EventDateAvailability.objects.filter(
-                    event_participant=participant
-                ).delete()
-            else:
-                EventWeekdayAvailability.objects.filter(
-                    event_participant=participant
-                ).delete()
-
-            # Add new availability
-            if user_event.date_type == UserEvent.EventType.SPECIFIC:
-                timeslot_dict = {t.utc_timeslot: t for t in timeslots}
-                new_availabilities = []
-                for timeslot in availability:
-                    if timeslot not in timeslot_dict:
-                        raise InvalidTimeslotError()
-                    new_availabilities.append(
-                        EventDateAvailability(
-                            event_participant=participant,
-                            event_date_timeslot=timeslot_dict[timeslot],
-                            status=AvailabilityStatus.AVAILABLE,
-                        )
-                    )
-                EventDateAvailability.objects.bulk_create(new_availabilities)
-            elif user_event.date_type == UserEvent.EventType.GENERIC:
-                timeslot_dict = {
-                    get_weekday_date(t.weekday, t.local_timeslot): t for t in timeslots
-                }
-                new_availabilities = []
-                for timeslot in availability:
-                    if timeslot not in timeslot_dict:
-                        raise InvalidTimeslotError()
-                    new_availabilities.append(
-                        EventWeekdayAvailability(
-                            event_participant=participant,
-                            event_weekday_timeslot=timeslot_dict[timeslot],
-                            status=AvailabilityStatus.AVAILABLE,
-                        )
-                    )
-                EventWeekdayAvailability.objects.bulk_create(new_availabilities)
+            timeslot_indexes = {
+                get_timeslot_datetime(user_event, t): i for i, t in enumerate(timeslots)
+            }
+            indexes = set()
+            for timeslot in availability:
+                if timeslot not in timeslot_indexes:
+                    raise InvalidTimeslotError()
+                indexes.add(timeslot_indexes[timeslot])
+            existing = (
+                set()
+                if new
+                else get_participant_timeslot_indexes(
+                    user_event, participant, timeslots
+                )
+            )
+            # Only the timeslots that changed are written
+            save_participant_timeslot_indexes(
+                user_event, participant, timeslots, indexes, existing=existing
+            )
 
             # Update participant updated_at
             participant.save()
+            invalidate_availability_snapshot(event_code)
+            publish_participant_change(
+                event_code,
+                user_event,
+                timeslots,
+                "participant_added" if new else "participant_updated",
+                display_name,
+                indexes - existing,
+                existing - indexes,
+                previous_display_name,
+            )
+        record_touch("url_code", event_code)
 
     except UserEvent.DoesNotExist:
         return Response(
@@ -170,11 +238,117 @@ def add_availability(request):
     )
 
 
+NOT_PARTICIPATED_ERROR = Response(
+    {"error": {"general": ["User has not participated in this event."]}},
+    status=400,
+)
+
+
+@api_endpoint("PATCH")
+@rate_limit(
+    AvailabilityUpdateThrottle,
+    "Availability update limit reached ({rate}). Try again later.",
+)
+@check_auth
+@validate_json_input(AvailabilityUpdateSerializer)
+@validate_output(MessageOutputSerializer)
+def update_availability(request):
+    """
+    Marks ranges of timeslots as available or unavailable for the current user, on top of
+    the availability they already submitted. This endpoint supports both types of events.
+
+    Each range covers the timeslots from "start" (inclusive) to "end" (exclusive), and its
+    "action" is either "add" or "remove". Ranges are applied in order. For 'week' events,
+    the dates are on the days of the week they represent.
+
+    An error will be returned if the user has not participated in the specified event, so
+    the first submission must still go through the "add" endpoint.
+    """
+    user = request.user
+    event_code = request.validated_data.get("event_code")
+    ranges = request.validated_data.get("ranges")
+
+    if not user:
+        return NOT_PARTICIPATED_ERROR
+
+    try:
+        with transaction.atomic():
+            event = UserEvent.objects.get(url_code=event_code)
+            # Locked so concurrent updates from the same user don't overwrite each other
+            participant = EventParticipant.objects.select_for_update().get(
+                user_event=event, user_account=user
+            )
+
+            timeslots = list(get_timeslots(event))
+            timeslot_datetimes = [get_timeslot_datetime(event, t) for t in timeslots]
+            existing = get_participant_timeslot_indexes(event, participant, timeslots)
+
+            indexes = set(existing)
+            for timeslot_range in ranges:
+                covered = range(
+                    bisect_left(timeslot_datetimes, timeslot_range["start"]),
+                    bisect_left(timeslot_datetimes, timeslot_range["end"]),
+                )
+                if not covered:
+                    raise InvalidTimeslotError()
+                if timeslot_range["action"] == "add":
+                    indexes.update(covered)
+                else:
+                    indexes.difference_update(covered)
+
+            # Nothing is written if the ranges didn't change the availability
+            if indexes != existing:
+                save_participant_timeslot_indexes(
+                    event, participant, timeslots, indexes, existing=existing
+                )
+                # Update participant updated_at
+                participant.save()
+                invalidate_availability_snapshot(event_code)
+                publish_participant_change(
+                    event_code,
+                    event,
+                    timeslots,
+                    "participant_updated",
+                    participant.display_name,
+                    indexes - existing,
+                    existing - indexes,
+                )
+        record_touch("url_code", event_code)
+
+    except UserEvent.DoesNotExist:
+        return Response(
+            {"error": {"event_code": ["Event not found."]}},
+            status=404,
+        )
+    except EventParticipant.DoesNotExist:
+        return NOT_PARTICIPATED_ERROR
+    except InvalidTimeslotError:
+        return Response(
+            {
+                "error": {
+                    "ranges": [
+                        "One or more ranges contain no timeslots, check if the event has been updated."
+                    ]
+                }
+            },
+            status=400,
+        )
+    except DatabaseError as e:
+        logger.db_error(e)
+        return GENERIC_ERR_RESPONSE
+    except Exception as e:
+        logger.error(e)
+        return GENERIC_ERR_RESPONSE
+
+    logger.debug(f"Availability updated for event with code: {event_code}")
+    return Response({"message": ["Availability updated successfully."]}, status=200)
+
+
 @api_endpoint("POST")
 @check_auth
 @validate_json_input(DisplayNameCheckSerializer)
 @validate_output(MessageOutputSerializer)
-def check_display_name(request):
+async def check_display_name(request):
     """
     Checks if a display name is available for an event.
 
@@ -188,8 +362,8 @@ def check_display_name(request):
     display_name = request.validated_data.get("display_name")
 
     try:
-        event = UserEvent.objects.get(url_code=event_code)
-        if check_name_available(event, user, display_name):
+        event = await UserEvent.objects.aget(url_code=event_code)
+        if await sync_to_async(check_name_available)(event, user, display_name):
             return Response(
                 {"message": ["Name is available."]},
                 status=200,
@@ -212,17 +386,29 @@ def check_display_name(request):
         return GENERIC_ERR_RESPONSE
 
 
-NOT_PARTICIPATED_ERROR = Response(
-    {"error": {"general": ["User has not participated in this event."]}},
-    status=400,
-)
+async def get_self_availability_etag(request):
+    if not request.user:
+        return None
+    # Timeslot edits can remove availability without changing the participant
+    version = (
+        await EventParticipant.objects.filter(
+            user_event__url_code=request.validated_data.get("event_code"),
+            user_account=request.user,
+        )
+        .values_list("pk", "updated_at", "user_event__updated_at")
+        .afirst()
+    )
+    if version is None:
+        return None
+    return make_etag("self_availability", *version)
 
 
 @api_endpoint("GET")
 @check_auth
 @validate_query_param_input(EventCodeSerializer)
+@etag(get_self_availability_etag)
 @validate_output(AvailableDatesSerializer)
-def get_self_availability(request):
+async def get_self_availability(request):
     """
     Gets the availability submitted by the current user, in the form of a list of dates
     that the user is available.
@@ -239,16 +425,25 @@ def get_self_availability(request):
         return NOT_PARTICIPATED_ERROR
 
     try:
-        event = UserEvent.objects.get(url_code=event_code)
-        participant = EventParticipant.objects.get(user_event=event, user_account=user)
+        event = await UserEvent.objects.aget(url_code=event_code)
+        participant = await EventParticipant.objects.aget(
+            user_event=event, user_account=user
+        )
 
-        if event.date_type == UserEvent.EventType.SPECIFIC:
+        if AVAILABILITY_BITMAP_STORAGE:
+            timeslots = [ts async for ts in get_timeslots(event)]
+            data = [
+                get_timeslot_datetime(event, timeslots[i])
+                for i in decode_bitmap(participant.availability_bitmap)
+                if i < len(timeslots)
+            ]
+        elif event.date_type == UserEvent.EventType.SPECIFIC:
             availabilities = (
                 EventDateAvailability.objects.filter(event_participant=participant)
                 .select_related("event_date_timeslot")
                 .order_by("event_date_timeslot__utc_timeslot")
             )
-            data = [a.event_date_timeslot.utc_timeslot for a in availabilities]
+            data = [a.event_date_timeslot.utc_timeslot async for a in availabilities]
         else:
             availabilities = (
                 EventWeekdayAvailability.objects.filter(event_participant=participant)
@@ -263,7 +458,7 @@ def get_self_availability(request):
                     a.event_weekday_timeslot.weekday,
                     a.event_weekday_timeslot.local_timeslot,
                 )
-                for a in availabilities
+                async for a in availabilities
             ]
 
         return Response(
@@ -290,11 +485,35 @@ def get_self_availability(request):
         return GENERIC_ERR_RESPONSE
 
 
+def get_all_availability_etag(request):
+    event_code = request.validated_data.get("event_code")
+    # Polling counts as using the code, even when nothing changed
+    record_touch("url_code", event_code)
+    version = get_availability_version(event_code)
+    if version is None:
+        return None
+    user = request.user
+    return make_etag(
+        "all_availability",
+        event_code,
+        version,
+        request.validated_data.get("encoding"),
+        user.pk if user else None,
+    )
+
+
 @api_endpoint("GET")
 @check_auth
-@validate_query_param_input(EventCodeSerializer)
-@validate_output(EventAvailabilitySerializer)
-def get_all_availability(request):
+@validate_query_param_input(EventAvailabilityQuerySerializer)
+@etag(get_all_availability_etag)
+@validate_output(
+    EventAvailabilitySerializer,
+    encodings={
+        "indexed": IndexedEventAvailabilitySerializer,
+        "compact": CompactEventAvailabilitySerializer,
+    },
+)
+async def get_all_availability(request):
     """
     Gets the availability submitted by all event participants.
 
@@ -304,103 +523,50 @@ def get_all_availability(request):
     The "user_display_name" field is the display name of the current user. If the user
     has not participated in the event, this will be null.
 
-    The "is_creator" field indicates whether the current user is the creator of the event.
+    With the "indexed" encoding, the values are arrays of indexes into "participants"
+    instead of display names.
+
+    With the "compact" encoding, timeslots are instead given as offsets from "start" in
+    units of "timeslot_minutes", grouped into [offset, length] runs. "timeslots" holds the
+    runs of the event's timeslots, and "availability" holds the runs each participant is
+    available for, in the same order as "participants". For an event without timeslots,
+    "start" is null.
+
+    The shared part of the response is cached per event until its availability or
+    timeslots change. Responses have an ETag, so unchanged availability can be polled
+    with If-None-Match.
     """
     user = request.user
     event_code = request.validated_data.get("event_code")
-
-    user_display_name = None
+    encoding = request.validated_data.get("encoding")
 
     try:
-        event = UserEvent.objects.get(url_code=event_code)
-        participants = event.participants.all().order_by("created_at")
-
-        # Prep the dictionary with empty arrays for the return value
-        availability_dict = {}
-        timeslots = get_timeslots(event)
-        if event.date_type == UserEvent.EventType.SPECIFIC:
-            for slot in timeslots:
-                availability_dict[slot.utc_timeslot.isoformat()] = []
-        else:
-            for slot in timeslots:
-                availability_dict[
-                    get_weekday_date(slot.weekday, slot.local_timeslot).isoformat()
-                ] = []
-
-        if not len(participants):
-            return Response(
-                {
-                    "user_display_name": user_display_name,
-                    "participants": [],
-                    "availability": availability_dict,
-                },
-                status=200,
-            )
-
-        # Check if the user is a participant to get their display name
-        # This checks after the empty participants check to avoid unnecessary queries
-        if user:
-            participant = participants.filter(user_account=user).first()
-            user_display_name = participant.display_name if participant else None
-
-        if event.date_type == UserEvent.EventType.SPECIFIC:
-            availabilities = (
-                EventDateAvailability.objects.filter(event_participant__in=participants)
-                .select_related("event_date_timeslot", "event_participant")
-                .order_by(
-                    "event_date_timeslot__utc_timeslot",
-                    "event_participant__display_name",
+        version, snapshot = await sync_to_async(get_availability_snapshot)(
+            event_code, encoding
+        )
+        if snapshot is None:
+            # Snapshots are cached under the current version, so they are built from the
+            # primary database in case the replica hasn't caught up to it yet
+            with read_from_primary():
+                event = await UserEvent.objects.aget(url_code=event_code)
+                snapshot = await sync_to_async(build_availability_snapshot)(
+                    event, encoding
                 )
-            )
-            for t in availabilities:
-                timeslot = t.event_date_timeslot.utc_timeslot.isoformat()
-                if timeslot not in availability_dict:
-                    logger.error(
-                        f"Timeslot {timeslot} not found in availability dict for event {event_code}"
-                    )
-                    continue
-                availability_dict[timeslot].append(t.event_participant.display_name)
-
-            return Response(
-                {
-                    "user_display_name": user_display_name,
-                    "participants": [p.display_name for p in participants],
-                    "availability": availability_dict,
-                },
-                status=200,
+            await sync_to_async(set_availability_snapshot)(
+                event_code, version, snapshot, encoding
             )
         else:
-            availabilities = (
-                EventWeekdayAvailability.objects.filter(
-                    event_participant__in=participants
-                )
-                .select_related("event_weekday_timeslot", "event_participant")
-                .order_by(
-                    "event_weekday_timeslot__weekday",
-                    "event_weekday_timeslot__local_timeslot",
-                    "event_participant__display_name",
-                )
-            )
-            for t in availabilities:
-                timeslot = get_weekday_date(
-                    t.event_weekday_timeslot.weekday,
-                    t.event_weekday_timeslot.local_timeslot,
-                ).isoformat()
-                if timeslot not in availability_dict:
-                    logger.error(
-                        f"Timeslot {timeslot} not found in availability dict for event {event_code}"
-                    )
-                    continue
-                availability_dict[timeslot].append(t.event_participant.display_name)
+            logger.debug(f"Availability snapshot hit for event with code: {event_code}")
 
-            return Response(
-                {
-                    "user_display_name": user_display_name,
-                    "participants": [p.display_name for p in participants],
-                    "availability": availability_dict,
-                },
-                status=200,
-            )
+        return Response(
+            {
+                "user_display_name": (
+                    snapshot["display_names"].get(user.pk) if user else None
+                ),
+                **snapshot["data"],
+            },
+            status=200,
+        )
 
     except UserEvent.DoesNotExist:
         return Response(
@@ -433,8 +599,15 @@ def remove_self_availability(request):
 
     try:
         event = UserEvent.objects.get(url_code=event_code)
+        participant = EventParticipant.objects.get(user_event=event, user_account=user)
         # Because of the foreign key cascades, this should remove everything
-        EventParticipant.objects.get(user_event=event, user_account=user).delete()
+        participant.delete()
+        mark_participants_changed([event.pk])
+        invalidate_availability_snapshot(event_code)
+        publish_availability_change(
+            event_code,
+            {"type": "participant_removed", "display_name": participant.display_name},
+        )
 
     except UserEvent.DoesNotExist:
         return Response(
@@ -482,6 +655,11 @@ def remove_availability(request):
         EventParticipant.objects.get(
             user_event=event, display_name=display_name
         ).delete()
+        mark_participants_changed([event.pk])
+        invalidate_availability_snapshot(event_code)
+        publish_availability_change(
+            event_code, {"type": "participant_removed", "display_name": display_name}
+        )
 
     except UserEvent.DoesNotExist:
         return Response(
@@ -501,3 +679,91 @@ def remove_availability(request):
         return GENERIC_ERR_RESPONSE
 
     return Response({"message": ["Availability removed successfully."]}, status=200)
+
+
+# How long clients wait before reconnecting to an availability stream
+AVAILABILITY_STREAM_RETRY_MILLISECONDS = 3000
+
+
+async def iter_availability_stream(event_code):
+    # Clients reconnect on their own if the stream ends or the connection drops
+    yield f"retry: {AVAILABILITY_STREAM_RETRY_MILLISECONDS}\n\n"
+    deadline = time.monotonic() + AVAILABILITY_STREAM_MAX_SECONDS
+    changes = listen_for_availability_changes(
+        event_code, AVAILABILITY_STREAM_KEEPALIVE_SECONDS
+    )
+    async with aclosing(changes):
+        async for change in changes:
+            if change is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {change['type']}\ndata: {json.dumps(change)}\n\n"
+            if time.monotonic() >= deadline:
+                break
+
+
+@require_GET
+async def stream_availability(request):
+    """
+    Streams changes to an event's availability as server-sent events, so clients don't
+    have to poll the "get-all" endpoint. Clients should load the full availability first,
+    then apply each change as it arrives.
+
+    Each event's type is its "type" field, and its data is a JSON object with it:
+    - "participant_added" and "participant_updated" have the participant's
+      "display_name", and the timeslots they were "added" to and "removed" from (in the
+      same format as the "get-all" keys). A renamed participant also has its
+      "previous_display_name".
+    - "participant_removed" has the "display_name" of the removed participant.
+    - "timeslots_updated" is sent when the event's timeslots are edited, and the full
+      availability should be loaded again.
+    - "event_deleted" is sent when the event is removed by the daily cleanup.
+
+    The stream is closed after a while, and clients should reconnect.
+
+    Streams are only available when the API is served through ASGI. Otherwise, this
+    returns a 501 and clients should poll the "get-all" endpoint instead.
+    """
+    if not isinstance(request, ASGIRequest):
+        # Under WSGI, Django reads the whole stream before sending any of it
+        return JsonResponse(
+            {
+                "error": {
+                    "general": [
+                        "Availability streams are only available when the API is served through ASGI."
+                    ]
+                }
+            },
+            status=501,
+        )
+
+    serializer = EventCodeSerializer(data=request.GET.dict())
+    if not serializer.is_valid():
+        return JsonResponse({"error": serializer.errors}, status=400)
+    event_code = serializer.validated_data.get("event_code")
+
+    try:
+        if not await UrlCode.objects.filter(url_code=event_code).aexists():
+            return JsonResponse(
+                {"error": {"event_code": ["Event not found."]}}, status=404
+            )
+        await sync_to_async(record_touch)("url_code", event_code)
+    except DatabaseError as e:
+        logger.db_error(e)
+        return JsonResponse(GENERIC_ERR_RESPONSE.data, status=500)
+
+    response = StreamingHttpResponse(
+        iter_availability_stream(event_code), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    # Stops nginx from buffering the events
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+# Not an `api_endpoint`, since its response is streamed instead of rendered from a DRF
+# `Response`, so its documentation is filled in here
+stream_metadata = get_metadata(stream_availability)
+stream_metadata.method = "GET"
+stream_metadata.input_type = "Query Parameters"
+stream_metadata.input_serializer_class = EventCodeSerializer
@@ -1,24 +1,25 @@
 import logging
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
 from zoneinfo import ZoneInfo
 
+from asgiref.sync import sync_to_async
 from django.db import DatabaseError
-from django.db.models import Prefetch, Q
+from django.db.models import Count, Exists, Max, OuterRef, Q, prefetch_related_objects
 from rest_framework import serializers
 from rest_framework.response import Response
 
-from api.models import (
-    EventDateTimeslot,
-    EventParticipant,
-    EventWeekdayTimeslot,
-    UserEvent,
-)
-from api.settings import GENERIC_ERR_RESPONSE
+from api.models import EventParticipant, UserEvent
+from api.settings import DASHBOARD_MAX_PAGE_SIZE, GENERIC_ERR_RESPONSE
 from api.utils import (
     TimeZoneField,
     api_endpoint,
     check_auth,
+    etag,
     format_event_info,
+    make_etag,
     validate_output,
+    validate_query_param_input,
 )
 
 logger = logging.getLogger("api")
@@ -39,6 +40,36 @@ class DashboardEventSerializer(serializers.Serializer):
     event_code = serializers.CharField(required=True, max_length=255)
 
 
+class EventCursorField(serializers.CharField):
+    """
+    An opaque pagination cursor, decoded to the `(created_at, user_event_id)` of the last
+    event on the previous page.
+    """
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        try:
+            created_at, event_id = urlsafe_b64decode(value).decode().split("|")
+            return datetime.fromisoformat(created_at), int(event_id)
+        except (ValueError, UnicodeDecodeError):
+            raise serializers.ValidationError("Invalid cursor.")
+
+
+def encode_cursor(event: UserEvent) -> str:
+    return urlsafe_b64encode(
+        f"{event.created_at.isoformat()}|{event.pk}".encode()
+    ).decode()
+
+
+class DashboardQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(
+        required=False, min_value=1, max_value=DASHBOARD_MAX_PAGE_SIZE
+    )
+    created_cursor = EventCursorField(required=False)
+    participated_cursor = EventCursorField(required=False)
+    updated_since = serializers.DateTimeField(required=False)
+
+
 class DashboardSerializer(serializers.Serializer):
     created_events = serializers.ListField(
         child=DashboardEventSerializer(), required=True
@@ -46,12 +77,83 @@ class DashboardSerializer(serializers.Serializer):
     participated_events = serializers.ListField(
         child=DashboardEventSerializer(), required=True
     )
+    next_created_cursor = serializers.CharField(required=True, allow_null=True)
+    next_participated_cursor = serializers.CharField(required=True, allow_null=True)
+
+
+async def get_page(events, cursor, limit):
+    """
+    Returns a page of events in creation order, starting after the cursor if given, and
+    the cursor for the next page (or `None` if there are no more events).
+
+    Without a limit, all remaining events are returned.
+    """
+    events = events.order_by("created_at", "user_event_id")
+    if cursor:
+        created_at, event_id = cursor
+        events = events.filter(
+            Q(created_at__gt=created_at)
+            | Q(created_at=created_at, user_event_id__gt=event_id)
+        )
+    if limit is None:
+        return [event async for event in events], None
+
+    page = [event async for event in events[: limit + 1]]
+    if len(page) > limit:
+        return page[:limit], encode_cursor(page[limit - 1])
+    return page, None
+
+
+async def get_participant_names(events: list[UserEvent]) -> dict[int, list[str]]:
+    """
+    Returns the display names of each event's participants by event ID, in the order
+    they joined, with a single query.
+    """
+    names = {event.pk: [] for event in events}
+    rows = (
+        EventParticipant.objects.filter(user_event__in=names.keys())
+        .order_by("created_at")
+        .values_list("user_event_id", "display_name")
+    )
+    async for event_id, display_name in rows:
+        names[event_id].append(display_name)
+    return names
+
+
+async def get_dashboard_etag(request):
+    user = request.user
+    if not user:
+        return None
+    # Removed participants bump the event's updated_at, and removed events change the
+    # count, so this covers everything shown on the dashboard
+    events = UserEvent.objects.filter(
+        Q(user_account=user)
+        | Q(
+            pk__in=EventParticipant.objects.filter(user_account=user).values(
+                "user_event_id"
+            )
+        ),
+        url_code__isnull=False,
+    )
+    version = await events.aaggregate(
+        count=Count("pk", distinct=True),
+        events_updated=Max("updated_at"),
+        participants_updated=Max("participants__updated_at"),
+    )
+    return make_etag(
+        "dashboard",
+        user.pk,
+        *version.values(),
+        *sorted(request.validated_data.items()),
+    )
 
 
 @api_endpoint("GET")
 @check_auth
+@validate_query_param_input(DashboardQuerySerializer)
+@etag(get_dashboard_etag)
 @validate_output(DashboardSerializer)
-def get_dashboard(request):
+async def get_dashboard(request):
     """
     Returns dashboard data for the current user. This includes events that the user
     created and ones that the user participated in.
@@ -59,76 +161,84 @@ def get_dashboard(request):
     The events are sorted by their creation date.
 
     Events that no longer have a URL code from inactivity will not be included.
+
+    If a "limit" is given, each list is paginated to that many events. The next page of
+    each list is requested by passing "next_created_cursor" or "next_participated_cursor"
+    from the response as "created_cursor" or "participated_cursor". The next cursor is
+    null on the last page.
+
+    With "updated_since", only events whose details or participants changed after that
+    time are returned. Events that were removed in the meantime are not reported.
     """
     user = request.user
+    limit = request.validated_data.get("limit")
+    created_cursor = request.validated_data.get("created_cursor")
+    participated_cursor = request.validated_data.get("participated_cursor")
+    updated_since = request.validated_data.get("updated_since")
 
     if not user:
         return Response(
             {
                 "created_events": [],
                 "participated_events": [],
+                "next_created_cursor": None,
+                "next_participated_cursor": None,
             },
             status=200,
         )
 
     try:
-        created_events = (
-            UserEvent.objects.filter(user_account=user, url_code__isnull=False)
-            .order_by("created_at")
-            .select_related("url_code")
-            .prefetch_related(
-                Prefetch(
-                    "date_timeslots",
-                    queryset=EventDateTimeslot.objects.order_by("utc_timeslot"),
-                ),
-                Prefetch(
-                    "weekday_timeslots",
-                    queryset=EventWeekdayTimeslot.objects.order_by(
-                        "weekday", "local_timeslot"
-                    ),
-                ),
-                Prefetch(
-                    "participants",
-                    queryset=EventParticipant.objects.order_by("created_at"),
-                ),
-            )
+        created_events = UserEvent.objects.filter(
+            user_account=user, url_code__isnull=False
         )
         # Don't include events that the user both created and participated in
-        participations = (
-            EventParticipant.objects.filter(
-                ~Q(user_event__user_account=user),
-                user_account=user,
-                user_event__url_code__isnull=False,
-            )
-            .order_by("user_event__created_at")
-            .select_related("user_event__url_code")
-            .prefetch_related(
-                Prefetch(
-                    "user_event__date_timeslots",
-                    queryset=EventDateTimeslot.objects.order_by("utc_timeslot"),
-                ),
-                Prefetch(
-                    "user_event__weekday_timeslots",
-                    queryset=EventWeekdayTimeslot.objects.order_by(
-                        "weekday", "local_timeslot"
-                    ),
-                ),
-                Prefetch(
-                    "user_event__participants",
-                    queryset=EventParticipant.objects.order_by("created_at"),
-                ),
+        participated_events = UserEvent.objects.filter(
+            ~Q(user_account=user),
+            participants__user_account=user,
+            url_code__isnull=False,
+        )
+        if updated_since:
+            changed = Q(updated_at__gt=updated_since) | Q(
+                Exists(
+                    EventParticipant.objects.filter(
+                        user_event=OuterRef("pk"), updated_at__gt=updated_since
+                    )
+                )
             )
+            created_events = created_events.filter(changed)
+            participated_events = participated_events.filter(changed)
+
+        created_events, next_created_cursor = await get_page(
+            created_events.select_related("url_code"), created_cursor, limit
+        )
+        participated_events, next_participated_cursor = await get_page(
+            participated_events.select_related("url_code"), participated_cursor, limit
+        )
+        participant_names = await get_participant_names(
+            created_events + participated_events
         )
 
-        my_events = []
-        for event in created_events:
-            my_events.append(format_event_info(event, include_participants=True))
-        their_events = []
-        for event in participations:
-            their_events.append(
-                format_event_info(event.user_event, include_participants=True)
+        # Events from before bounds were stored have them calculated from their
+        # timeslots, without saving them (see the backfill_event_bounds command)
+        missing_bounds = [
+            event
+            for event in created_events + participated_events
+            if event.start_date is None
+        ]
+        if missing_bounds:
+            await sync_to_async(prefetch_related_objects)(
+                missing_bounds, "date_timeslots", "weekday_timeslots"
             )
 
+        my_events = [
+            format_event_info(event, participant_names[event.pk])
+            for event in created_events
+        ]
+        their_events = [
+            format_event_info(event, participant_names[event.pk])
+            for event in participated_events
+        ]
+
     except DatabaseError as e:
         logger.db_error(e)
         return GENERIC_ERR_RESPONSE
@@ -137,5 +247,11 @@ def get_dashboard(request):
         return GENERIC_ERR_RESPONSE
 
     return Response(
-        {"created_events": my_events, "participated_events": their_events}, status=200
+        {
+            "created_events": my_events,
+            "participated_events": their_events,
+            "next_created_cursor": next_created_cursor,
+            "next_participated_cursor": next_participated_cursor,
+        },
+        status=200,
     )
@@ -1,6 +1,9 @@
 import copy
 
 from django.urls import get_resolver
+from rest_framework import serializers
+
+from api.utils import TimeslotListField
 
 
 def get_endpoints(urlpatterns, prefix=""):
@@ -48,9 +51,29 @@ def get_readable_field_name(field_name):
             return "object"
 
 
+def get_field_type_name(field):
+    """
+    Returns the standard data type of a field, using the closest built-in field class for
+    custom fields.
+    """
+    for cls in type(field).__mro__:
+        readable = get_readable_field_name(cls.__name__)
+        if readable != "object":
+            return readable
+    return "object"
+
+
 def get_field_info(field, include_required):
     data = {}
-    if field.__class__.__name__ == "ListField":
+    if isinstance(field, TimeslotListField):
+        # Described like a list of `DateTimeField`s, which it replaces
+        data = {
+            "type": "array",
+            "items": get_field_info(serializers.DateTimeField(), include_required),
+        }
+        if include_required:
+            data["required"] = field.required
+    elif isinstance(field, serializers.ListField):
         child = field.child
         data = {
             "type": "array",
@@ -58,7 +81,7 @@ def get_field_info(field, include_required):
         }
         if include_required:
             data["required"] = field.required
-    elif field.__class__.__name__ == "DictField":
+    elif isinstance(field, serializers.DictField):
         data = {
             "type": "map",
             "key": "string",
@@ -66,10 +89,7 @@ def get_field_info(field, include_required):
         }
         if include_required:
             data["required"] = field.required
-    elif (
-        get_readable_field_name(field.__class__.__name__) == "object"
-        and field.__class__.__name__ != "JSONField"
-    ):
+    elif isinstance(field, serializers.BaseSerializer):
         # This is only for nested serializers
         data = {
             "type": "object",
@@ -79,7 +99,7 @@ def get_field_info(field, include_required):
         }
     else:
         data = {
-            "type": get_readable_field_name(field.__class__.__name__),
+            "type": get_field_type_name(field),
         }
         if include_required:
             data["required"] = field.required
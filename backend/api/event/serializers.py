@@ -1,6 +1,6 @@
 from rest_framework import serializers
 
-from api.utils import TimeZoneField
+from api.utils import TimeslotListField, TimeZoneField
 
 
 # Defining an object-oriented inheritance structure of serializers for DRY
@@ -15,9 +15,7 @@ class EventCodeSerializer(serializers.Serializer):
 class EventInfoSerializer(serializers.Serializer):
     title = serializers.CharField(required=True, max_length=50)
     duration = serializers.IntegerField(required=False)
-    timeslots = serializers.ListField(
-        child=serializers.DateTimeField(), required=True, allow_empty=False
-    )
+    timeslots = TimeslotListField(required=True, allow_empty=False)
     time_zone = TimeZoneField(required=True)
 
     def validate(self, attrs):
@@ -63,17 +63,6 @@ def generate_code():
     raise Exception("Failed to generate a unique URL code.")
 
 
-def check_timeslot_times(timeslots):
-    for timeslot in timeslots:
-        if (
-            timeslot.minute % 15 != 0
-            or timeslot.second != 0
-            or timeslot.microsecond != 0
-        ):
-            return False
-    return True
-
-
 def validate_date_timeslots(
     timeslots: list[datetime],
     earliest_date_local: datetime.date,
@@ -112,37 +101,37 @@ def validate_date_timeslots(
     if (end_date - start_date).days > MAX_EVENT_DAYS:
         add_error(f"Max event length is {MAX_EVENT_DAYS} days.")
 
-    if not check_timeslot_times(timeslots):
-        add_error("Timeslots must be on 15-minute intervals.")
-
     return errors
 
 
 def validate_weekday_timeslots(timeslots):
     if not timeslots:
         return {"timeslots": ["At least one timeslot is required."]}
-
-    if not check_timeslot_times(timeslots):
-        return {"timeslots": ["Timeslots must be on 15-minute intervals."]}
     return {}
 
 
-def event_lookup(event_code: str):
+async def event_lookup(event_code: str):
     """
     Looks up an event by its URL code.
 
-    Also prefetches related timeslot data for efficiency.
+    Also fetches its URL code and prefetches related timeslot data for efficiency.
     """
-    return UserEvent.objects.prefetch_related(
-        Prefetch(
-            "date_timeslots",
-            queryset=EventDateTimeslot.objects.order_by("utc_timeslot"),
-        ),
-        Prefetch(
-            "weekday_timeslots",
-            queryset=EventWeekdayTimeslot.objects.order_by("weekday", "local_timeslot"),
-        ),
-    ).get(url_code=event_code)
+    return (
+        await UserEvent.objects.select_related("url_code")
+        .prefetch_related(
+            Prefetch(
+                "date_timeslots",
+                queryset=EventDateTimeslot.objects.order_by("utc_timeslot"),
+            ),
+            Prefetch(
+                "weekday_timeslots",
+                queryset=EventWeekdayTimeslot.objects.order_by(
+                    "weekday", "local_timeslot"
+                ),
+            ),
+        )
+        .aget(url_code=event_code)
+    )
 
 
 def js_weekday(weekday: int) -> int:
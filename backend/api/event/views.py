@@ -2,12 +2,18 @@ import logging
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
+from asgiref.sync import sync_to_async
 from django.db import DatabaseError, transaction
 from django.db.models import Q
 from rest_framework.response import Response
 from rest_framework.throttling import AnonRateThrottle
 
-from api.availability.utils import get_weekday_date
+from api.availability.live import publish_availability_change
+from api.availability.utils import (
+    get_weekday_date,
+    invalidate_availability_snapshot,
+    remap_availability_bitmaps,
+)
 from api.event.serializers import (
     CustomCodeSerializer,
     DateEventCreateSerializer,
@@ -26,14 +32,18 @@ from api.event.utils import (
     validate_weekday_timeslots,
 )
 from api.models import EventDateTimeslot, EventWeekdayTimeslot, UrlCode, UserEvent
-from api.settings import GENERIC_ERR_RESPONSE
+from api.settings import AVAILABILITY_BITMAP_STORAGE, GENERIC_ERR_RESPONSE
+from api.touches import record_touch
 from api.utils import (
     MessageOutputSerializer,
     api_endpoint,
     check_auth,
+    etag,
     format_event_info,
+    make_etag,
     rate_limit,
     require_auth,
+    update_event_bounds,
     validate_json_input,
     validate_output,
     validate_query_param_input,
@@ -110,6 +120,8 @@ def create_date_event(request):
                 time_zone=time_zone,
             )
             UrlCode.objects.create(url_code=url_code, user_event=new_event)
+            # In case the code was used by a deleted event with a cached snapshot
+            invalidate_availability_snapshot(url_code)
             # Create timeslot objects
             EventDateTimeslot.objects.bulk_create(
                 [
@@ -117,6 +129,7 @@ def create_date_event(request):
                     for ts in set(timeslots)
                 ]
             )
+            update_event_bounds(new_event)
     except DatabaseError as e:
         logger.db_error(e)
         return GENERIC_ERR_RESPONSE
@@ -183,6 +196,8 @@ def create_week_event(request):
                 time_zone=time_zone,
             )
             UrlCode.objects.create(url_code=url_code, user_event=new_event)
+            # In case the code was used by a deleted event with a cached snapshot
+            invalidate_availability_snapshot(url_code)
             # Create timeslot objects
             deduplicated_timeslots = set(
                 (js_weekday(ts.weekday()), ts.time()) for ts in timeslots
@@ -197,6 +212,7 @@ def create_week_event(request):
                     for (weekday, time) in deduplicated_timeslots
                 ]
             )
+            update_event_bounds(new_event)
     except DatabaseError as e:
         logger.db_error(e)
         return GENERIC_ERR_RESPONSE
@@ -211,7 +227,7 @@ def create_week_event(request):
 @api_endpoint("POST")
 @validate_json_input(CustomCodeSerializer)
 @validate_output(MessageOutputSerializer)
-def check_code(request):
+async def check_code(request):
     """
     Checks if a custom code is valid and available, and returns an error if not.
 
@@ -219,7 +235,11 @@ def check_code(request):
     creating an event will count for the rate limit.
     """
     custom_code = request.validated_data.get("custom_code")
-    error = check_custom_code(custom_code)
+    try:
+        error = await sync_to_async(check_custom_code)(custom_code)
+    except DatabaseError as e:
+        logger.db_error(e)
+        return GENERIC_ERR_RESPONSE
     if error:
         return Response({"error": {"custom_code": [error]}}, status=400)
 
@@ -298,6 +318,7 @@ def edit_date_event(request):
                     "utc_timeslot", flat=True
                 )
             )
+            old_timeslots = sorted(existing_timeslots)
             edited_timeslots = set(timeslots)
             to_delete = existing_timeslots - edited_timeslots
             to_add = [
@@ -308,6 +329,12 @@ def edit_date_event(request):
                 user_event=event, utc_timeslot__in=to_delete
             ).delete()
             EventDateTimeslot.objects.bulk_create(to_add)
+            update_event_bounds(event)
+
+            if AVAILABILITY_BITMAP_STORAGE:
+                remap_availability_bitmaps(event, old_timeslots)
+            invalidate_availability_snapshot(event_code)
+            publish_availability_change(event_code, {"type": "timeslots_updated"})
 
     except UserEvent.DoesNotExist:
         return EVENT_NOT_FOUND_ERROR
@@ -368,6 +395,9 @@ def edit_week_event(request):
                     "weekday", "local_timeslot"
                 )
             )
+            old_timeslots = [
+                get_weekday_date(wd, ts) for (wd, ts) in sorted(existing_timeslots)
+            ]
             edited_timeslots = set(
                 [(js_weekday(ts.weekday()), ts.time()) for ts in timeslots]
             )
@@ -385,6 +415,12 @@ def edit_week_event(request):
                 EventWeekdayTimeslot.objects.filter(query).delete()
 
             EventWeekdayTimeslot.objects.bulk_create(to_add)
+            update_event_bounds(event)
+
+            if AVAILABILITY_BITMAP_STORAGE:
+                remap_availability_bitmaps(event, old_timeslots)
+            invalidate_availability_snapshot(event_code)
+            publish_availability_change(event_code, {"type": "timeslots_updated"})
 
     except UserEvent.DoesNotExist:
         return EVENT_NOT_FOUND_ERROR
@@ -399,11 +435,28 @@ def edit_week_event(request):
     return Response({"message": ["Event updated successfully."]}, status=200)
 
 
+async def get_event_details_etag(request):
+    event_code = request.validated_data.get("event_code")
+    version = (
+        await UserEvent.objects.filter(url_code=event_code)
+        .values_list("pk", "updated_at", "user_account_id")
+        .afirst()
+    )
+    if version is None:
+        return None
+    # Viewing counts as using the code, even when nothing changed
+    await sync_to_async(record_touch)("url_code", event_code)
+    event_id, updated_at, creator_id = version
+    is_creator = request.user is not None and request.user.pk == creator_id
+    return make_etag("event_details", event_id, updated_at, is_creator)
+
+
 @api_endpoint("GET")
 @check_auth
 @validate_query_param_input(EventCodeSerializer)
+@etag(get_event_details_etag)
 @validate_output(EventDetailSerializer)
-def get_event_details(request):
+async def get_event_details(request):
     """
     Gets details about an event like title, duration, and timeslots.
 
@@ -413,7 +466,7 @@ def get_event_details(request):
     event_code = request.validated_data.get("event_code")
 
     try:
-        event = event_lookup(event_code)
+        event = await event_lookup(event_code)
         data = format_event_info(event)
         match event.date_type:
             case UserEvent.EventType.SPECIFIC:
@@ -439,7 +492,7 @@ def get_event_details(request):
     return Response(
         {
             **data,
-            "is_creator": event.user_account == user,
+            "is_creator": user is not None and event.user_account_id == user.pk,
         },
         status=200,
     )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from api.models import UserEvent
+from api.utils import update_event_bounds
+
+
+class Command(BaseCommand):
+    help = (
+        "Calculates and stores the date/time bounds of events created before they were "
+        "stored on the event."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="Recalculate the bounds of every event, not just those missing them.",
+        )
+
+    def handle(self, *args, **options):
+        events = UserEvent.objects.all()
+        if not options["all"]:
+            events = events.filter(start_date__isnull=True)
+
+        updated = 0
+        for event in events.iterator():
+            try:
+                update_event_bounds(event)
+            except ValueError:
+                self.stdout.write(
+                    self.style.WARNING(f"Skipped event {event.pk} with no timeslots.")
+                )
+                continue
+            updated += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Stored bounds for {updated} events."))
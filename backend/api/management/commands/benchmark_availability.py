@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.availability.utils import AGGREGATION_ENGINES, get_timeslots
+from api.models import UserEvent
+from api.settings import AVAILABILITY_BITMAP_STORAGE
+
+
+class Command(BaseCommand):
+    help = (
+        "Times each availability aggregation engine against an existing event. Nothing "
+        "is written to the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("event_code", help="The URL code of the event to use.")
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=20,
+            help="How many times to run each engine.",
+        )
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        try:
+            event = UserEvent.objects.get(url_code=options["event_code"])
+        except UserEvent.DoesNotExist:
+            raise CommandError("Event not found.")
+
+        participants = list(event.participants.all().order_by("created_at"))
+        timeslots = list(get_timeslots(event))
+        self.stdout.write(
+            f"{len(participants)} participants, {len(timeslots)} timeslots, "
+            f"{iterations} iterations"
+        )
+
+        engines = AGGREGATION_ENGINES
+        if AVAILABILITY_BITMAP_STORAGE:
+            # The loop engine can only read row storage
+            engines = {"array": AGGREGATION_ENGINES["array"]}
+
+        timings = {}
+        results = {}
+        for name, engine in engines.items():
+            start = time.perf_counter()
+            for _ in range(iterations):
+                results[name] = engine(event, participants, timeslots)
+            timings[name] = (time.perf_counter() - start) / iterations
+            self.stdout.write(f"{name:<8} {timings[name] * 1000:>10.2f} ms/call")
+
+        if "loop" in timings:
+            self.stdout.write(f"Speedup: {timings['loop'] / timings['array']:.1f}x")
+            if results["loop"] == results["array"]:
+                self.stdout.write(self.style.SUCCESS("Engine outputs match."))
+            else:
+                self.stdout.write(self.style.WARNING("Engine outputs differ."))
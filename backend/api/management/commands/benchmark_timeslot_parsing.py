@@ -0,0 +1,57 @@
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+
+from api.utils import TimeslotListField
+
+
+class Command(BaseCommand):
+    help = (
+        "Times parsing a list of timeslots with the bulk timeslot field against a "
+        "DRF ListField of DateTimeFields."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--timeslots",
+            type=int,
+            # 30 days of 15-minute timeslots
+            default=2880,
+            help="How many timeslots to parse.",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=50,
+            help="How many times to run each field.",
+        )
+
+    def handle(self, *args, **options):
+        iterations = options["iterations"]
+        start = datetime(2030, 1, 1)
+        data = [
+            (start + timedelta(minutes=15 * i)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            for i in range(options["timeslots"])
+        ]
+        self.stdout.write(f"{len(data)} timeslots, {iterations} iterations")
+
+        fields = {
+            "list": serializers.ListField(child=serializers.DateTimeField()),
+            "bulk": TimeslotListField(),
+        }
+        timings = {}
+        results = {}
+        for name, field in fields.items():
+            start_time = time.perf_counter()
+            for _ in range(iterations):
+                results[name] = field.run_validation(data)
+            timings[name] = (time.perf_counter() - start_time) / iterations
+            self.stdout.write(f"{name:<8} {timings[name] * 1000:>10.2f} ms/call")
+
+        self.stdout.write(f"Speedup: {timings['list'] / timings['bulk']:.1f}x")
+        if results["list"] == results["bulk"]:
+            self.stdout.write(self.style.SUCCESS("Field outputs match."))
+        else:
+            self.stdout.write(self.style.WARNING("Field outputs differ."))
@@ -0,0 +1,110 @@
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.availability.utils import (
+    decode_bitmap,
+    encode_bitmap,
+    get_availability_model,
+    get_timeslots,
+)
+from api.models import AvailabilityStatus, EventParticipant, UserEvent
+
+
+class Command(BaseCommand):
+    help = (
+        "Converts stored availability between one row per timeslot and one bitmap per "
+        "participant. Run this after changing AVAILABILITY_BITMAP_STORAGE."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "target",
+            choices=["bitmap", "rows"],
+            help="The storage format to convert existing availability to.",
+        )
+        parser.add_argument(
+            "--keep-source",
+            action="store_true",
+            help="Keep the data in the old format instead of removing it.",
+        )
+
+    def handle(self, *args, **options):
+        to_bitmap = options["target"] == "bitmap"
+        keep_source = options["keep_source"]
+
+        events = UserEvent.objects.filter(participants__isnull=False).distinct()
+        event_count = 0
+        participant_count = 0
+        for event in events.iterator():
+            # Each event is converted in its own transaction to keep locks short
+            with transaction.atomic():
+                if to_bitmap:
+                    participant_count += self.convert_to_bitmap(event, keep_source)
+                else:
+                    participant_count += self.convert_to_rows(event, keep_source)
+            event_count += 1
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Converted {participant_count} participants in {event_count} events "
+                f"to {options['target']} storage."
+            )
+        )
+
+    def convert_to_bitmap(self, event, keep_source):
+        model, timeslot_field = get_availability_model(event)
+        timeslot_ids = list(get_timeslots(event).values_list("pk", flat=True))
+        timeslot_indexes = {pk: i for i, pk in enumerate(timeslot_ids)}
+
+        participant_indexes = defaultdict(list)
+        rows = model.objects.filter(event_participant__user_event=event).values_list(
+            "event_participant_id", timeslot_field
+        )
+        for participant_id, timeslot_id in rows:
+            participant_indexes[participant_id].append(timeslot_indexes[timeslot_id])
+
+        participants = list(
+            EventParticipant.objects.filter(user_event=event).only(
+                "event_participant_id"
+            )
+        )
+        for participant in participants:
+            participant.availability_bitmap = encode_bitmap(
+                participant_indexes[participant.pk], len(timeslot_ids)
+            )
+        EventParticipant.objects.bulk_update(participants, ["availability_bitmap"])
+
+        if not keep_source:
+            model.objects.filter(event_participant__user_event=event).delete()
+        return len(participants)
+
+    def convert_to_rows(self, event, keep_source):
+        model, timeslot_field = get_availability_model(event)
+        timeslot_ids = list(get_timeslots(event).values_list("pk", flat=True))
+
+        participants = list(
+            EventParticipant.objects.filter(
+                user_event=event, availability_bitmap__isnull=False
+            ).only("event_participant_id", "availability_bitmap")
+        )
+        new_availabilities = []
+        for participant in participants:
+            for i in decode_bitmap(participant.availability_bitmap):
+                if i >= len(timeslot_ids):
+                    break
+                new_availabilities.append(
+                    model(
+                        event_participant_id=participant.pk,
+                        status=AvailabilityStatus.AVAILABLE,
+                        **{timeslot_field: timeslot_ids[i]},
+                    )
+                )
+        model.objects.bulk_create(new_availabilities, ignore_conflicts=True)
+
+        if not keep_source:
+            for participant in participants:
+                participant.availability_bitmap = None
+            EventParticipant.objects.bulk_update(participants, ["availability_bitmap"])
+        return len(participants)
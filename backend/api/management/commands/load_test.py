@@ -0,0 +1,154 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# How long to wait for a started server to answer requests
+SERVER_START_SECONDS = 30
+
+
+def send_request(url):
+    """
+    Sends a GET request and returns its status code, or `None` if it failed.
+    """
+    try:
+        with urllib.request.urlopen(url, timeout=10) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return None
+
+
+def run_client(url, deadline):
+    latencies = []
+    statuses = []
+    while time.monotonic() < deadline:
+        start_time = time.perf_counter()
+        statuses.append(send_request(url))
+        latencies.append(time.perf_counter() - start_time)
+    return latencies, statuses
+
+
+def get_percentile(values, percentile):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percentile / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures the throughput of an endpoint with the production Gunicorn "
+        "configuration, once for every given number of workers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            help='The path to request, like "/event/get-details/?event_code=abc".',
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            nargs="+",
+            default=[1, 2, 4],
+            help="The numbers of workers to measure.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=16,
+            help="How many requests are sent at the same time.",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=10,
+            help="How many seconds to send requests for each number of workers.",
+        )
+        parser.add_argument(
+            "--port",
+            type=int,
+            default=8100,
+            help="The port to run the server on.",
+        )
+        parser.add_argument(
+            "--worker-class",
+            help="The Gunicorn worker class, if not the one in gunicorn.conf.py.",
+        )
+
+    def handle(self, *args, **options):
+        url = f"http://localhost:{options['port']}{options['path']}"
+        self.stdout.write(
+            f"GET {options['path']}, {options['concurrency']} concurrent clients, "
+            f"{options['duration']:g} seconds each"
+        )
+        self.stdout.write(
+            f"{'workers':>8} {'requests':>10} {'req/s':>10} {'p50 ms':>10} "
+            f"{'p95 ms':>10} {'errors':>8}"
+        )
+        for workers in options["workers"]:
+            # Kept apart from the metrics of any server already running
+            with tempfile.TemporaryDirectory() as metrics_dir:
+                server = self.start_server(workers, metrics_dir, options)
+                try:
+                    self.wait_for_server(url, server)
+                    latencies, statuses = self.run_load(url, options)
+                finally:
+                    server.terminate()
+                    server.wait()
+
+            errors = sum(1 for s in statuses if s is None or s >= 500)
+            self.stdout.write(
+                f"{workers:>8} {len(latencies):>10} "
+                f"{len(latencies) / options['duration']:>10.1f} "
+                f"{get_percentile(latencies, 50) * 1000:>10.1f} "
+                f"{get_percentile(latencies, 95) * 1000:>10.1f} {errors:>8}"
+            )
+
+    def start_server(self, workers, metrics_dir, options):
+        env = os.environ.copy()
+        env["GUNICORN_WORKERS"] = str(workers)
+        env["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+        env["GUNICORN_BIND"] = f"127.0.0.1:{options['port']}"
+        if options["worker_class"]:
+            env["GUNICORN_WORKER_CLASS"] = options["worker_class"]
+        return subprocess.Popen(
+            [sys.executable, "-m", "gunicorn"],
+            cwd=settings.BASE_DIR,
+            env=env,
+            # The server's logs would drown out the results
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+
+    def wait_for_server(self, url, server):
+        deadline = time.monotonic() + SERVER_START_SECONDS
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("The server exited before it could be tested.")
+            if send_request(url) is not None:
+                return
+            time.sleep(0.2)
+        raise CommandError(f"The server didn't start within {SERVER_START_SECONDS}s.")
+
+    def run_load(self, url, options):
+        deadline = time.monotonic() + options["duration"]
+        with ThreadPoolExecutor(options["concurrency"]) as executor:
+            results = list(
+                executor.map(
+                    run_client,
+                    [url] * options["concurrency"],
+                    [deadline] * options["concurrency"],
+                )
+            )
+        latencies = [latency for result in results for latency in result[0]]
+        statuses = [status for result in results for status in result[1]]
+        return latencies, statuses
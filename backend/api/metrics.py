@@ -0,0 +1,158 @@
+import os
+
+from django.core.signals import request_finished
+from django.db import connections
+from prometheus_client import (
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    multiprocess,
+)
+
+OUTPUT_VALIDATIONS = Counter(
+    "api_output_validations",
+    "Successful responses, by how their output was validated.",
+    ["endpoint", "mode"],
+)
+
+REQUESTS = Counter(
+    "api_requests",
+    "Requests handled, by endpoint and status code.",
+    ["endpoint", "method", "status"],
+)
+
+REQUEST_DURATION = Histogram(
+    "api_request_duration_seconds",
+    "Time taken to handle requests, by endpoint.",
+    ["endpoint"],
+)
+
+REQUEST_QUERIES = Histogram(
+    "api_request_queries",
+    "Database queries run per request, by endpoint.",
+    ["endpoint"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+
+REQUEST_DB_DURATION = Histogram(
+    "api_request_db_duration_seconds",
+    "Time spent running database queries per request, by endpoint.",
+    ["endpoint"],
+)
+
+VALIDATION_DURATION = Histogram(
+    "api_validation_duration_seconds",
+    "Time spent validating the input or output of a request, by endpoint.",
+    ["endpoint", "stage"],
+)
+
+RATE_LIMIT_REJECTIONS = Counter(
+    "api_rate_limit_rejections",
+    "Requests rejected by a rate limit, by the limit's scope.",
+    ["scope"],
+)
+
+GUEST_CREATIONS = Counter(
+    "api_guest_creations",
+    "Guest accounts created for unauthenticated requests.",
+)
+
+CLEANUP_ROWS = Counter(
+    "api_cleanup_rows",
+    "Rows removed by the daily cleanup, by cleanup step.",
+    ["step"],
+)
+
+DB_READS = Counter(
+    "api_db_reads",
+    "Requests that read from each database (see `ReplicaRouter`).",
+    ["database"],
+)
+
+# The pool gauges are summed over the running processes, as of each one's last request
+DB_POOL_CONNECTIONS = Gauge(
+    "api_db_pool_connections",
+    "Connections currently open in the pool.",
+    ["database"],
+    multiprocess_mode="livesum",
+)
+
+DB_POOL_IN_USE = Gauge(
+    "api_db_pool_connections_in_use",
+    "Connections currently in use, or still being opened by the pool.",
+    ["database"],
+    multiprocess_mode="livesum",
+)
+
+DB_POOL_WAITING = Gauge(
+    "api_db_pool_requests_waiting",
+    "Requests currently waiting for a connection from the pool.",
+    ["database"],
+    multiprocess_mode="livesum",
+)
+
+DB_POOL_REQUESTS = Counter(
+    "api_db_pool_requests",
+    "Connections requested from the pool.",
+    ["database"],
+)
+
+DB_POOL_WAIT = Counter(
+    "api_db_pool_wait_seconds",
+    "Time spent waiting for a connection from the pool.",
+    ["database"],
+)
+
+DB_POOL_TIMEOUTS = Counter(
+    "api_db_pool_timeouts",
+    "Requests that timed out waiting for a connection from the pool.",
+    ["database"],
+)
+
+DB_POOL_LOST = Counter(
+    "api_db_pool_connections_lost",
+    "Connections that failed their health check and were replaced.",
+    ["database"],
+)
+
+
+def record_pool_stats(**kwargs):
+    """
+    Records the connection pool stats of every pooled database (see `DB_POOL`).
+
+    Runs after every request, once its connections have been returned to the pool.
+    """
+    for alias in connections:
+        pool = getattr(connections[alias], "pool", None)
+        if pool is None:
+            continue
+        # The counters are reset by reading them, and left out until they are first
+        # incremented again
+        stats = pool.pop_stats()
+        DB_POOL_CONNECTIONS.labels(alias).set(stats["pool_size"])
+        DB_POOL_IN_USE.labels(alias).set(stats["pool_size"] - stats["pool_available"])
+        DB_POOL_WAITING.labels(alias).set(stats["requests_waiting"])
+        DB_POOL_REQUESTS.labels(alias).inc(stats.get("requests_num", 0))
+        DB_POOL_WAIT.labels(alias).inc(stats.get("requests_wait_ms", 0) / 1000)
+        DB_POOL_TIMEOUTS.labels(alias).inc(stats.get("requests_errors", 0))
+        DB_POOL_LOST.labels(alias).inc(stats.get("connections_lost", 0))
+
+
+request_finished.connect(record_pool_stats)
+
+
+def get_metrics_registry():
+    """
+    Returns the registry with the metrics to serve.
+
+    If PROMETHEUS_MULTIPROC_DIR is set (see `gunicorn.conf.py`), every process writes its
+    metrics to files in that folder, and they are combined from there. Otherwise, only
+    the current process's metrics are served.
+    """
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
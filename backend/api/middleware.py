@@ -0,0 +1,90 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from api.metrics import DB_READS
+from api.routers import RoutingState, has_replica, routing_state
+from api.settings import READ_AFTER_WRITE_COOKIE_NAME, READ_AFTER_WRITE_SECONDS
+from api.utils import SessionAuth, set_cookie
+
+
+class SessionAuthMiddleware:
+    """
+    Attaches the sessions from the request's cookies to every request as
+    `request.session_auth`.
+
+    The sessions are resolved lazily, so requests to endpoints without authentication
+    don't run any queries.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Under ASGI, this keeps async views from being run in a thread
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request.session_auth = SessionAuth(request.COOKIES)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.session_auth = SessionAuth(request.COOKIES)
+        return await self.get_response(request)
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Lets GET requests read from the read replica (see `ReplicaRouter`), unless the client
+    wrote to the database within the last READ_AFTER_WRITE_SECONDS.
+
+    Responses to requests that wrote to the database set a cookie that keeps the client's
+    reads on the primary database for that long.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Under ASGI, this keeps async views from being run in a thread
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.get_state(request)
+        token = routing_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        return self.process_response(state, response)
+
+    async def __acall__(self, request):
+        state = self.get_state(request)
+        token = routing_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            routing_state.reset(token)
+        return self.process_response(state, response)
+
+    def get_state(self, request):
+        return RoutingState(
+            use_replica=request.method in ("GET", "HEAD")
+            and READ_AFTER_WRITE_COOKIE_NAME not in request.COOKIES
+            and has_replica()
+        )
+
+    def process_response(self, state, response):
+        for database in state.read_databases:
+            DB_READS.labels(database).inc()
+        if state.wrote and has_replica():
+            set_cookie(
+                response, READ_AFTER_WRITE_COOKIE_NAME, "1", READ_AFTER_WRITE_SECONDS
+            )
+        return response
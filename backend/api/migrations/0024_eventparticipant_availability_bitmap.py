@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 16:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0023_rename_display_name_useraccount_default_display_name"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="eventparticipant",
+            name="availability_bitmap",
+            field=models.BinaryField(null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("api", "0024_eventparticipant_availability_bitmap"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="userevent",
+            name="end_date",
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name="userevent",
+            name="end_time",
+            field=models.TimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name="userevent",
+            name="start_date",
+            field=models.DateField(null=True),
+        ),
+        migrations.AddField(
+            model_name="userevent",
+            name="start_time",
+            field=models.TimeField(null=True),
+        ),
+    ]
@@ -83,6 +83,12 @@ class UserEvent(models.Model):
     )
     duration = models.PositiveSmallIntegerField(null=True)
     time_zone = models.CharField(max_length=64)
+    # Bounds of the event's timeslots, stored whenever the timeslots are saved so they
+    # don't have to be calculated from every timeslot (see `update_event_bounds`)
+    start_date = models.DateField(null=True)
+    end_date = models.DateField(null=True)
+    start_time = models.TimeField(null=True)
+    end_time = models.TimeField(null=True)
     created_at = DateTimeNoTZField(auto_now_add=True)
     updated_at = DateTimeNoTZField(auto_now=True)
 
@@ -108,6 +114,9 @@ class EventParticipant(models.Model):
     )
     display_name = models.CharField(max_length=25)
     time_zone = models.CharField(max_length=64)
+    # Only used when AVAILABILITY_BITMAP_STORAGE is enabled. One bit per timeslot, in
+    # the same order as the event's timeslots (see `get_timeslots`).
+    availability_bitmap = models.BinaryField(null=True)
     created_at = DateTimeNoTZField(auto_now_add=True)
     updated_at = DateTimeNoTZField(auto_now=True)
 
@@ -0,0 +1,79 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.db import connections
+
+PRIMARY_DATABASE = "default"
+REPLICA_DATABASE = "replica"
+
+
+class RoutingState:
+    """
+    Where the current request's queries go, set up by `ReplicaRoutingMiddleware`.
+    """
+
+    def __init__(self, use_replica):
+        self.use_replica = use_replica
+        self.wrote = False
+        # The databases the request read from, counted once it is done
+        self.read_databases = set()
+
+
+routing_state = contextvars.ContextVar("routing_state", default=None)
+
+# Set by `read_from_primary` to temporarily keep reads off the replica
+primary_only = contextvars.ContextVar("primary_only", default=False)
+
+
+def has_replica():
+    return REPLICA_DATABASE in connections.settings
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Reads from the primary database inside this block, even in requests that would use
+    the replica.
+
+    Meant for reads whose results are cached, since data from a lagging replica would
+    otherwise be cached as if it were current.
+    """
+    token = primary_only.set(True)
+    try:
+        yield
+    finally:
+        primary_only.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the read replica in requests that allow it (see
+    `ReplicaRoutingMiddleware`), and everything else to the primary database.
+
+    Once a request writes anything, the rest of its reads go to the primary database so
+    they include the write.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = routing_state.get()
+        if state is None:
+            return PRIMARY_DATABASE
+        if state.use_replica and not state.wrote and not primary_only.get():
+            database = REPLICA_DATABASE
+        else:
+            database = PRIMARY_DATABASE
+        state.read_databases.add(database)
+        return database
+
+    def db_for_write(self, model, **hints):
+        state = routing_state.get()
+        if state is not None:
+            state.wrote = True
+        return PRIMARY_DATABASE
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary database
+        databases = {PRIMARY_DATABASE, REPLICA_DATABASE}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -7,6 +7,7 @@ from urllib.parse import urlparse
 
 import environ
 from celery.schedules import crontab
+from corsheaders.defaults import default_headers
 from django.core.mail import send_mail
 from rest_framework.response import Response
 
@@ -47,12 +48,16 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "corsheaders.middleware.CorsMiddleware",
+    "api.middleware.ReplicaRoutingMiddleware",
+    "api.middleware.SessionAuthMiddleware",
 ]
 
 # CORS, CSRF, and allowed hosts settings
 CORS_ALLOW_ALL_ORIGINS = True if DEBUG else False
 CORS_ALLOWED_ORIGINS = [BASE_URL, "http://localhost"]
 CORS_ALLOW_CREDENTIALS = True
+CORS_ALLOW_HEADERS = (*default_headers, "if-none-match")
+CORS_EXPOSE_HEADERS = ["ETag"]
 CSRF_TRUSTED_ORIGINS = [BASE_URL, "http://localhost"]
 CSRF_COOKIE_DOMAIN = COOKIE_DOMAIN
 ALLOWED_HOSTS = [urlparse(API_URL).hostname, "localhost"]
@@ -65,6 +70,24 @@ WSGI_APPLICATION = "api.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# By default, each worker shares a pool of connections between its threads
+# Otherwise, every thread keeps its own connection open for DB_CONN_MAX_AGE seconds.
+# ASGI runs sync code in threads that aren't reused between requests, so there
+# `api.asgi` defaults it to 0 and every request opens a new connection.
+DB_POOL = env.bool("DB_POOL", default=True)
+DB_CONN_MAX_AGE = env.int("DB_CONN_MAX_AGE", default=600)
+DB_POOL_MIN_SIZE = env.int("DB_POOL_MIN_SIZE", default=2)
+DB_POOL_MAX_SIZE = env.int("DB_POOL_MAX_SIZE", default=10)
+
+# How long a query waits for a free connection from the pool before failing
+DB_POOL_TIMEOUT_SECONDS = 10
+
+# Idle connections above the minimum are closed after this long, and every connection
+# is replaced after the lifetime to spread the load after a database restart or failover
+DB_POOL_MAX_IDLE_SECONDS = 600  # 10 minutes
+
+DB_POOL_MAX_LIFETIME_SECONDS = 3600  # 1 hour
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.postgresql",
@@ -73,10 +96,44 @@ DATABASES = {
         "PASSWORD": env("DB_PASSWORD"),
         "HOST": env("DB_HOST"),
         "PORT": env("DB_PORT"),
-        "CONN_MAX_AGE": 600,
+        # The pool keeps connections open itself
+        "CONN_MAX_AGE": 0 if DB_POOL else DB_CONN_MAX_AGE,
+        # Reused connections are checked before use, so a dropped connection is
+        # replaced instead of failing a request
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": (
+            {
+                "pool": {
+                    "min_size": DB_POOL_MIN_SIZE,
+                    "max_size": DB_POOL_MAX_SIZE,
+                    "timeout": DB_POOL_TIMEOUT_SECONDS,
+                    "max_idle": DB_POOL_MAX_IDLE_SECONDS,
+                    "max_lifetime": DB_POOL_MAX_LIFETIME_SECONDS,
+                }
+            }
+            if DB_POOL
+            else {}
+        ),
     }
 }
 
+# If DB_REPLICA_HOST is set, GET requests read from this replica of the database instead
+# (see `api.routers`), except for clients that recently wrote to the database
+DB_REPLICA_HOST = env("DB_REPLICA_HOST", default="")
+if DB_REPLICA_HOST:
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "HOST": DB_REPLICA_HOST,
+        "PORT": env("DB_REPLICA_PORT", default=env("DB_PORT")),
+        "TEST": {"MIRROR": "default"},
+    }
+
+DATABASE_ROUTERS = ["api.routers.ReplicaRouter"]
+
+# After a client writes to the database, its reads stay on the primary database for this
+# long, so it sees its own changes even while the replica catches up
+READ_AFTER_WRITE_SECONDS = 10
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -99,21 +156,53 @@ REST_FRAMEWORK = {
         "password_reset": "3/hour",
         "event_creation": "6/hour",
         "availability_add": "12/hour",
+        "availability_update": "600/hour",
     },
 }
 
+# The token needed to read the metrics at /metrics/ (see `api.views.get_metrics`)
+# If left empty, the metrics are only available in debug mode
+METRICS_TOKEN = env("METRICS_TOKEN", default="")
+
+# Requests that take longer than this are logged as warnings, along with their number
+# of queries and time spent in the database
+SLOW_REQUEST_SECONDS = 1
+
 SESS_EXP_SECONDS = 3600  # 1 hour
 
 LONG_SESS_EXP_SECONDS = 31536000  # 1 year
 
+# How long a validated session is trusted without checking the database again
+# Keep this short, since an in-process cache can't be invalidated across workers
+SESS_CACHE_SECONDS = 30
+
+# The minimum time between writes to a session's last_used time
+SESS_TOUCH_INTERVAL_SECONDS = 300  # 5 minutes
+
+# How often buffered last_used times for sessions and URL codes are written
+TOUCH_FLUSH_INTERVAL_SECONDS = 60  # 1 minute
+
 EMAIL_CODE_EXP_SECONDS = 600  # 10 minutes
 
 PWD_RESET_EXP_SECONDS = 600  # 10 minutes
 
 URL_CODE_EXP_SECONDS = 1209600  # 14 days
 
+# Expired URL codes are deleted in batches of up to this size, and the batch size is
+# halved whenever a batch takes longer than the time budget to keep locks short
+URL_CODE_EXPIRY_BATCH_SIZE = 1000
+
+URL_CODE_EXPIRY_BATCH_SECONDS = 1
+
+# The daily cleanup deletes expired rows in batches of this size, pausing between
+# batches so other queries can take the locks in the meantime
+CLEANUP_BATCH_SIZE = 1000
+
+CLEANUP_BATCH_PAUSE_SECONDS = 0.1
+
 ACCOUNT_COOKIE_NAME = "account_sess_token"
 GUEST_COOKIE_NAME = "guest_sess_token"
+READ_AFTER_WRITE_COOKIE_NAME = "read_after_write"
 
 GENERIC_ERR_RESPONSE = Response(
     {"error": {"general": ["An unknown error has occurred."]}}, status=500
@@ -136,9 +225,52 @@ CELERY_BEAT_SCHEDULE = {
         "task": "api.tasks.daily_duties",
         "schedule": crontab(hour=0, minute=0),  # Every day at midnight
     },
+    "flush_last_used": {
+        "task": "api.tasks.flush_last_used",
+        "schedule": TOUCH_FLUSH_INTERVAL_SECONDS,
+    },
 }
 CELERY_BROKER_URL = "redis://localhost:6379/0"
 
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# If REDIS_CACHE_URL is not set, an in-process cache is used instead
+REDIS_CACHE_URL = env("REDIS_CACHE_URL", default="")
+
+
+def get_cache_config(name, max_entries):
+    if REDIS_CACHE_URL:
+        return {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_CACHE_URL,
+            "KEY_PREFIX": name,
+        }
+    return {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": name,
+        "OPTIONS": {"MAX_ENTRIES": max_entries},
+    }
+
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "availability": get_cache_config("availability", 1000),
+    "sessions": get_cache_config("sessions", 10000),
+}
+
+# Without REDIS_CACHE_URL, snapshots invalidated by Celery tasks (like the cleanup) are
+# only invalidated in the Celery process, so the API server can serve them until they
+# expire
+AVAILABILITY_SNAPSHOT_TTL_SECONDS = 3600  # 1 hour
+
+# How often a comment is sent on idle availability streams to keep the connection open
+AVAILABILITY_STREAM_KEEPALIVE_SECONDS = 15
+# Streams are closed after this long, and clients reconnect to a (possibly different)
+# worker
+AVAILABILITY_STREAM_MAX_SECONDS = 600  # 10 minutes
+
 LOG_DIR = env("LOG_DIR")
 os.makedirs(LOG_DIR, exist_ok=True)  # Make the log directory if it doesn't exist
 LOGGING = {
@@ -223,3 +355,34 @@ RAND_URL_CODE_LENGTH = 8
 RAND_URL_CODE_ATTEMPTS = 4
 
 MAX_EVENT_DAYS = 30  # 1 month
+
+# Store each participant's availability as a single bitmap instead of one row per
+# timeslot. Run `python manage.py convert_availability_storage` when changing this.
+AVAILABILITY_BITMAP_STORAGE = env.bool("AVAILABILITY_BITMAP_STORAGE", default=False)
+
+# How "get-all" availability is aggregated, either "array" or "loop" (the original
+# row-by-row implementation). Compare them with `python manage.py benchmark_availability`.
+AVAILABILITY_AGGREGATION_ENGINE = env(
+    "AVAILABILITY_AGGREGATION_ENGINE", default="array"
+)
+if AVAILABILITY_AGGREGATION_ENGINE not in ["array", "loop"]:
+    raise ValueError("AVAILABILITY_AGGREGATION_ENGINE must be 'array' or 'loop'.")
+
+# How successful responses are checked against their output serializers. "full" validates
+# every response, "sampled" fully validates 1 in every OUTPUT_VALIDATION_SAMPLE_RATE
+# responses and only checks the rest for missing fields, "structural" only does that
+# check, and "off" skips output validation entirely.
+OUTPUT_VALIDATION_MODE = env(
+    "OUTPUT_VALIDATION_MODE", default="full" if DEBUG else "sampled"
+)
+if OUTPUT_VALIDATION_MODE not in ["full", "sampled", "structural", "off"]:
+    raise ValueError(
+        "OUTPUT_VALIDATION_MODE must be 'full', 'sampled', 'structural' or 'off'."
+    )
+
+OUTPUT_VALIDATION_SAMPLE_RATE = env.int("OUTPUT_VALIDATION_SAMPLE_RATE", default=100)
+
+# Tests always validate output fully, whatever OUTPUT_VALIDATION_MODE is set to
+TEST_RUNNER = "api.test_runner.TestRunner"
+
+DASHBOARD_MAX_PAGE_SIZE = 100
@@ -1,20 +1,72 @@
+import logging
+import time
 from datetime import datetime, timedelta
 
 from celery import shared_task
+from django.db import transaction
 from django.db.models import Q
 
+from api.availability.live import publish_availability_change
+from api.availability.utils import invalidate_availability_snapshot
+from api.metrics import CLEANUP_ROWS
 from api.models import (
+    EventDateAvailability,
+    EventDateTimeslot,
+    EventParticipant,
+    EventWeekdayAvailability,
+    EventWeekdayTimeslot,
     PasswordResetToken,
     UnverifiedUserAccount,
+    UrlCode,
     UserAccount,
+    UserEvent,
+    UserLogin,
     UserSession,
 )
 from api.settings import (
+    CLEANUP_BATCH_PAUSE_SECONDS,
+    CLEANUP_BATCH_SIZE,
     EMAIL_CODE_EXP_SECONDS,
     LONG_SESS_EXP_SECONDS,
     PWD_RESET_EXP_SECONDS,
     SESS_EXP_SECONDS,
+    URL_CODE_EXP_SECONDS,
+    URL_CODE_EXPIRY_BATCH_SECONDS,
+    URL_CODE_EXPIRY_BATCH_SIZE,
 )
+from api.touches import flush_touches
+from api.utils import mark_participants_changed
+
+logger = logging.getLogger("api")
+
+
+def iter_pk_batches(queryset, batch_size=CLEANUP_BATCH_SIZE):
+    """
+    Yields the primary keys of a queryset in ascending order, in lists of up to
+    `batch_size`. Each batch is fetched with a fresh keyset query, so rows can be deleted
+    between batches.
+    """
+    last_pk = None
+    while True:
+        batch = queryset.order_by("pk")
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        pks = list(batch.values_list("pk", flat=True)[:batch_size])
+        if not pks:
+            return
+        yield pks
+        last_pk = pks[-1]
+
+
+def raw_delete(queryset):
+    """
+    Deletes the rows of a queryset with a single DELETE statement and returns how many
+    were removed.
+
+    This skips Django's delete collector, so no cascades or signals are run. It must only
+    be used once everything referencing the rows has already been deleted.
+    """
+    return queryset._raw_delete(queryset.db)
 
 
 def session_cleanup():
@@ -24,7 +76,7 @@ def session_cleanup():
 
     Session lifetime is defined for each type in `settings.py`.
     """
-    UserSession.objects.filter(
+    expired = UserSession.objects.filter(
         (
             Q(is_extended=True)
             & Q(last_used__lt=datetime.now() - timedelta(seconds=LONG_SESS_EXP_SECONDS))
@@ -33,32 +85,188 @@ def session_cleanup():
             Q(is_extended=False)
             & Q(last_used__lt=datetime.now() - timedelta(seconds=SESS_EXP_SECONDS))
         )
-    ).delete()
+    )
+    for tokens in iter_pk_batches(expired):
+        yield raw_delete(UserSession.objects.filter(session_token__in=tokens))
+
+
+def delete_user_accounts(account_ids):
+    """
+    Deletes user accounts along with their events and everything else that references
+    them. Returns the total number of rows removed.
+
+    Rows are removed children first, so every table is cleared with one raw DELETE
+    instead of Django loading each related object to cascade the delete.
+
+    The cached availability and streams of the affected events are updated once the
+    deletion is committed. From Celery, this only reaches the API server through Redis
+    (see `AVAILABILITY_SNAPSHOT_TTL_SECONDS`).
+    """
+    mark_participants_changed(
+        UserEvent.objects.filter(participants__user_account_id__in=account_ids)
+    )
+    deleted_event_codes = list(
+        UrlCode.objects.filter(user_event__user_account_id__in=account_ids).values_list(
+            "url_code", flat=True
+        )
+    )
+    removed_participants = list(
+        EventParticipant.objects.filter(
+            user_account_id__in=account_ids, user_event__url_code__isnull=False
+        )
+        .exclude(user_event__user_account_id__in=account_ids)
+        .values_list("user_event__url_code", "display_name")
+    )
+
+    events = UserEvent.objects.filter(user_account_id__in=account_ids)
+    participants = EventParticipant.objects.filter(
+        Q(user_account_id__in=account_ids) | Q(user_event__in=events)
+    )
+    querysets = [
+        EventDateAvailability.objects.filter(event_participant__in=participants),
+        EventWeekdayAvailability.objects.filter(event_participant__in=participants),
+        participants,
+        EventDateTimeslot.objects.filter(user_event__in=events),
+        EventWeekdayTimeslot.objects.filter(user_event__in=events),
+        UrlCode.objects.filter(user_event__in=events),
+        events,
+        UserSession.objects.filter(user_account_id__in=account_ids),
+        PasswordResetToken.objects.filter(user_account_id__in=account_ids),
+        UserLogin.objects.filter(user_account_id__in=account_ids),
+        UserAccount.objects.filter(user_account_id__in=account_ids),
+    ]
+    removed = sum(raw_delete(queryset) for queryset in querysets)
+
+    for event_code in deleted_event_codes:
+        invalidate_availability_snapshot(event_code)
+        publish_availability_change(event_code, {"type": "event_deleted"})
+    for event_code in {event_code for event_code, _ in removed_participants}:
+        invalidate_availability_snapshot(event_code)
+    for event_code, display_name in removed_participants:
+        publish_availability_change(
+            event_code, {"type": "participant_removed", "display_name": display_name}
+        )
+    return removed
 
 
 def guest_cleanup():
     """
     Removes guest users that no longer have any sessions.
     """
-    UserAccount.objects.filter(is_guest=True, session_tokens__isnull=True).delete()
+    guests = UserAccount.objects.filter(is_guest=True, session_tokens__isnull=True)
+    for account_ids in iter_pk_batches(guests):
+        with transaction.atomic():
+            deleted = delete_user_accounts(account_ids)
+        yield deleted
 
 
 def unverified_user_cleanup():
     """
     Removes expired unverified users.
     """
-    UnverifiedUserAccount.objects.filter(
+    expired = UnverifiedUserAccount.objects.filter(
         created_at__lt=datetime.now() - timedelta(seconds=EMAIL_CODE_EXP_SECONDS)
-    ).delete()
+    )
+    for codes in iter_pk_batches(expired):
+        yield raw_delete(
+            UnverifiedUserAccount.objects.filter(verification_code__in=codes)
+        )
 
 
 def password_reset_token_cleanup():
     """
     Removes expired password reset tokens.
     """
-    PasswordResetToken.objects.filter(
+    expired = PasswordResetToken.objects.filter(
         created_at__lt=datetime.now() - timedelta(seconds=PWD_RESET_EXP_SECONDS)
-    ).delete()
+    )
+    for tokens in iter_pk_batches(expired):
+        yield raw_delete(PasswordResetToken.objects.filter(reset_token__in=tokens))
+
+
+def url_code_cleanup():
+    """
+    Removes URL codes that haven't been used within the expiration time. The events
+    themselves are kept, but can no longer be accessed, so their availability streams are
+    told the event was deleted.
+
+    The batch size is halved whenever a batch takes longer than the time budget.
+    """
+    cutoff = datetime.now() - timedelta(seconds=URL_CODE_EXP_SECONDS)
+    batch_size = URL_CODE_EXPIRY_BATCH_SIZE
+    last_code = ""
+
+    while True:
+        start = time.monotonic()
+        codes = list(
+            UrlCode.objects.filter(last_used__lt=cutoff, url_code__gt=last_code)
+            .order_by("url_code")
+            .values_list("url_code", flat=True)[:batch_size]
+        )
+        if not codes:
+            return
+        removed = raw_delete(
+            UrlCode.objects.filter(url_code__in=codes, last_used__lt=cutoff)
+        )
+        deleted_codes = codes
+        if removed < len(codes):
+            # Some of the codes were used after they were selected
+            kept_codes = set(
+                UrlCode.objects.filter(url_code__in=codes).values_list(
+                    "url_code", flat=True
+                )
+            )
+            deleted_codes = [code for code in codes if code not in kept_codes]
+        for code in deleted_codes:
+            invalidate_availability_snapshot(code)
+            publish_availability_change(code, {"type": "event_deleted"})
+        last_code = codes[-1]
+
+        elapsed = time.monotonic() - start
+        if elapsed > URL_CODE_EXPIRY_BATCH_SECONDS and batch_size > 1:
+            batch_size //= 2
+            logger.warning(
+                "URL code expiry batch took %.2fs, reducing batch size to %d.",
+                elapsed,
+                batch_size,
+            )
+        yield removed
+
+
+CLEANUP_STEPS = [
+    session_cleanup,
+    guest_cleanup,
+    unverified_user_cleanup,
+    password_reset_token_cleanup,
+    url_code_cleanup,
+]
+
+
+def run_cleanup_step(step):
+    """
+    Runs a cleanup step to completion, pausing between its batches. Each step is a
+    generator that yields the number of rows removed by each batch.
+
+    Returns a dict with the rows removed, the number of batches, and the time taken.
+    """
+    start = time.monotonic()
+    rows = 0
+    batches = 0
+    for removed in step():
+        rows += removed
+        batches += 1
+        time.sleep(CLEANUP_BATCH_PAUSE_SECONDS)
+    seconds = round(time.monotonic() - start, 3)
+    CLEANUP_ROWS.labels(step.__name__).inc(rows)
+
+    logger.info(
+        "%s removed %d rows in %d batches (%.2fs).",
+        step.__name__,
+        rows,
+        batches,
+        seconds,
+    )
+    return {"rows": rows, "batches": batches, "seconds": seconds}
 
 
 @shared_task
@@ -66,8 +274,15 @@ def daily_duties():
     """
     Performs daily duties, including:
     - Cleaning up expired data in the database.
+
+    Returns the row counts and timing of each cleanup step.
+    """
+    return {step.__name__: run_cleanup_step(step) for step in CLEANUP_STEPS}
+
+
+@shared_task
+def flush_last_used():
+    """
+    Writes the buffered last_used times of sessions and URL codes to the database.
     """
-    session_cleanup()
-    guest_cleanup()
-    unverified_user_cleanup()
-    password_reset_token_cleanup()
+    flush_touches()
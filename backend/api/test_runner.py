@@ -0,0 +1,19 @@
+from unittest.mock import patch
+
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests with full output validation whatever `OUTPUT_VALIDATION_MODE` is set
+    to, so every response of every test is checked against its output serializer.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.output_validation = patch("api.utils.OUTPUT_VALIDATION_MODE", "full")
+        self.output_validation.start()
+
+    def teardown_test_environment(self, **kwargs):
+        self.output_validation.stop()
+        super().teardown_test_environment(**kwargs)
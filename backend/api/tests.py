@@ -1,3 +1,1130 @@
-from django.test import TestCase
+import json
+import os
+import re
+import subprocess
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from io import StringIO
+from itertools import count
+from unittest.mock import patch
 
-# Create your tests here.
+import bcrypt
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import (
+    AsyncClient,
+    Client,
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    skipUnlessDBFeature,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from prometheus_client import REGISTRY
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from api.auth import views as auth_views
+from api.availability.utils import (
+    aggregate_availability_array,
+    aggregate_availability_loop,
+    decode_bitmap,
+    encode_bitmap,
+    get_participant_timeslot_indexes,
+    get_timeslot_datetime,
+    get_timeslots,
+    remap_availability_bitmaps,
+)
+from api.middleware import ReplicaRoutingMiddleware
+from api.models import (
+    EventDateAvailability,
+    EventDateTimeslot,
+    EventParticipant,
+    PasswordResetToken,
+    UnverifiedUserAccount,
+    UrlCode,
+    UserAccount,
+    UserEvent,
+    UserSession,
+)
+from api.routers import (
+    PRIMARY_DATABASE,
+    REPLICA_DATABASE,
+    ReplicaRouter,
+    RoutingState,
+    has_replica,
+    read_from_primary,
+    routing_state,
+)
+from api.settings import ACCOUNT_COOKIE_NAME, READ_AFTER_WRITE_COOKIE_NAME
+from api.tasks import (
+    guest_cleanup,
+    iter_pk_batches,
+    raw_delete,
+    run_cleanup_step,
+    url_code_cleanup,
+)
+from api.utils import (
+    TimeslotListField,
+    authenticate_session,
+    get_output_validation_mode,
+    validate_output,
+)
+
+ip_addresses = count(1)
+
+
+def get_client():
+    # Every client gets its own address, so the rate limits don't carry over
+    return Client(
+        SERVER_NAME="localhost", REMOTE_ADDR=f"10.0.0.{next(ip_addresses) % 250 + 1}"
+    )
+
+
+def get_timeslot_strings(count, days=2):
+    start = (datetime.now(timezone.utc) + timedelta(days=days)).replace(
+        hour=14, minute=0, second=0, microsecond=0
+    )
+    return [
+        (start + timedelta(minutes=15 * i)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        for i in range(count)
+    ]
+
+
+@contextmanager
+def use_replica():
+    """
+    Routes GET requests as if there were a read replica, with the primary database
+    standing in for it.
+    """
+    with patch("api.routers.REPLICA_DATABASE", "default"), patch(
+        "api.middleware.has_replica", lambda: True
+    ):
+        yield
+
+
+@contextmanager
+def use_bitmap_storage(enabled):
+    """
+    Overrides AVAILABILITY_BITMAP_STORAGE in every module that reads it per request.
+    """
+    with patch("api.availability.utils.AVAILABILITY_BITMAP_STORAGE", enabled), patch(
+        "api.availability.views.AVAILABILITY_BITMAP_STORAGE", enabled
+    ), patch("api.event.views.AVAILABILITY_BITMAP_STORAGE", enabled):
+        yield
+
+
+class APITestMixin:
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+
+    def post(self, client, path, data):
+        return client.post(path, json.dumps(data), content_type="application/json")
+
+    def create_event(self, client, timeslots):
+        response = self.post(
+            client,
+            "/event/date-create/",
+            {"title": "Test", "timeslots": timeslots, "time_zone": "UTC"},
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.json()["event_code"]
+
+    def add_availability(self, client, event_code, display_name, availability):
+        response = self.post(
+            client,
+            "/availability/add/",
+            {
+                "event_code": event_code,
+                "display_name": display_name,
+                "availability": availability,
+                "time_zone": "UTC",
+            },
+        )
+        self.assertEqual(response.status_code, 201, response.content)
+        return response
+
+    def get_all_availability(self, client, event_code):
+        response = client.get("/availability/get-all/", {"event_code": event_code})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+
+class APITestCase(APITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # A configured replica has its own connection, which can't see the test's
+        # uncommitted data, so reads stay on the primary database unless a test uses
+        # `use_replica`
+        patcher = patch("api.middleware.has_replica", lambda: False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, client, path, data):
+        # Runs what would happen once the request's transactions are committed, like
+        # invalidating cached availability
+        with self.captureOnCommitCallbacks(execute=True):
+            return super().post(client, path, data)
+
+
+class BitmapStorageTests(APITestCase):
+    def test_bitmap_round_trip(self):
+        indexes = [0, 3, 7, 8, 20]
+        bitmap = encode_bitmap(indexes, 21)
+        self.assertEqual(len(bitmap), 3)
+        self.assertEqual(decode_bitmap(bitmap), indexes)
+        self.assertEqual(decode_bitmap(encode_bitmap([], 5)), [])
+        self.assertEqual(decode_bitmap(None), [])
+
+    def run_availability_changes(self):
+        client = get_client()
+        other_client = get_client()
+        timeslots = get_timeslot_strings(8)
+        event_code = self.create_event(client, timeslots)
+        self.add_availability(client, event_code, "A", timeslots[:4])
+        self.add_availability(other_client, event_code, "B", timeslots[2:6])
+        self.add_availability(other_client, event_code, "B", timeslots[3:7])
+        # The remaining availability is moved to the new timeslot indexes
+        response = self.post(
+            client,
+            "/event/date-edit/",
+            {
+                "event_code": event_code,
+                "title": "Test",
+                "timeslots": timeslots[1:],
+                "time_zone": "UTC",
+            },
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+
+        self_response = other_client.get(
+            "/availability/get-self/", {"event_code": event_code}
+        )
+        self.assertEqual(self_response.status_code, 200, self_response.content)
+        return self.get_all_availability(client, event_code), self_response.json()
+
+    def test_bitmap_storage_matches_row_storage(self):
+        with use_bitmap_storage(False):
+            rows = self.run_availability_changes()
+        row_count = EventDateAvailability.objects.count()
+        with use_bitmap_storage(True):
+            bitmaps = self.run_availability_changes()
+        self.assertEqual(bitmaps, rows)
+        # Only the participants' bitmaps were written
+        self.assertEqual(EventDateAvailability.objects.count(), row_count)
+
+
+class AvailabilityAggregationTests(APITestCase):
+    # The loop engine only reads availability rows
+    @use_bitmap_storage(False)
+    def test_array_engine_matches_loop_engine_name_order(self):
+        timeslots = get_timeslot_strings(4)
+        event_code = self.create_event(get_client(), timeslots)
+        for name in ["bob", "Alice", "alice", "Bob", "Émile", "_x"]:
+            self.add_availability(get_client(), event_code, name, timeslots[:2])
+
+        event = UserEvent.objects.get(url_code__url_code=event_code)
+        participants = list(event.participants.order_by("created_at"))
+        event_timeslots = list(get_timeslots(event))
+        self.assertEqual(
+            aggregate_availability_array(event, participants, event_timeslots),
+            aggregate_availability_loop(event, participants, event_timeslots),
+        )
+
+    def test_compact_encoding_without_timeslots(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(4)
+        event_code = self.create_event(client, timeslots)
+        self.add_availability(client, event_code, "Name", timeslots[:2])
+        EventDateTimeslot.objects.filter(user_event__url_code=event_code).delete()
+
+        response = client.get(
+            "/availability/get-all/", {"event_code": event_code, "encoding": "compact"}
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        self.assertIsNone(data["start"])
+        self.assertEqual(data["timeslots"], [])
+        self.assertEqual(data["availability"], [[]])
+
+
+class AvailabilitySnapshotTests(APITestCase):
+    def test_edit_returns_fresh_snapshot(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(8)
+        event_code = self.create_event(client, timeslots)
+        self.add_availability(client, event_code, "Name", timeslots[2:6])
+        stale = self.get_all_availability(client, event_code)
+
+        response = self.post(
+            client,
+            "/event/date-edit/",
+            {
+                "event_code": event_code,
+                "title": "Test",
+                "timeslots": timeslots[4:],
+                "time_zone": "UTC",
+            },
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        edited = self.get_all_availability(client, event_code)
+
+        self.assertNotEqual(edited, stale)
+        for cache in caches.all():
+            cache.clear()
+        self.assertEqual(edited, self.get_all_availability(client, event_code))
+
+
+class AvailabilityUpdateTests(APITestCase):
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_add_locks_existing_participant(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(4)
+        event_code = self.create_event(client, timeslots)
+        self.add_availability(client, event_code, "Name", timeslots[:2])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.add_availability(client, event_code, "Name", timeslots[1:])
+        self.assertTrue(
+            any(
+                "api_eventparticipant" in query["sql"] and "FOR UPDATE" in query["sql"]
+                for query in queries
+            )
+        )
+
+    @use_bitmap_storage(True)
+    def test_add_reads_timeslots_after_locking_participant(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(8)
+        event_code = self.create_event(client, timeslots)
+        self.add_availability(client, event_code, "Name", timeslots[2:4])
+        event = UserEvent.objects.get(url_code=event_code)
+        old_timeslots = [
+            get_timeslot_datetime(event, ts) for ts in get_timeslots(event)
+        ]
+        select_for_update = EventParticipant.objects.select_for_update
+
+        def edit_while_locking(*args, **kwargs):
+            # Like an edit removing the first timeslot, committed while the lock waits
+            EventDateTimeslot.objects.filter(user_event=event).earliest(
+                "utc_timeslot"
+            ).delete()
+            remap_availability_bitmaps(event, old_timeslots)
+            return select_for_update(*args, **kwargs)
+
+        with patch.object(
+            EventParticipant.objects, "select_for_update", edit_while_locking
+        ):
+            self.add_availability(client, event_code, "Name", timeslots[3:6])
+        participant = EventParticipant.objects.get(user_event=event)
+        self.assertEqual(decode_bitmap(participant.availability_bitmap), [2, 3, 4])
+
+    def update_availability(self, client, event_code, *ranges):
+        with self.captureOnCommitCallbacks(execute=True):
+            return client.patch(
+                "/availability/update/",
+                json.dumps(
+                    {
+                        "event_code": event_code,
+                        "ranges": [
+                            {"start": start, "end": end, "action": action}
+                            for action, start, end in ranges
+                        ],
+                    }
+                ),
+                content_type="application/json",
+            )
+
+    def get_indexes(self, event_code):
+        participant = EventParticipant.objects.get(user_event__url_code=event_code)
+        event = participant.user_event
+        return get_participant_timeslot_indexes(
+            event, participant, list(get_timeslots(event))
+        )
+
+    def test_update_ranges(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(8)
+        event_code = self.create_event(client, timeslots)
+        self.add_availability(client, event_code, "Name", timeslots[:2])
+
+        for ranges, expected in [
+            ([("add", timeslots[2], timeslots[4])], {0, 1, 2, 3}),
+            ([("remove", timeslots[1], timeslots[2])], {0, 2, 3}),
+            # Overlapping ranges are applied in order
+            (
+                [
+                    ("add", timeslots[3], timeslots[6]),
+                    ("add", timeslots[1], timeslots[4]),
+                    ("remove", timeslots[5], timeslots[7]),
+                ],
+                {0, 1, 2, 3, 4},
+            ),
+            # Ranges only need to cover a timeslot's start
+            ([("remove", timeslots[0][:-6] + "05:00Z", timeslots[3])], {0, 3, 4}),
+        ]:
+            with self.subTest(ranges=ranges):
+                response = self.update_availability(client, event_code, *ranges)
+                self.assertEqual(response.status_code, 200, response.content)
+                self.assertEqual(self.get_indexes(event_code), expected)
+
+    def test_update_invalid_ranges(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(4)
+        event_code = self.create_event(client, timeslots)
+        self.add_availability(client, event_code, "Name", timeslots[:2])
+        earlier = get_timeslot_strings(4, days=1)
+
+        for ranges in [
+            [("add", earlier[0], earlier[2])],
+            # Between two timeslots
+            [("add", timeslots[0][:-6] + "05:00Z", timeslots[0][:-6] + "10:00Z")],
+            [("add", timeslots[2], timeslots[2])],
+            [("add", timeslots[2], timeslots[3]), ("remove", earlier[0], earlier[1])],
+        ]:
+            with self.subTest(ranges=ranges):
+                response = self.update_availability(client, event_code, *ranges)
+                self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.get_indexes(event_code), {0, 1})
+
+    def test_update_without_participating(self):
+        timeslots = get_timeslot_strings(4)
+        event_code = self.create_event(get_client(), timeslots)
+        response = self.update_availability(
+            get_client(), event_code, ("add", timeslots[0], timeslots[2])
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(EventParticipant.objects.exists())
+
+    def test_unchanged_update_writes_nothing(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(4)
+        event_code = self.create_event(client, timeslots)
+        self.add_availability(client, event_code, "Name", timeslots[:2])
+        participants = EventParticipant.objects.filter(user_event__url_code=event_code)
+        updated_at = datetime(2020, 1, 1)
+        participants.update(updated_at=updated_at)
+
+        with patch(
+            "api.availability.views.invalidate_availability_snapshot"
+        ) as invalidate:
+            response = self.update_availability(
+                client, event_code, ("add", timeslots[0], timeslots[1])
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        invalidate.assert_not_called()
+        self.assertEqual(participants.get().updated_at, updated_at)
+
+
+class TimeslotListFieldTests(SimpleTestCase):
+    def get_errors(self, data):
+        with self.assertRaises(ValidationError) as context:
+            TimeslotListField().to_internal_value(data)
+        return context.exception.detail
+
+    def test_timeslots_are_sorted_without_duplicates(self):
+        field = TimeslotListField()
+        self.assertEqual(
+            field.to_internal_value(
+                [
+                    "2030-01-01T10:15:00Z",
+                    "2030-01-01T10:00:00Z",
+                    "2030-01-01T10:15:00",
+                    datetime(2030, 1, 1, 10, 0),
+                ]
+            ),
+            [datetime(2030, 1, 1, 10, 0), datetime(2030, 1, 1, 10, 15)],
+        )
+
+    def test_aware_timeslots_are_converted_to_utc(self):
+        field = TimeslotListField()
+        self.assertEqual(
+            field.to_internal_value(
+                [
+                    "2030-01-01T10:00:00+05:30",
+                    datetime(2030, 1, 1, 23, 45, tzinfo=timezone(-timedelta(hours=1))),
+                ]
+            ),
+            [datetime(2030, 1, 1, 4, 30), datetime(2030, 1, 2, 0, 45)],
+        )
+
+    def test_misaligned_timeslots(self):
+        for timeslot in [
+            "2030-01-01T10:05:00Z",
+            "2030-01-01T10:00:30Z",
+            "2030-01-01T10:00:00.5Z",
+            # Aligned locally, but not in UTC
+            "2030-01-01T10:00:00+00:20",
+        ]:
+            with self.subTest(timeslot=timeslot):
+                self.assertEqual(self.get_errors([timeslot])[0].code, "misaligned")
+
+    def test_invalid_timeslots(self):
+        for data in [["tomorrow"], ["2030-01-01T10:00:00Z", None], [""], [12]]:
+            with self.subTest(data=data):
+                self.assertEqual(self.get_errors(data)[0].code, "invalid")
+        self.assertEqual(self.get_errors("2030-01-01T10:00:00Z")[0].code, "not_a_list")
+        field = TimeslotListField(allow_empty=False)
+        with self.assertRaises(ValidationError):
+            field.to_internal_value([])
+
+
+class OutputSerializer(serializers.Serializer):
+    name = serializers.CharField()
+    count = serializers.IntegerField()
+
+
+class OutputValidationTests(SimpleTestCase):
+    def get_output(self, mode, data):
+        @validate_output(OutputSerializer)
+        def view(request):
+            return Response(data)
+
+        request = RequestFactory().get("/test/")
+        request.resolver_match = resolve("/event/get-details/")
+        with patch("api.utils.OUTPUT_VALIDATION_MODE", mode):
+            response = view(request)
+        return response.status_code, response.data
+
+    def assertInvalid(self, mode, data):
+        with self.assertLogs("api", "ERROR"):
+            self.assertEqual(self.get_output(mode, data)[0], 500)
+
+    def test_full(self):
+        self.assertEqual(
+            self.get_output("full", {"name": "a", "count": "2", "extra": True}),
+            (200, {"name": "a", "count": 2}),
+        )
+        self.assertInvalid("full", {"name": "a", "count": "two"})
+        self.assertInvalid("full", {"name": "a"})
+
+    def test_structural(self):
+        # Only the top-level fields are checked
+        self.assertEqual(
+            self.get_output("structural", {"count": "two", "name": "a", "extra": True}),
+            (200, {"name": "a", "count": "two"}),
+        )
+        self.assertInvalid("structural", {"name": "a"})
+        self.assertInvalid("structural", ["a", 2])
+
+    def test_sampled(self):
+        data = {"name": "a", "count": "two"}
+        with patch("api.utils.random.randrange", return_value=0):
+            self.assertInvalid("sampled", data)
+        with patch("api.utils.random.randrange", return_value=1):
+            self.assertEqual(self.get_output("sampled", data), (200, data))
+            self.assertInvalid("sampled", {"name": "a"})
+
+    def test_off(self):
+        data = {"count": "two", "extra": True}
+        self.assertEqual(self.get_output("off", data), (200, data))
+
+    def test_tests_validate_fully(self):
+        # See `api.test_runner`
+        self.assertEqual(get_output_validation_mode(), "full")
+
+
+class TouchBufferTests(APITestCase):
+    def test_touches_are_flushed_after_the_request(self):
+        event_code = self.create_event(get_client(), get_timeslot_strings(4))
+        old_time = datetime(2000, 1, 1)
+        UrlCode.objects.filter(url_code=event_code).update(last_used=old_time)
+
+        with use_replica(), patch("api.touches.TOUCH_FLUSH_INTERVAL_SECONDS", 0):
+            response = get_client().get(
+                "/event/get-details/", {"event_code": event_code}
+            )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(UrlCode.objects.get(url_code=event_code).last_used, old_time)
+        # The flush isn't a write of the GET request
+        self.assertNotIn(READ_AFTER_WRITE_COOKIE_NAME, response.cookies)
+
+
+class SessionTests(APITestCase):
+    def test_reset_password_rejects_sessions_immediately(self):
+        user = UserAccount.objects.create(
+            email="user@example.com",
+            password_hash=bcrypt.hashpw(b"Old password 1!", bcrypt.gensalt(4)).decode(),
+            is_guest=False,
+        )
+        UserSession.objects.create(session_token="session", user_account=user)
+        PasswordResetToken.objects.create(reset_token="reset", user_account=user)
+        client = get_client()
+        client.cookies[ACCOUNT_COOKIE_NAME] = "session"
+        self.assertEqual(client.get("/auth/check-account-auth/").status_code, 200)
+
+        forget_user_sessions = auth_views.forget_user_sessions
+
+        def authenticate_while_resetting(user):
+            forget_user_sessions(user)
+            # Like a request made before the reset is committed
+            self.assertIsNotNone(authenticate_session("session"))
+
+        with patch.object(
+            auth_views, "forget_user_sessions", authenticate_while_resetting
+        ):
+            response = self.post(
+                get_client(),
+                "/auth/reset-password/",
+                {"reset_token": "reset", "new_password": "New password 2!"},
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(client.get("/auth/check-account-auth/").status_code, 401)
+
+
+class CleanupTests(APITestCase):
+    def run_cleanup(self, step):
+        with patch("api.tasks.CLEANUP_BATCH_PAUSE_SECONDS", 0), patch(
+            "api.tasks.publish_availability_change"
+        ) as publish, self.captureOnCommitCallbacks(execute=True):
+            result = run_cleanup_step(step)
+        return result, publish
+
+    def test_batches_continue_after_deletes(self):
+        UnverifiedUserAccount.objects.bulk_create(
+            UnverifiedUserAccount(
+                verification_code=str(i), email=f"{i}@example.com", password_hash=""
+            )
+            for i in range(5)
+        )
+        batches = []
+        for pks in iter_pk_batches(UnverifiedUserAccount.objects.all(), batch_size=2):
+            batches.append(pks)
+            raw_delete(UnverifiedUserAccount.objects.filter(pk__in=pks))
+        self.assertEqual([len(batch) for batch in batches], [2, 2, 1])
+        self.assertFalse(UnverifiedUserAccount.objects.exists())
+
+    def test_guest_cleanup_removes_participants_from_cached_availability(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(4)
+        event_code = self.create_event(client, timeslots)
+        self.add_availability(get_client(), event_code, "Guest", timeslots[:2])
+        self.assertEqual(
+            self.get_all_availability(client, event_code)["participants"], ["Guest"]
+        )
+
+        guest = EventParticipant.objects.get(display_name="Guest").user_account
+        UserSession.objects.filter(user_account=guest).delete()
+        result, publish = self.run_cleanup(guest_cleanup)
+
+        self.assertEqual(result["batches"], 1)
+        publish.assert_called_once_with(
+            event_code, {"type": "participant_removed", "display_name": "Guest"}
+        )
+        self.assertEqual(
+            self.get_all_availability(client, event_code)["participants"], []
+        )
+
+    def test_guest_cleanup_removes_events_of_deleted_guests(self):
+        client = get_client()
+        event_code = self.create_event(client, get_timeslot_strings(4))
+        UserSession.objects.all().delete()
+        result, publish = self.run_cleanup(guest_cleanup)
+
+        publish.assert_called_once_with(event_code, {"type": "event_deleted"})
+        self.assertFalse(UrlCode.objects.filter(url_code=event_code).exists())
+        response = client.get("/availability/get-all/", {"event_code": event_code})
+        self.assertEqual(response.status_code, 404)
+
+    def expire_url_codes(self, event_codes):
+        UrlCode.objects.filter(url_code__in=event_codes).update(
+            last_used=datetime(2000, 1, 1)
+        )
+
+    @patch("api.tasks.URL_CODE_EXPIRY_BATCH_SIZE", 2)
+    def test_url_code_cleanup(self):
+        client = get_client()
+        event_codes = [
+            self.create_event(client, get_timeslot_strings(4)) for _ in range(4)
+        ]
+        expired_codes = sorted(event_codes[:3])
+        self.expire_url_codes(expired_codes)
+        self.get_all_availability(client, expired_codes[0])
+        result, publish = self.run_cleanup(url_code_cleanup)
+
+        self.assertEqual(result["batches"], 2)
+        self.assertEqual(
+            [call.args for call in publish.call_args_list],
+            [(code, {"type": "event_deleted"}) for code in expired_codes],
+        )
+        self.assertEqual(
+            set(UrlCode.objects.values_list("url_code", flat=True)), {event_codes[3]}
+        )
+        response = client.get(
+            "/availability/get-all/", {"event_code": expired_codes[0]}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    @patch("api.tasks.URL_CODE_EXPIRY_BATCH_SIZE", 4)
+    def test_url_code_cleanup_reduces_slow_batches(self):
+        event_codes = [
+            self.create_event(get_client(), get_timeslot_strings(4)) for _ in range(7)
+        ]
+        self.expire_url_codes(event_codes)
+
+        # Every batch takes 2 seconds, more than the 1 second budget
+        with patch("api.tasks.URL_CODE_EXPIRY_BATCH_SECONDS", 1), patch(
+            "api.tasks.time"
+        ) as time, self.assertLogs("api", "WARNING") as logs:
+            time.monotonic.side_effect = count(0, 2)
+            self.assertEqual(list(url_code_cleanup()), [4, 2, 1])
+        # The batch size doesn't go below 1
+        self.assertEqual(len(logs.output), 2)
+        self.assertFalse(UrlCode.objects.exists())
+
+
+class EventBoundsTests(APITestCase):
+    def get_bounds(self, event_code):
+        return UserEvent.objects.values(
+            "start_date", "end_date", "start_time", "end_time"
+        ).get(url_code=event_code)
+
+    def test_edit_stores_bounds(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(8)
+        event_code = self.create_event(client, timeslots)
+        bounds = self.get_bounds(event_code)
+        self.assertEqual(bounds["start_time"].isoformat(), "14:00:00")
+
+        response = self.post(
+            client,
+            "/event/date-edit/",
+            {
+                "event_code": event_code,
+                "title": "Test",
+                "timeslots": timeslots[4:] + get_timeslot_strings(8, days=4)[4:],
+                "time_zone": "UTC",
+            },
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        edited_bounds = self.get_bounds(event_code)
+        self.assertEqual(edited_bounds["start_time"].isoformat(), "15:00:00")
+        self.assertEqual(
+            edited_bounds["end_date"], bounds["end_date"] + timedelta(days=2)
+        )
+
+    def test_backfill(self):
+        client = get_client()
+        event_codes = [
+            self.create_event(client, get_timeslot_strings(4)) for _ in range(3)
+        ]
+        bounds = self.get_bounds(event_codes[0])
+        events = UserEvent.objects.filter(url_code__in=event_codes[:2])
+        events.update(start_date=None, end_date=None, start_time=None, end_time=None)
+        EventDateTimeslot.objects.filter(user_event__url_code=event_codes[1]).delete()
+
+        output = StringIO()
+        with self.assertLogs("api", "CRITICAL"):
+            call_command("backfill_event_bounds", stdout=output)
+        self.assertEqual(self.get_bounds(event_codes[0]), bounds)
+        self.assertIsNone(self.get_bounds(event_codes[1])["start_date"])
+        self.assertIn("Skipped event", output.getvalue())
+        self.assertIn("Stored bounds for 1 events.", output.getvalue())
+
+
+class DashboardTests(APITestCase):
+    def test_missing_bounds_are_calculated_without_saving(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(8)
+        event_code = self.create_event(client, timeslots)
+        events = UserEvent.objects.filter(url_code__url_code=event_code)
+        bounds = events.values("start_date", "end_date", "start_time", "end_time").get()
+        events.update(start_date=None, end_date=None, start_time=None, end_time=None)
+
+        with use_replica():
+            response = client.get("/dashboard/get/")
+
+        self.assertEqual(response.status_code, 200, response.content)
+        (event,) = response.json()["created_events"]
+        self.assertEqual(event["start_date"], bounds["start_date"].isoformat())
+        self.assertEqual(event["end_time"], bounds["end_time"].isoformat())
+        self.assertIsNone(events.get().start_date)
+        self.assertNotIn(READ_AFTER_WRITE_COOKIE_NAME, response.cookies)
+
+    def get_dashboard(self, client, **params):
+        response = client.get("/dashboard/get/", params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_pages_follow_creation_order(self):
+        client = get_client()
+        event_codes = [
+            self.create_event(client, get_timeslot_strings(4)) for _ in range(5)
+        ]
+        # Events created at the same time are ordered by ID
+        UserEvent.objects.filter(url_code__url_code__in=event_codes[1:3]).update(
+            created_at=datetime(2020, 1, 1)
+        )
+        expected = event_codes[1:3] + event_codes[:1] + event_codes[3:]
+
+        pages = []
+        cursor = None
+        while True:
+            params = {"limit": 2, "created_cursor": cursor} if cursor else {"limit": 2}
+            data = self.get_dashboard(client, **params)
+            pages.append([event["event_code"] for event in data["created_events"]])
+            cursor = data["next_created_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(pages, [expected[:2], expected[2:4], expected[4:]])
+
+    def test_updated_since(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(4)
+        old_code = self.create_event(client, timeslots)
+        new_code = self.create_event(client, timeslots)
+        UserEvent.objects.exclude(url_code__url_code=new_code).update(
+            updated_at=datetime(2020, 1, 1)
+        )
+
+        data = self.get_dashboard(client, updated_since="2021-01-01T00:00:00Z")
+        self.assertEqual(
+            [event["event_code"] for event in data["created_events"]], [new_code]
+        )
+        self.add_availability(get_client(), old_code, "Name", timeslots)
+        data = self.get_dashboard(client, updated_since="2021-01-01T00:00:00Z")
+        self.assertEqual(
+            [event["event_code"] for event in data["created_events"]],
+            [old_code, new_code],
+        )
+
+    def test_invalid_cursor(self):
+        response = get_client().get("/dashboard/get/", {"created_cursor": "nope"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ETagTests(APITestCase):
+    def get_with_etag(self, client, path, tag, **params):
+        return client.get(path, params, HTTP_IF_NONE_MATCH=tag)
+
+    def test_unchanged_availability_is_not_modified(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(4)
+        event_code = self.create_event(client, timeslots)
+        self.add_availability(client, event_code, "Name", timeslots[:2])
+        response = client.get("/availability/get-all/", {"event_code": event_code})
+        tag = response["ETag"]
+
+        response = self.get_with_etag(
+            client, "/availability/get-all/", tag, event_code=event_code
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], tag)
+
+        self.add_availability(get_client(), event_code, "Other", timeslots[2:])
+        response = self.get_with_etag(
+            client, "/availability/get-all/", tag, event_code=event_code
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], tag)
+        self.assertEqual(response.json()["participants"], ["Name", "Other"])
+
+    def test_not_modified_with_expired_account_session(self):
+        client = get_client()
+        event_code = self.create_event(client, get_timeslot_strings(4))
+        tag = client.get("/event/get-details/", {"event_code": event_code})["ETag"]
+        client.cookies[ACCOUNT_COOKIE_NAME] = "expired"
+
+        response = self.get_with_etag(
+            client, "/event/get-details/", tag, event_code=event_code
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.cookies[ACCOUNT_COOKIE_NAME].value, "")
+
+
+class AvailabilityStreamTests(APITestCase):
+    def test_stream_refused_under_wsgi(self):
+        client = get_client()
+        event_code = self.create_event(client, get_timeslot_strings(4))
+        response = client.get("/availability/stream/", {"event_code": event_code})
+        self.assertEqual(response.status_code, 501)
+
+    async def test_stream_under_asgi(self):
+        event_code = await sync_to_async(self.create_event)(
+            get_client(), get_timeslot_strings(4)
+        )
+        client = AsyncClient(headers={"host": "localhost"})
+        response = await client.get("/availability/stream/", {"event_code": event_code})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b"retry: "))
+        await stream.aclose()
+
+
+class ReplicaRouterTests(TestCase):
+    def route_reads(self, state):
+        router = ReplicaRouter()
+        token = routing_state.set(state)
+        try:
+            reads = [router.db_for_read(UserEvent)]
+            with read_from_primary():
+                reads.append(router.db_for_read(UserEvent))
+            self.assertEqual(router.db_for_write(UserEvent), PRIMARY_DATABASE)
+            reads.append(router.db_for_read(UserEvent))
+        finally:
+            routing_state.reset(token)
+        return reads
+
+    def test_reads_use_replica_until_write(self):
+        self.assertEqual(
+            self.route_reads(RoutingState(use_replica=True)),
+            [REPLICA_DATABASE, PRIMARY_DATABASE, PRIMARY_DATABASE],
+        )
+
+    def test_reads_use_primary_without_replica(self):
+        self.assertEqual(
+            self.route_reads(RoutingState(use_replica=False)), [PRIMARY_DATABASE] * 3
+        )
+        self.assertEqual(self.route_reads(None), [PRIMARY_DATABASE] * 3)
+
+
+class ReplicaRoutingMiddlewareTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.states = []
+        get_state = ReplicaRoutingMiddleware.get_state
+
+        def record_state(middleware, request):
+            state = get_state(middleware, request)
+            self.states.append(state)
+            return state
+
+        patcher = patch.object(ReplicaRoutingMiddleware, "get_state", record_state)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_read_after_write(self):
+        client = get_client()
+        with use_replica():
+            event_code = self.create_event(client, get_timeslot_strings(4))
+            (write_state,) = self.states
+            self.assertFalse(write_state.use_replica)
+            self.assertTrue(write_state.wrote)
+            self.assertIn(READ_AFTER_WRITE_COOKIE_NAME, client.cookies)
+
+            # The client's reads stay on the primary database for a while
+            response = client.get("/event/get-details/", {"event_code": event_code})
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(self.states[-1].use_replica)
+
+            response = get_client().get(
+                "/event/get-details/", {"event_code": event_code}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(self.states[-1].use_replica)
+            self.assertNotIn(READ_AFTER_WRITE_COOKIE_NAME, response.cookies)
+
+    def test_no_cookie_without_replica(self):
+        client = get_client()
+        self.create_event(client, get_timeslot_strings(4))
+        self.assertTrue(self.states[-1].wrote)
+        self.assertNotIn(READ_AFTER_WRITE_COOKIE_NAME, client.cookies)
+
+
+class ReplicaDatabaseTests(APITestMixin, TransactionTestCase):
+    """
+    Reads from a replica that mirrors the primary database. Without DB_REPLICA_HOST, it
+    is added as a second connection to the test database. The replica has its own
+    connection, so it only sees committed data.
+    """
+
+    databases = (
+        {PRIMARY_DATABASE, REPLICA_DATABASE} if has_replica() else {PRIMARY_DATABASE}
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Added after the test databases are set up, which it mirrors
+        cls.added_replica = not has_replica()
+        if cls.added_replica:
+            connections.settings[REPLICA_DATABASE] = {
+                **connections[PRIMARY_DATABASE].settings_dict,
+                "TEST": {"MIRROR": PRIMARY_DATABASE},
+            }
+            cls.databases = cls.databases | {REPLICA_DATABASE}
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.added_replica:
+            del cls.databases
+            connections[REPLICA_DATABASE].close()
+            del connections[REPLICA_DATABASE]
+            del connections.settings[REPLICA_DATABASE]
+        super().tearDownClass()
+
+    def get_replica_reads(self):
+        return (
+            REGISTRY.get_sample_value(
+                "api_db_reads_total", {"database": REPLICA_DATABASE}
+            )
+            or 0
+        )
+
+    def test_get_reads_from_replica(self):
+        client = get_client()
+        event_code = self.create_event(client, get_timeslot_strings(4))
+        self.assertIn(READ_AFTER_WRITE_COOKIE_NAME, client.cookies)
+
+        replica_reads = self.get_replica_reads()
+        with CaptureQueriesContext(connections[REPLICA_DATABASE]) as replica_queries:
+            response = get_client().get(
+                "/event/get-details/", {"event_code": event_code}
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(replica_queries.captured_queries)
+        self.assertNotIn(READ_AFTER_WRITE_COOKIE_NAME, response.cookies)
+        # Counted once for the request, not for every query
+        self.assertEqual(self.get_replica_reads(), replica_reads + 1)
+
+        # The client that just wrote reads from the primary database
+        with CaptureQueriesContext(connections[REPLICA_DATABASE]) as replica_queries:
+            response = client.get("/event/get-details/", {"event_code": event_code})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(replica_queries.captured_queries)
+
+
+# Loads the settings in a new process, like an API server would
+DATABASE_SETTINGS_SCRIPT = """
+import json, sys
+import django
+if sys.argv[1] == "asgi":
+    import api.asgi
+else:
+    django.setup()
+from django.db import connection
+pool = connection.pool
+print(json.dumps({
+    "CONN_MAX_AGE": connection.settings_dict["CONN_MAX_AGE"],
+    "pool": pool and [pool.min_size, pool.max_size],
+}))
+"""
+
+
+class DatabaseSettingsTests(SimpleTestCase):
+    def get_database_settings(self, server, **variables):
+        environment = {
+            name: value
+            for name, value in os.environ.items()
+            if not name.startswith("DB_POOL") and name != "DB_CONN_MAX_AGE"
+        }
+        environment.update(
+            DJANGO_SETTINGS_MODULE="api.settings",
+            PYTHONPATH=str(settings.BASE_DIR),
+            **variables,
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", DATABASE_SETTINGS_SCRIPT, server],
+            env=environment,
+            capture_output=True,
+            text=True,
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def test_pool(self):
+        for server in ["wsgi", "asgi"]:
+            with self.subTest(server=server):
+                self.assertEqual(
+                    self.get_database_settings(
+                        server,
+                        DB_POOL="True",
+                        DB_POOL_MIN_SIZE="1",
+                        DB_POOL_MAX_SIZE="3",
+                    ),
+                    {"CONN_MAX_AGE": 0, "pool": [1, 3]},
+                )
+
+    def test_no_pool(self):
+        self.assertEqual(
+            self.get_database_settings("asgi", DB_POOL="False"),
+            {"CONN_MAX_AGE": 0, "pool": None},
+        )
+        self.assertEqual(
+            self.get_database_settings("asgi", DB_POOL="False", DB_CONN_MAX_AGE="60"),
+            {"CONN_MAX_AGE": 60, "pool": None},
+        )
+        self.assertEqual(
+            self.get_database_settings("wsgi", DB_POOL="False", DB_CONN_MAX_AGE="60"),
+            {"CONN_MAX_AGE": 60, "pool": None},
+        )
+
+
+class RequestStatsTests(APITestCase):
+    def get_logged_queries(self, logs, endpoint):
+        for line in logs.output:
+            match = re.search(rf"endpoint={endpoint} .* queries=(\d+)", line)
+            if match:
+                return int(match[1])
+        self.fail(f"No request to {endpoint} was logged.")
+
+    def test_queries_are_recorded(self):
+        client = get_client()
+        timeslots = get_timeslot_strings(4)
+        # Like a connection opened before any request
+        with patch.object(connection, "execute_wrappers", []), self.assertLogs(
+            "api", "DEBUG"
+        ) as logs:
+            event_code = self.create_event(client, timeslots)
+            # An async view
+            client.get("/event/get-details/", {"event_code": event_code})
+        self.assertGreater(self.get_logged_queries(logs, "/event/date-create/"), 0)
+        self.assertGreater(self.get_logged_queries(logs, "/event/get-details/"), 0)
+
+
+class MetricsTests(APITestCase):
+    def get_metrics(self, token=None):
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {token}"} if token else {}
+        return get_client().get("/metrics/", **headers)
+
+    @patch.multiple("api.views", DEBUG=False, METRICS_TOKEN="")
+    def test_hidden_without_token(self):
+        self.assertEqual(self.get_metrics().status_code, 404)
+
+    @patch.multiple("api.views", DEBUG=False, METRICS_TOKEN="secret")
+    def test_requires_token(self):
+        self.assertEqual(self.get_metrics().status_code, 401)
+        self.assertEqual(self.get_metrics("wrong").status_code, 401)
+        self.assertEqual(self.get_metrics("secret").status_code, 200)
+
+    @patch.multiple("api.views", DEBUG=False, METRICS_TOKEN="secret")
+    def test_metric_families(self):
+        get_client().get("/event/get-details/", {"event_code": "missing"})
+        response = self.get_metrics("secret")
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        metrics = response.content.decode()
+        for family in [
+            "api_requests",
+            "api_request_duration_seconds",
+            "api_request_queries",
+            "api_request_db_duration_seconds",
+            "api_validation_duration_seconds",
+            "api_rate_limit_rejections",
+            "api_guest_creations",
+            "api_cleanup_rows",
+            "api_db_reads",
+            "api_db_pool_connections",
+        ]:
+            self.assertTrue(
+                re.search(rf"^# TYPE {family}(_total)? ", metrics, re.MULTILINE), family
+            )
+        self.assertIn(
+            'api_requests_total{endpoint="/event/get-details/",method="GET",'
+            'status="404"}',
+            metrics,
+        )
+        # Endpoints without requests are listed too
+        self.assertIn(
+            'api_request_duration_seconds_count{endpoint="/availability/get-all/"}',
+            metrics,
+        )
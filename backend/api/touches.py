@@ -0,0 +1,138 @@
+import logging
+import threading
+import time
+from datetime import datetime
+
+import redis
+from django.core.signals import request_finished
+from django.db import DatabaseError
+
+from api.models import UrlCode, UserSession
+from api.routers import routing_state
+from api.settings import REDIS_CACHE_URL, TOUCH_FLUSH_INTERVAL_SECONDS
+
+logger = logging.getLogger("api")
+
+# Models with a `last_used` time that is written through the touch buffer, along with
+# the field used to identify them
+TOUCH_MODELS = {
+    "session": (UserSession, "session_token"),
+    "url_code": (UrlCode, "url_code"),
+}
+
+# The maximum number of rows updated by a single statement when flushing
+FLUSH_BATCH_SIZE = 1000
+
+
+class RedisTouchBuffer:
+    """
+    Buffers touches in Redis sets, to be flushed by the `flush_last_used` Celery task.
+    """
+
+    flushes_after_requests = False
+
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url)
+
+    def add(self, kind, key):
+        self.client.sadd(f"touched:{kind}", key)
+
+    def pop_all(self, kind):
+        redis_key = f"touched:{kind}"
+        # Read and clear the set in one transaction so no touches are lost in between
+        with self.client.pipeline() as pipe:
+            pipe.smembers(redis_key)
+            pipe.delete(redis_key)
+            keys, _ = pipe.execute()
+        return [key.decode() for key in keys]
+
+
+class LocalTouchBuffer:
+    """
+    Buffers touches in memory when Redis isn't configured (like in development and
+    tests). Since other processes can't see this buffer, it is flushed after a request
+    once the flush interval has passed (see `flush_due_touches`).
+    """
+
+    flushes_after_requests = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.touched = {kind: set() for kind in TOUCH_MODELS}
+        self.last_flush = time.monotonic()
+
+    def add(self, kind, key):
+        with self.lock:
+            self.touched[kind].add(key)
+
+    def pop_all(self, kind):
+        with self.lock:
+            keys = self.touched[kind]
+            self.touched[kind] = set()
+            self.last_flush = time.monotonic()
+        return list(keys)
+
+    def is_flush_due(self):
+        return time.monotonic() - self.last_flush >= TOUCH_FLUSH_INTERVAL_SECONDS
+
+
+touch_buffer = (
+    RedisTouchBuffer(REDIS_CACHE_URL) if REDIS_CACHE_URL else LocalTouchBuffer()
+)
+
+
+def record_touch(kind, key):
+    """
+    Records that an object's `last_used` time should be set to now, without writing to
+    the database immediately.
+
+    `kind` is a key of `TOUCH_MODELS`. Touches are written in bulk by `flush_touches`.
+    """
+    try:
+        touch_buffer.add(kind, key)
+    except Exception as e:
+        logger.warning("Failed to buffer touch, writing it directly: %s", e)
+        model, field = TOUCH_MODELS[kind]
+        model.objects.filter(**{field: key}).update(last_used=datetime.now())
+
+
+def flush_touches():
+    """
+    Writes all buffered touches to the database, with one UPDATE per model for every
+    `FLUSH_BATCH_SIZE` objects.
+
+    Returns the number of rows updated.
+    """
+    now = datetime.now()
+    updated = 0
+    for kind, (model, field) in TOUCH_MODELS.items():
+        keys = touch_buffer.pop_all(kind)
+        for i in range(0, len(keys), FLUSH_BATCH_SIZE):
+            updated += model.objects.filter(
+                **{f"{field}__in": keys[i : i + FLUSH_BATCH_SIZE]}
+            ).update(last_used=now)
+        if keys:
+            logger.debug("Flushed %d %s touches.", len(keys), kind)
+    return updated
+
+
+def flush_due_touches(**kwargs):
+    """
+    Flushes the in-memory touch buffer once the flush interval has passed.
+
+    Runs once a response has been sent, so the flush doesn't slow down the request. It
+    also doesn't count as a write of the request (see `ReplicaRoutingMiddleware`), since
+    touches shouldn't keep the client's reads on the primary database.
+    """
+    if not (touch_buffer.flushes_after_requests and touch_buffer.is_flush_due()):
+        return
+    token = routing_state.set(None)
+    try:
+        flush_touches()
+    except DatabaseError as e:
+        logger.db_error(e)
+    finally:
+        routing_state.reset(token)
+
+
+request_finished.connect(flush_due_touches)
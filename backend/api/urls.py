@@ -9,4 +9,5 @@ urlpatterns = [
     path("availability/", include("api.availability.urls")),
     path("dashboard/", include("api.dashboard.urls")),
     path("account/", include("api.account.urls")),
+    path("metrics/", views.get_metrics),
 ]
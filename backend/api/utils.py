@@ -1,18 +1,40 @@
+import contextvars
 import functools
+import hashlib
 import logging
+import random
+import time
 import uuid
+from collections import defaultdict
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from django.db import DatabaseError, transaction
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.core.cache import caches
+from django.db import DatabaseError, connections, transaction
 from django.db.models import Q
+from django.http import HttpResponse
+from django.utils.http import parse_etags, quote_etag
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import serializers
 from rest_framework.decorators import api_view
 from rest_framework.exceptions import ParseError
+from rest_framework.request import Request
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework.throttling import AnonRateThrottle
 
-from api.availability.utils import get_weekday_date
+from api.availability.utils import TIMESLOT_MINUTES, get_timeslots, get_weekday_date
+from api.metrics import (
+    GUEST_CREATIONS,
+    OUTPUT_VALIDATIONS,
+    RATE_LIMIT_REJECTIONS,
+    REQUEST_DB_DURATION,
+    REQUEST_DURATION,
+    REQUEST_QUERIES,
+    REQUESTS,
+    VALIDATION_DURATION,
+)
 from api.models import UserAccount, UserEvent, UserSession
 from api.settings import (
     ACCOUNT_COOKIE_NAME,
@@ -21,10 +43,16 @@ from api.settings import (
     GENERIC_ERR_RESPONSE,
     GUEST_COOKIE_NAME,
     LONG_SESS_EXP_SECONDS,
+    OUTPUT_VALIDATION_MODE,
+    OUTPUT_VALIDATION_SAMPLE_RATE,
     REST_FRAMEWORK,
+    SESS_CACHE_SECONDS,
     SESS_EXP_SECONDS,
+    SESS_TOUCH_INTERVAL_SECONDS,
+    SLOW_REQUEST_SECONDS,
     TEST_ENVIRONMENT,
 )
+from api.touches import record_touch
 
 logger = logging.getLogger("api")
 
@@ -55,15 +83,169 @@ def get_metadata(func):
     return func.metadata
 
 
+class RequestStats:
+    """
+    What a request spent its time on, collected while it is handled by `api_endpoint`.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0
+        # Only has the stages the request's endpoint validates
+        self.validation_seconds = defaultdict(float)
+
+    def record_query(self, execute, sql, params, many, context):
+        """
+        A database execute wrapper that counts and times the queries of the request.
+        """
+        # Concurrent async requests run their queries on the same thread's connections,
+        # so each request only records the queries made in its own context
+        if request_stats.get() is not self:
+            return execute(sql, params, many, context)
+        start_time = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - start_time
+
+
+request_stats = contextvars.ContextVar("request_stats", default=None)
+
+
+def add_query_recorder(stats):
+    """
+    Starts recording the queries made on the current thread's connections in `stats`.
+    """
+    for connection in connections.all():
+        connection.execute_wrappers.append(stats.record_query)
+
+
+def remove_query_recorder(stats):
+    # Removed by value, since requests sharing a thread don't finish in order
+    for connection in connections.all():
+        connection.execute_wrappers.remove(stats.record_query)
+
+
+def record_validation_time(stage):
+    """
+    A decorator to add the time taken by a validation function to the current request's
+    stats, as either "input" or "output" validation.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stats = request_stats.get()
+                if stats is not None:
+                    stats.validation_seconds[stage] += time.perf_counter() - start_time
+
+        return wrapper
+
+    return decorator
+
+
+def get_endpoint_path(request):
+    """
+    Returns the path of the endpoint handling a request, the same way it is listed in
+    the docs (see `api.docs.utils.get_all_endpoints`). Used to label its metrics.
+    """
+    return "/" + request.resolver_match.route
+
+
+def record_request(request, response, stats, seconds):
+    endpoint = get_endpoint_path(request)
+    REQUESTS.labels(endpoint, request.method, response.status_code).inc()
+    REQUEST_DURATION.labels(endpoint).observe(seconds)
+    REQUEST_QUERIES.labels(endpoint).observe(stats.queries)
+    REQUEST_DB_DURATION.labels(endpoint).observe(stats.db_seconds)
+    for stage, stage_seconds in stats.validation_seconds.items():
+        VALIDATION_DURATION.labels(endpoint, stage).observe(stage_seconds)
+
+    logger.log(
+        logging.WARNING if seconds >= SLOW_REQUEST_SECONDS else logging.DEBUG,
+        "endpoint=%s method=%s status=%d duration_ms=%.1f queries=%d db_ms=%.1f "
+        "input_validation_ms=%.1f output_validation_ms=%.1f",
+        endpoint,
+        request.method,
+        response.status_code,
+        seconds * 1000,
+        stats.queries,
+        stats.db_seconds * 1000,
+        stats.validation_seconds.get("input", 0) * 1000,
+        stats.validation_seconds.get("output", 0) * 1000,
+    )
+
+
+def instrument_view(view):
+    """
+    Wraps a view to record how long its requests take, along with their database queries
+    and validation time (see `RequestStats`), in the metrics and the log.
+    """
+    if iscoroutinefunction(view):
+
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            stats = RequestStats()
+            token = request_stats.set(stats)
+            start_time = time.perf_counter()
+            # The async ORM methods run their queries in the thread used by
+            # `sync_to_async`, so the recorder is added to that thread's connections
+            await sync_to_async(add_query_recorder)(stats)
+            try:
+                response = await view(request, *args, **kwargs)
+            finally:
+                await sync_to_async(remove_query_recorder)(stats)
+                request_stats.reset(token)
+            record_request(request, response, stats, time.perf_counter() - start_time)
+            return response
+
+    else:
+
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            stats = RequestStats()
+            token = request_stats.set(stats)
+            start_time = time.perf_counter()
+            add_query_recorder(stats)
+            try:
+                response = view(request, *args, **kwargs)
+                # Rendered here instead of after the view returns, like async views are,
+                # so rendering is included in the time
+                if hasattr(response, "render"):
+                    response.render()
+            finally:
+                remove_query_recorder(stats)
+                request_stats.reset(token)
+            record_request(request, response, stats, time.perf_counter() - start_time)
+            return response
+
+    wrapper.instrumented = True
+    return wrapper
+
+
 def api_endpoint(method):
     """
     Defines an API endpoint that uses a single method type.
 
+    The view function can be async, in which case the rest of its decorators must
+    support async functions too.
+
+    Every request is timed, and its number of queries and time spent in the database
+    and on validation are recorded (see `instrument_view`).
+
     **This must be the outer-most decorator for the view function to work properly.**
     """
 
     def decorator(func):
-        drf_view = api_view([method])(func)
+        if iscoroutinefunction(func):
+            drf_view = async_api_view(method, func)
+        else:
+            drf_view = api_view([method])(func)
         metadata = get_metadata(func)
         metadata.method = method
         drf_view.metadata = metadata
@@ -73,11 +255,64 @@ def api_endpoint(method):
                 "No output serializer defined for function: %s",
                 func.__name__,
             )
-        return drf_view
+        return instrument_view(drf_view)
 
     return decorator
 
 
+def async_api_view(method, func):
+    """
+    The equivalent of DRF's `api_view` for async view functions, which it doesn't
+    support.
+
+    The request is wrapped in a DRF `Request` so the same decorators work for both kinds
+    of views, and the returned `Response` is rendered here.
+    """
+    allowed_methods = sorted({method, "OPTIONS"})
+
+    @csrf_exempt
+    @functools.wraps(func)
+    async def view(request, *args, **kwargs):
+        request = Request(
+            request,
+            parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        )
+        if request.method == "OPTIONS":
+            response = Response(status=200)
+        # Like Django's views, GET views also answer HEAD requests
+        elif request.method == method or (method, request.method) == ("GET", "HEAD"):
+            response = await func(request, *args, **kwargs)
+        else:
+            response = Response(
+                {"detail": f'Method "{request.method}" not allowed.'}, status=405
+            )
+        response["Allow"] = ", ".join(allowed_methods)
+        return render_response(request, response)
+
+    return view
+
+
+def render_response(request, response):
+    """
+    Renders a DRF `Response` from an async view into a plain `HttpResponse`, so Django
+    doesn't have to render it in a thread.
+    """
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    response.accepted_renderer = renderer
+    response.accepted_media_type = renderer.media_type
+    response.renderer_context = {"request": request, "response": response}
+    response.render()
+
+    rendered = HttpResponse(response.content, status=response.status_code)
+    if "Content-Type" not in response:
+        # Empty responses (like 304 Not Modified) don't get a content type
+        del rendered["Content-Type"]
+    for header, value in response.items():
+        rendered[header] = value
+    rendered.cookies = response.cookies
+    return rendered
+
+
 def get_session(token):
     """
     Retrieves a session by its token, ensuring it is still valid.
@@ -97,13 +332,94 @@ def get_session(token):
                 & Q(last_used__gte=datetime.now() - timedelta(seconds=SESS_EXP_SECONDS))
             )
         )
+        .select_related("user_account")
         .first()
     )
 
 
-def set_session_cookie(response, key, value, is_extended):
+def get_session_cache_key(token):
+    # Hashed so raw session tokens never end up in the cache
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def is_session_valid(session, now):
+    exp_seconds = LONG_SESS_EXP_SECONDS if session.is_extended else SESS_EXP_SECONDS
+    return session.last_used >= now - timedelta(seconds=exp_seconds)
+
+
+def authenticate_session(token):
     """
-    Given a response, sets a session cookie with appropriate parameters.
+    Retrieves a valid session (with its user account) by its token, or `None` if it
+    doesn't exist or expired.
+
+    Validated sessions are cached for `SESS_CACHE_SECONDS`, and `last_used` is touched
+    (see `api.touches`) at most once every `SESS_TOUCH_INTERVAL_SECONDS` instead of being
+    written on every request.
+    """
+    cache = caches["sessions"]
+    cache_key = get_session_cache_key(token)
+    now = datetime.now()
+
+    try:
+        session = cache.get(cache_key)
+    except Exception as e:
+        logger.warning("Session cache unavailable: %s", e)
+        session = None
+
+    needs_caching = False
+    if session is None or not is_session_valid(session, now):
+        session = get_session(token)
+        if not session:
+            return None
+        needs_caching = True
+
+    if now - session.last_used >= timedelta(seconds=SESS_TOUCH_INTERVAL_SECONDS):
+        record_touch("session", token)
+        session.last_used = now
+        needs_caching = True
+
+    if needs_caching:
+        try:
+            cache.set(cache_key, session, SESS_CACHE_SECONDS)
+        except Exception as e:
+            logger.warning("Session cache unavailable: %s", e)
+    return session
+
+
+def forget_sessions(tokens):
+    """
+    Removes sessions from the session cache. This must be called whenever sessions are
+    deleted or their user account changes.
+
+    Inside a transaction, they are only removed once it commits, since a concurrent
+    request would otherwise cache them again from before the change.
+    """
+    cache_keys = [get_session_cache_key(t) for t in tokens]
+
+    def delete_cache_keys():
+        try:
+            caches["sessions"].delete_many(cache_keys)
+        except Exception as e:
+            logger.error("Failed to remove sessions from cache: %s", e)
+
+    transaction.on_commit(delete_cache_keys)
+
+
+def forget_user_sessions(user):
+    """
+    Removes all of a user's sessions from the session cache. The sessions are looked up
+    right away, so this must be called before they are deleted.
+    """
+    forget_sessions(
+        UserSession.objects.filter(user_account=user).values_list(
+            "session_token", flat=True
+        )
+    )
+
+
+def set_cookie(response, key, value, max_age):
+    """
+    Given a response, sets a cookie with appropriate parameters.
 
     Mostly just to avoid repeating this 8-line block of code.
 
@@ -111,21 +427,33 @@ def set_session_cookie(response, key, value, is_extended):
     parameters for testing to allow proper cookie functionality in different testing
     environments.
     """
-
-    # Delete the legacy "Host-Only" cookie if it exists
-    response.delete_cookie(key)
-
     response.set_cookie(
         key=key,
         value=value,
         httponly=True,
         secure=False if DEBUG and TEST_ENVIRONMENT == "Local" else True,
         samesite="None" if DEBUG and TEST_ENVIRONMENT == "Codespaces" else "Lax",
-        max_age=LONG_SESS_EXP_SECONDS if is_extended else SESS_EXP_SECONDS,
+        max_age=max_age,
         domain=COOKIE_DOMAIN,
     )
 
 
+def set_session_cookie(response, key, value, is_extended):
+    """
+    Given a response, sets a session cookie with appropriate parameters.
+    """
+
+    # Delete the legacy "Host-Only" cookie if it exists
+    response.delete_cookie(key)
+
+    set_cookie(
+        response,
+        key,
+        value,
+        LONG_SESS_EXP_SECONDS if is_extended else SESS_EXP_SECONDS,
+    )
+
+
 def delete_session_cookie(response, key):
     """
     Given a response, deletes a session cookie.
@@ -135,6 +463,99 @@ def delete_session_cookie(response, key):
     response.delete_cookie(key, domain=COOKIE_DOMAIN)
 
 
+class SessionAuth:
+    """
+    The sessions identified by a request's cookies, attached to every request as
+    `request.session_auth` by `SessionAuthMiddleware`.
+
+    Each session is only looked up when first accessed, and at most once per request.
+    """
+
+    def __init__(self, cookies):
+        self.account_token = cookies.get(ACCOUNT_COOKIE_NAME)
+        self.guest_token = cookies.get(GUEST_COOKIE_NAME)
+
+    @functools.cached_property
+    def account_session(self):
+        if not self.account_token:
+            return None
+        logger.debug("Account session token: %s", self.account_token)
+        session = authenticate_session(self.account_token)
+        if not session:
+            logger.info("Account session expired.")
+        return session
+
+    @functools.cached_property
+    def guest_session(self):
+        if not self.guest_token:
+            return None
+        logger.debug("Guest session token: %s", self.guest_token)
+        session = authenticate_session(self.guest_token)
+        if not session:
+            logger.info("Guest session expired.")
+        return session
+
+    @property
+    def account_session_expired(self):
+        return bool(self.account_token) and self.account_session is None
+
+    @property
+    def session(self):
+        """
+        The account session if it is valid, otherwise the guest session.
+        """
+        return self.account_session or self.guest_session
+
+
+def finish_auth_response(response, auth):
+    """
+    Refreshes the cookie of the session used for a request, and lets the user know if
+    their account session expired.
+    """
+    if auth.account_session:
+        set_session_cookie(
+            response,
+            ACCOUNT_COOKIE_NAME,
+            auth.account_session.session_token,
+            auth.account_session.is_extended,
+        )
+        return response
+
+    if auth.guest_session:
+        set_session_cookie(
+            response, GUEST_COOKIE_NAME, auth.guest_session.session_token, True
+        )
+
+    # Make sure to return a message if the account session expired
+    if auth.account_session_expired:
+        SESS_EXP_MSG = "Account session expired."
+        # 304 responses (see `etag`) have no body, so only the cookie is removed
+        if response.data is not None and response.status_code != 304:
+            if "message" in response.data:
+                response.data["message"].append(SESS_EXP_MSG)
+            else:
+                response.data["message"] = [SESS_EXP_MSG]
+        delete_session_cookie(response, ACCOUNT_COOKIE_NAME)
+    return response
+
+
+def get_auth_session(auth):
+    """
+    Looks up the session used for a request.
+
+    Returns the session (or `None`) and `None`, or `None` and an error response if the
+    lookup failed.
+    """
+    try:
+        return auth.session, None
+    except DatabaseError as e:
+        logger.db_error(e)
+        return None, GENERIC_ERR_RESPONSE
+    except Exception as e:
+        logger.error(e)
+        return None, GENERIC_ERR_RESPONSE
+
+
 def check_auth(func):
     """
     A decorator to check if the user is authenticated based on their cookies.
@@ -147,80 +568,33 @@ def check_auth(func):
     If authenticated, this refreshes the session token cookie with the response.
     """
 
-    @functools.wraps(func)
-    def wrapper(request, *args, **kwargs):
-        acct_token = request.COOKIES.get(ACCOUNT_COOKIE_NAME)
-        acct_sess_expired = False
-        if acct_token:
-            logger.debug("Account session token: %s", acct_token)
-            try:
-                with transaction.atomic():
-                    session = get_session(acct_token)
-                    if not session:
-                        # To break out of the rest of the logic
-                        raise UserSession.DoesNotExist
-                    session.save()  # To update last_used to now
+    if iscoroutinefunction(func):
 
-                # At this point the account is authenticated
-                request.user = session.user_account
+        @functools.wraps(func)
+        async def async_wrapper(request, *args, **kwargs):
+            auth = request.session_auth
+            session, error = await sync_to_async(get_auth_session)(auth)
+            if error is not None:
+                return error
 
-                response = func(request, *args, **kwargs)
-                # Intercept the response to refresh the session token cookie
-                set_session_cookie(
-                    response, ACCOUNT_COOKIE_NAME, acct_token, session.is_extended
-                )
-                return response
-            except UserSession.DoesNotExist:
-                logger.info("Account session expired.")
-                acct_sess_expired = True
-            except DatabaseError as e:
-                logger.db_error(e)
-                return GENERIC_ERR_RESPONSE
-            except Exception as e:
-                logger.error(e)
-                return GENERIC_ERR_RESPONSE
+            # Do NOT create a new guest account
+            request.user = session.user_account if session else None
+            response = await func(request, *args, **kwargs)
+            return finish_auth_response(response, auth)
 
-        # At this point the account session either expired or did not exist
-        guest_token = request.COOKIES.get(GUEST_COOKIE_NAME)
+        return async_wrapper
 
-        if guest_token:
-            logger.debug("Guest session token: %s", guest_token)
-            # Make sure the guest session token exists (it should)
-            try:
-                with transaction.atomic():
-                    session = get_session(guest_token)
-                    if not session:
-                        raise UserSession.DoesNotExist
-                    session.save()  # Update last_used
-
-                request.user = session.user_account
-                # Run the function
-                response = func(request, *args, **kwargs)
-                set_session_cookie(response, GUEST_COOKIE_NAME, guest_token, True)
-            except UserSession.DoesNotExist:
-                logger.info("Guest session expired.")
-                # Do NOT create a new guest account
-                request.user = None
-                # Run the function
-                response = func(request, *args, **kwargs)
-            except Exception as e:
-                logger.error(e)
-                return GENERIC_ERR_RESPONSE
-        else:
-            # Do NOT create a new guest account
-            request.user = None
-            # Run the function
-            response = func(request, *args, **kwargs)
+    @functools.wraps(func)
+    def wrapper(request, *args, **kwargs):
+        auth = request.session_auth
+        session, error = get_auth_session(auth)
+        if error is not None:
+            return error
 
-        # Make sure to return a message if the account session expired
-        if acct_sess_expired:
-            SESS_EXP_MSG = "Account session expired."
-            if "message" in response.data:
-                response.data["message"].append(SESS_EXP_MSG)
-            else:
-                response.data["message"] = [SESS_EXP_MSG]
-            delete_session_cookie(response, ACCOUNT_COOKIE_NAME)
-        return response
+        # Do NOT create a new guest account
+        request.user = session.user_account if session else None
+        response = func(request, *args, **kwargs)
+        return finish_auth_response(response, auth)
 
     return wrapper
 
@@ -229,6 +603,22 @@ class GuestAccountCreationThrottle(AnonRateThrottle):
     scope = "guest_account_creation"
 
 
+def create_guest_session():
+    """
+    Creates a guest user account with an extended session.
+    """
+    with transaction.atomic():
+        guest_account = UserAccount.objects.create(is_guest=True)
+        guest_session = UserSession.objects.create(
+            session_token=str(uuid.uuid4()),
+            user_account=guest_account,
+            is_extended=True,
+        )
+    GUEST_CREATIONS.inc()
+    logger.debug("New guest session token: %s", guest_session.session_token)
+    return guest_session
+
+
 def require_auth(func):
     """
     A decorator to check if the user is authenticated (either with an account or as a
@@ -244,108 +634,22 @@ def require_auth(func):
 
     @functools.wraps(func)
     def wrapper(request, *args, **kwargs):
-        acct_token = request.COOKIES.get(ACCOUNT_COOKIE_NAME)
-        acct_sess_expired = False
-        if acct_token:
-            logger.debug("Account session token: %s", acct_token)
-            try:
-                with transaction.atomic():
-                    session = get_session(acct_token)
-                    if not session:
-                        # To break out of the rest of the logic
-                        raise UserSession.DoesNotExist
-                    session.save()  # To update last_used to now
-
-                # At this point the account is authenticated
-                request.user = session.user_account
-
-                response = func(request, *args, **kwargs)
-                # Intercept the response to refresh the session token cookie
-                set_session_cookie(
-                    response, ACCOUNT_COOKIE_NAME, acct_token, session.is_extended
-                )
-                return response
-            except UserSession.DoesNotExist:
-                logger.info("Account session expired.")
-                acct_sess_expired = True
-            except DatabaseError as e:
-                logger.db_error(e)
-                return GENERIC_ERR_RESPONSE
-            except Exception as e:
-                logger.error(e)
-                return GENERIC_ERR_RESPONSE
-
-        # At this point the account session either expired or did not exist
-        guest_token = request.COOKIES.get(GUEST_COOKIE_NAME)
-
-        if guest_token:
-            logger.debug("Guest session token: %s", guest_token)
-            # Make sure the guest session token exists (it should)
-            try:
-                with transaction.atomic():
-                    session = get_session(guest_token)
-                    if not session:
-                        raise UserSession.DoesNotExist
-                    session.save()  # Update last_used
-
-                request.user = session.user_account
-                # Run the function
-                response = func(request, *args, **kwargs)
-                set_session_cookie(response, GUEST_COOKIE_NAME, guest_token, True)
-            except UserSession.DoesNotExist:
-                logger.info("Guest session expired. Creating a new guest account...")
-                # Check guest creation rate limit
-                throttle = GuestAccountCreationThrottle()
-                if not throttle.allow_request(request, None):
-                    logger.warning(
-                        "Guest creation limit (%s) reached.", throttle.get_rate()
-                    )
-                    return Response(
-                        {
-                            "error": {
-                                "general": [
-                                    f"Guest creation limit ({throttle.get_rate()}) reached. Make sure cookies are enabled for this site, and try again later."
-                                ]
-                            }
-                        },
-                        status=429,
-                    )
-                # Create a new guest user
-                try:
-                    with transaction.atomic():
-                        guest_account = UserAccount.objects.create(is_guest=True)
-                        new_session_token = str(uuid.uuid4())
-                        guest_session = UserSession.objects.create(
-                            session_token=new_session_token,
-                            user_account=guest_account,
-                            is_extended=True,
-                        )
-                    logger.debug(
-                        "New guest session token: %s", guest_session.session_token
-                    )
-
-                    request.user = guest_account
-                    # Run the function
-                    response = func(request, *args, **kwargs)
-                    set_session_cookie(
-                        response,
-                        GUEST_COOKIE_NAME,
-                        guest_session.session_token,
-                        True,
-                    )
-                except DatabaseError as e:
-                    logger.db_error(e)
-                    return GENERIC_ERR_RESPONSE
-                except Exception as e:
-                    logger.error(e)
-                    return GENERIC_ERR_RESPONSE
-            except Exception as e:
-                logger.error(e)
-                return GENERIC_ERR_RESPONSE
-        else:
+        auth = request.session_auth
+        try:
+            session = auth.session
+        except DatabaseError as e:
+            logger.db_error(e)
+            return GENERIC_ERR_RESPONSE
+        except Exception as e:
+            logger.error(e)
+            return GENERIC_ERR_RESPONSE
+
+        if not session:
+            logger.info("Creating a new guest account...")
             # Check guest creation rate limit
             throttle = GuestAccountCreationThrottle()
             if not throttle.allow_request(request, None):
+                RATE_LIMIT_REJECTIONS.labels(throttle.scope).inc()
                 logger.warning(
                     "Guest creation limit (%s) reached.", throttle.get_rate()
                 )
@@ -359,43 +663,19 @@ def require_auth(func):
                     },
                     status=429,
                 )
-            # Create a guest user with an extended session
             try:
-                with transaction.atomic():
-                    guest_account = UserAccount.objects.create(is_guest=True)
-                    new_session_token = str(uuid.uuid4())
-                    guest_session = UserSession.objects.create(
-                        session_token=new_session_token,
-                        user_account=guest_account,
-                        is_extended=True,
-                    )
-                logger.debug("New guest session token: %s", guest_session.session_token)
-
-                request.user = guest_account
-                # Run the function
-                response = func(request, *args, **kwargs)
-                set_session_cookie(
-                    response,
-                    GUEST_COOKIE_NAME,
-                    guest_session.session_token,
-                    True,
-                )
+                session = create_guest_session()
             except DatabaseError as e:
                 logger.db_error(e)
                 return GENERIC_ERR_RESPONSE
             except Exception as e:
                 logger.error(e)
                 return GENERIC_ERR_RESPONSE
+            auth.guest_session = session
 
-        # Make sure to return a message if the account session expired
-        if acct_sess_expired:
-            SESS_EXP_MSG = "Account session expired."
-            if "message" in response.data:
-                response.data["message"].append(SESS_EXP_MSG)
-            else:
-                response.data["message"] = [SESS_EXP_MSG]
-            delete_session_cookie(response, ACCOUNT_COOKIE_NAME)
-        return response
+        request.user = session.user_account
+        response = func(request, *args, **kwargs)
+        return finish_auth_response(response, auth)
 
     get_metadata(wrapper).min_auth_required = "Guest"
     return wrapper
@@ -415,41 +695,25 @@ def require_account_auth(func):
 
     @functools.wraps(func)
     def wrapper(request, *args, **kwargs):
-        acct_token = request.COOKIES.get(ACCOUNT_COOKIE_NAME)
-        logger.debug("Account session token: %s", acct_token)
-
-        BAD_AUTH_RESPONSE = Response(
-            {"error": {"general": ["Account required."]}}, status=401
+        try:
+            session = request.session_auth.account_session
+        except DatabaseError as e:
+            logger.db_error(e)
+            return GENERIC_ERR_RESPONSE
+        except Exception as e:
+            logger.error(e)
+            return GENERIC_ERR_RESPONSE
+
+        if not session:
+            return Response({"error": {"general": ["Account required."]}}, status=401)
+
+        request.user = session.user_account
+        response = func(request, *args, **kwargs)
+        # Intercept the response to refresh the session token cookie
+        set_session_cookie(
+            response, ACCOUNT_COOKIE_NAME, session.session_token, session.is_extended
         )
-
-        if acct_token:
-            try:
-                with transaction.atomic():
-                    session = get_session(acct_token)
-                    if not session:
-                        raise UserSession.DoesNotExist
-                    session.save()  # To update last_used to now
-
-                # At this point the account is authenticated
-                request.user = session.user_account
-
-                response = func(request, *args, **kwargs)
-                # Intercept the response to refresh the session token cookie
-                set_session_cookie(
-                    response, ACCOUNT_COOKIE_NAME, acct_token, session.is_extended
-                )
-                return response
-            except UserSession.DoesNotExist:
-                logger.info("Account session expired.")
-                return BAD_AUTH_RESPONSE
-            except DatabaseError as e:
-                logger.db_error(e)
-                return GENERIC_ERR_RESPONSE
-            except Exception as e:
-                logger.error(e)
-                return GENERIC_ERR_RESPONSE
-        else:
-            return BAD_AUTH_RESPONSE
+        return response
 
     get_metadata(wrapper).min_auth_required = "User Account"
     return wrapper
@@ -480,26 +744,43 @@ def validate_json_input(serializer_class):
     The `serializer_class` is used to validate the request data.
     """
 
+    @record_validation_time("input")
+    def validate(request):
+        if request.content_type != "application/json":
+            return Response(
+                {"error": {"general": ["Request body must be JSON."]}},
+                status=415,
+            )
+        try:
+            serializer = serializer_class(data=request.data)
+        except ParseError:
+            return Response(
+                {"error": {"general": ["Invalid JSON."]}},
+                status=400,
+            )
+        if not serializer.is_valid():
+            errors = fix_choice_field_errors(serializer)
+            return Response({"error": errors}, status=400)
+        request.validated_data = serializer.validated_data
+
     def decorator(func):
-        @functools.wraps(func)
-        def wrapper(request, *args, **kwargs):
-            if request.content_type != "application/json":
-                return Response(
-                    {"error": {"general": ["Request body must be JSON."]}},
-                    status=415,
-                )
-            try:
-                serializer = serializer_class(data=request.data)
-            except ParseError:
-                return Response(
-                    {"error": {"general": ["Invalid JSON."]}},
-                    status=400,
-                )
-            if not serializer.is_valid():
-                errors = fix_choice_field_errors(serializer)
-                return Response({"error": errors}, status=400)
-            request.validated_data = serializer.validated_data
-            return func(request, *args, **kwargs)
+        if iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(request, *args, **kwargs):
+                error = validate(request)
+                if error is not None:
+                    return error
+                return await func(request, *args, **kwargs)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(request, *args, **kwargs):
+                error = validate(request)
+                if error is not None:
+                    return error
+                return func(request, *args, **kwargs)
 
         metadata = get_metadata(wrapper)
         metadata.input_type = "JSON Body"
@@ -516,28 +797,45 @@ def validate_query_param_input(serializer_class):
     The `serializer_class` is used to validate the query parameters.
     """
 
-    def decorator(func):
-        @functools.wraps(func)
-        def wrapper(request, *args, **kwargs):
-            # Parse the query parameters into a dictionary
-            # This allows for both single and multiple values for the same key
-            query_dict = {}
-            for key in request.query_params:
-                value = request.query_params.getlist(key)
-                if isinstance(value, list):
-                    if len(value) == 1:
-                        query_dict[key] = value[0]
-                    else:
-                        query_dict[key] = value
-                elif isinstance(value, str):
+    @record_validation_time("input")
+    def validate(request):
+        # Parse the query parameters into a dictionary
+        # This allows for both single and multiple values for the same key
+        query_dict = {}
+        for key in request.query_params:
+            value = request.query_params.getlist(key)
+            if isinstance(value, list):
+                if len(value) == 1:
+                    query_dict[key] = value[0]
+                else:
                     query_dict[key] = value
+            elif isinstance(value, str):
+                query_dict[key] = value
 
-            serializer = serializer_class(data=query_dict)
-            if not serializer.is_valid():
-                errors = fix_choice_field_errors(serializer)
-                return Response({"error": errors}, status=400)
-            request.validated_data = serializer.validated_data
-            return func(request, *args, **kwargs)
+        serializer = serializer_class(data=query_dict)
+        if not serializer.is_valid():
+            errors = fix_choice_field_errors(serializer)
+            return Response({"error": errors}, status=400)
+        request.validated_data = serializer.validated_data
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(request, *args, **kwargs):
+                error = validate(request)
+                if error is not None:
+                    return error
+                return await func(request, *args, **kwargs)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(request, *args, **kwargs):
+                error = validate(request)
+                if error is not None:
+                    return error
+                return func(request, *args, **kwargs)
 
         metadata = get_metadata(wrapper)
         metadata.input_type = "Query Parameters"
@@ -598,20 +896,88 @@ class MessageOutputSerializer(serializers.Serializer):
     message = serializers.ListField(child=serializers.CharField())
 
 
-def validate_output(serializer_class):
+def get_output_validation_mode():
+    """
+    Returns how the output of the current request should be validated, either "full",
+    "structural" or "off".
+
+    In "sampled" mode, 1 in every `OUTPUT_VALIDATION_SAMPLE_RATE` responses is fully
+    validated and the rest only get the structural check.
+    """
+    if OUTPUT_VALIDATION_MODE == "sampled":
+        if random.randrange(OUTPUT_VALIDATION_SAMPLE_RATE) == 0:
+            return "full"
+        return "structural"
+    return OUTPUT_VALIDATION_MODE
+
+
+@functools.cache
+def get_output_fields(serializer_class):
+    """
+    Returns the names of all fields of a serializer, in order, and the names of its
+    required fields.
+    """
+    fields = serializer_class().fields
+    return tuple(fields), frozenset(n for n, f in fields.items() if f.required)
+
+
+def validate_output(serializer_class, encodings=None):
+    """
+    A decorator to validate the successful responses of a view function.
+
+    For endpoints with an "encoding" input field, `encodings` can map its values to the
+    serializer used for responses in that encoding instead of `serializer_class`.
+
+    How thoroughly responses are validated depends on `OUTPUT_VALIDATION_MODE`. The
+    structural check only makes sure the top-level required fields are present, and
+    drops any top-level fields the serializer doesn't define.
+    """
+
     def decorator(func):
-        @functools.wraps(func)
-        def wrapper(request, *args, **kwargs):
-            response = func(request, *args, **kwargs)
+        @record_validation_time("output")
+        def check_output(request, response):
             if isinstance(response, Response):
                 if 200 <= response.status_code < 300:
-                    serializer = serializer_class(data=response.data)
-                    if serializer.is_valid():
-                        response.data = serializer.validated_data
-                        return response
-                    else:
-                        logger.error("Output validation failed: %s", serializer.errors)
-                        return GENERIC_ERR_RESPONSE
+                    output_serializer_class = serializer_class
+                    if encodings:
+                        encoding = request.validated_data.get("encoding")
+                        output_serializer_class = encodings.get(
+                            encoding, serializer_class
+                        )
+                    mode = get_output_validation_mode()
+                    OUTPUT_VALIDATIONS.labels(get_endpoint_path(request), mode).inc()
+
+                    if mode == "full":
+                        serializer = output_serializer_class(data=response.data)
+                        if serializer.is_valid():
+                            response.data = serializer.validated_data
+                            return response
+                        else:
+                            logger.error(
+                                "Output validation failed: %s", serializer.errors
+                            )
+                            return GENERIC_ERR_RESPONSE
+                    elif mode == "structural":
+                        if not isinstance(response.data, dict):
+                            logger.error("Output validation failed: not a dictionary")
+                            return GENERIC_ERR_RESPONSE
+                        field_names, required = get_output_fields(
+                            output_serializer_class
+                        )
+                        missing = required - response.data.keys()
+                        if missing:
+                            logger.error(
+                                "Output validation failed, missing fields: %s",
+                                ", ".join(sorted(missing)),
+                            )
+                            return GENERIC_ERR_RESPONSE
+                        # Like full validation, only the serializer's fields are sent
+                        response.data = {
+                            name: response.data[name]
+                            for name in field_names
+                            if name in response.data
+                        }
+                    return response
                 else:
                     validate_error_format(
                         response.data, get_metadata(wrapper).input_serializer_class
@@ -623,12 +989,116 @@ def validate_output(serializer_class):
                 logger.critical("Response is not a valid Response object.")
                 return GENERIC_ERR_RESPONSE
 
+        if iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(request, *args, **kwargs):
+                return check_output(request, await func(request, *args, **kwargs))
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(request, *args, **kwargs):
+                return check_output(request, func(request, *args, **kwargs))
+
         get_metadata(wrapper).output_serializer_class = serializer_class
         return wrapper
 
     return decorator
 
 
+def make_etag(*parts):
+    """
+    Builds an ETag value from version data that changes whenever the response would.
+    """
+    return hashlib.sha256("|".join(map(str, parts)).encode()).hexdigest()[:32]
+
+
+def etag(etag_func):
+    """
+    A decorator to add an ETag to the successful responses of a view function. If the
+    request's If-None-Match header matches, 304 Not Modified is returned without running
+    the view.
+
+    `etag_func(request)` should build the ETag from cheap version data with `make_etag`,
+    or return `None` to skip this. It runs after authentication and input validation, so
+    this decorator must be placed after them.
+
+    For async views, `etag_func` can be async too. Otherwise it is run in a thread.
+    """
+
+    def get_tag(request):
+        try:
+            tag = etag_func(request)
+        except DatabaseError as e:
+            logger.db_error(e)
+            return None
+        return quote_etag(tag) if tag is not None else None
+
+    async def aget_tag(request):
+        if not iscoroutinefunction(etag_func):
+            return await sync_to_async(get_tag)(request)
+        try:
+            tag = await etag_func(request)
+        except DatabaseError as e:
+            logger.db_error(e)
+            return None
+        return quote_etag(tag) if tag is not None else None
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(request, *args, **kwargs):
+                tag = await aget_tag(request)
+                if is_not_modified(request, tag):
+                    return get_not_modified_response(tag)
+                response = await func(request, *args, **kwargs)
+                return add_etag(response, tag)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(request, *args, **kwargs):
+                tag = get_tag(request)
+                if is_not_modified(request, tag):
+                    return get_not_modified_response(tag)
+                response = func(request, *args, **kwargs)
+                return add_etag(response, tag)
+
+        return wrapper
+
+    return decorator
+
+
+def is_not_modified(request, tag):
+    """
+    Checks if a request's If-None-Match header matches a quoted ETag.
+    """
+    if tag is None:
+        return False
+    # If-None-Match uses weak comparison, so W/ prefixes are ignored
+    if_none_match = [
+        t.removeprefix("W/")
+        for t in parse_etags(request.headers.get("If-None-Match", ""))
+    ]
+    return tag in if_none_match or if_none_match == ["*"]
+
+
+def get_not_modified_response(tag):
+    response = Response(status=304)
+    response["ETag"] = tag
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+
+def add_etag(response, tag):
+    if tag is not None and response.status_code == 200:
+        response["ETag"] = tag
+        response["Cache-Control"] = "private, no-cache"
+    return response
+
+
 def get_rate_limit(scope):
     return REST_FRAMEWORK.get("DEFAULT_THROTTLE_RATES", {}).get(scope, None)
 
@@ -648,6 +1118,7 @@ def rate_limit(
         def wrapper(request, *args, **kwargs):
             throttle = throttle_class()
             if not throttle.allow_request(request, None):
+                RATE_LIMIT_REJECTIONS.labels(throttle.scope).inc()
                 msg = error_message
                 if "{rate}" in msg:
                     msg = msg.replace("{rate}", throttle.get_rate())
@@ -674,6 +1145,60 @@ class TimeZoneField(serializers.CharField):
         return value
 
 
+class TimeslotListField(serializers.Field):
+    """
+    A list of ISO 8601 timeslots, parsed and validated in a single pass instead of running
+    a `DateTimeField` for every item.
+
+    Timeslots must be on `TIMESLOT_MINUTES` intervals. Like `DateTimeField` with time
+    zones disabled, aware datetimes are converted to naive UTC. The timeslots are returned
+    sorted and without duplicates.
+    """
+
+    default_error_messages = {
+        "not_a_list": 'Expected a list of items but got type "{input_type}".',
+        "empty": "This list may not be empty.",
+        "invalid": "Timeslots must be datetimes in ISO 8601 format.",
+        "misaligned": f"Timeslots must be on {TIMESLOT_MINUTES}-minute intervals.",
+    }
+
+    def __init__(self, *, allow_empty=True, **kwargs):
+        self.allow_empty = allow_empty
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list):
+            self.fail("not_a_list", input_type=type(data).__name__)
+        if not data and not self.allow_empty:
+            self.fail("empty")
+
+        timeslots = set()
+        for item in data:
+            if isinstance(item, datetime):
+                timeslot = item
+            else:
+                if isinstance(item, str) and item.endswith("Z"):
+                    # The common case, parsed as naive UTC without converting
+                    item = item[:-1]
+                try:
+                    timeslot = datetime.fromisoformat(item)
+                except (TypeError, ValueError):
+                    self.fail("invalid")
+            if timeslot.tzinfo is not None:
+                timeslot = (timeslot - timeslot.utcoffset()).replace(tzinfo=None)
+            if (
+                timeslot.minute % TIMESLOT_MINUTES
+                or timeslot.second
+                or timeslot.microsecond
+            ):
+                self.fail("misaligned")
+            timeslots.add(timeslot)
+        return sorted(timeslots)
+
+    def to_representation(self, value):
+        return [timeslot.isoformat() for timeslot in value]
+
+
 def get_event_type(date_type):
     match date_type:
         case UserEvent.EventType.SPECIFIC:
@@ -700,29 +1225,45 @@ def get_event_bounds(event: UserEvent) -> EventBounds:
     """
     Finds the start and end date/time bounds for an event.
 
-    For query efficiency, the event's timeslots should be prefetched.
+    The bounds are normally stored on the event. If they aren't, they are calculated from
+    the event's timeslots, which should be prefetched for query efficiency.
+    """
+    if event.start_date is not None:
+        return EventBounds(
+            start_date=event.start_date,
+            end_date=event.end_date,
+            start_time=event.start_time,
+            end_time=event.end_time,
+        )
+
+    match event.date_type:
+        case UserEvent.EventType.SPECIFIC:
+            timeslots = event.date_timeslots.all()
+        case UserEvent.EventType.GENERIC:
+            timeslots = event.weekday_timeslots.all()
+    return calculate_event_bounds(event, timeslots)
+
+
+def calculate_event_bounds(event: UserEvent, timeslots) -> EventBounds:
+    """
+    Calculates the start and end date/time bounds for an event from its timeslot objects.
     """
     all_timeslots: list[datetime] = []
     event_time_zone = ZoneInfo(event.time_zone)
 
-    event_type = get_event_type(event.date_type)
     match event.date_type:
         case UserEvent.EventType.SPECIFIC:
             # Sort the timeslots by the EVENT'S time zone to get the creator's min/max
             all_timeslots = [
-                ts.utc_timeslot.astimezone(event_time_zone)
-                for ts in event.date_timeslots.all()
+                ts.utc_timeslot.astimezone(event_time_zone) for ts in timeslots
             ]
         case UserEvent.EventType.GENERIC:
             all_timeslots = [
-                get_weekday_date(ts.weekday, ts.local_timeslot)
-                for ts in event.weekday_timeslots.all()
+                get_weekday_date(ts.weekday, ts.local_timeslot) for ts in timeslots
             ]
 
     if not all_timeslots:
-        logger.critical(
-            f"Event {event.id} has no timeslots when formatting for dashboard."
-        )
+        logger.critical(f"Event {event.pk} has no timeslots when calculating bounds.")
         raise ValueError("Event has no timeslots.")
 
     # Earliest weekday is also sorted by date
@@ -752,14 +1293,38 @@ def get_event_bounds(event: UserEvent) -> EventBounds:
     )
 
 
-def format_event_info(event: UserEvent, include_participants: bool = False) -> dict:
+def update_event_bounds(event: UserEvent):
+    """
+    Calculates the bounds of an event from its saved timeslots and stores them on the
+    event. This must be called whenever the event's timeslots or time zone change.
+    """
+    bounds = calculate_event_bounds(event, get_timeslots(event))
+    event.start_date = bounds.start_date
+    event.end_date = bounds.end_date
+    event.start_time = bounds.start_time
+    event.end_time = bounds.end_time
+    event.save(update_fields=["start_date", "end_date", "start_time", "end_time"])
+
+
+def mark_participants_changed(events):
+    """
+    Bumps `updated_at` for events (or event IDs) that lost participants. Removed
+    participants leave nothing behind, so this is how the dashboard's "updated_since"
+    filter finds those events.
+    """
+    UserEvent.objects.filter(pk__in=events).update(updated_at=datetime.now())
+
+
+def format_event_info(
+    event: UserEvent, participant_names: list[str] | None = None
+) -> dict:
     """
     Formats event information.
 
-    For query efficiency, the event's timeslots should be prefetched.
+    For query efficiency, the event's timeslots should be prefetched if its bounds aren't
+    stored yet.
 
-    If `include_participants` is `True`, the event's participants should also be
-    prefetched.
+    If `participant_names` is given, it is included as the event's participants.
     """
     bounds = get_event_bounds(event)
 
@@ -774,10 +1339,8 @@ def format_event_info(event: UserEvent, include_participants: bool = False) -> d
         "event_code": event.url_code.url_code if event.url_code else None,
     }
 
-    if include_participants:
-        data["participants"] = [
-            participant.display_name for participant in event.participants.all()
-        ]
+    if participant_names is not None:
+        data["participants"] = participant_names
 
     if event.duration is not None:
         data["duration"] = event.duration
@@ -0,0 +1,55 @@
+import hmac
+
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+
+from api.docs.utils import get_all_endpoints
+from api.metrics import (
+    REQUEST_DB_DURATION,
+    REQUEST_DURATION,
+    REQUEST_QUERIES,
+    get_metrics_registry,
+)
+from api.settings import DEBUG, METRICS_TOKEN
+from api.utils import get_metadata
+
+
+def initialize_endpoint_metrics():
+    """
+    Adds every endpoint to the per-endpoint metrics, so endpoints without requests yet
+    are reported with zero requests instead of not at all.
+    """
+    for pattern in get_all_endpoints():
+        if getattr(pattern.callback, "instrumented", False):
+            endpoint = "/" + str(pattern.pattern)
+            REQUEST_DURATION.labels(endpoint)
+            REQUEST_QUERIES.labels(endpoint)
+            REQUEST_DB_DURATION.labels(endpoint)
+
+
+@require_GET
+def get_metrics(request):
+    """
+    Serves the API's metrics in the Prometheus text format, combined over all workers.
+
+    Requests must have the "Authorization: Bearer <METRICS_TOKEN>" header. If no
+    METRICS_TOKEN is set, the metrics are only served in debug mode.
+    """
+    if METRICS_TOKEN:
+        authorization = request.headers.get("Authorization", "")
+        if not hmac.compare_digest(authorization, f"Bearer {METRICS_TOKEN}"):
+            return JsonResponse(
+                {"error": {"general": ["Invalid metrics token."]}}, status=401
+            )
+    elif not DEBUG:
+        return JsonResponse({"error": {"general": ["Not found."]}}, status=404)
+
+    initialize_endpoint_metrics()
+    return HttpResponse(
+        generate_latest(get_metrics_registry()), content_type=CONTENT_TYPE_LATEST
+    )
+
+
+# Not a DRF view (its output isn't JSON), so its documentation is filled in here
+get_metadata(get_metrics).method = "GET"
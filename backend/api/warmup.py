@@ -0,0 +1,40 @@
+import logging
+
+from django.db import connections
+from rest_framework.settings import api_settings
+
+from api.docs.utils import get_all_endpoints
+from api.utils import get_output_fields
+
+logger = logging.getLogger("api")
+
+
+def warm_up():
+    """
+    Loads everything that would otherwise be loaded by the first requests a worker gets,
+    and checks that the databases are reachable.
+
+    Meant to run in the Gunicorn master process before workers are forked (see
+    `gunicorn.conf.py`), so every worker starts with it already in memory.
+    """
+    # Resolving the URL patterns imports every view module
+    endpoints = get_all_endpoints()
+    for pattern in endpoints:
+        metadata = getattr(pattern.callback, "metadata", None)
+        if metadata and metadata.output_serializer_class:
+            get_output_fields(metadata.output_serializer_class)
+
+    # DRF imports these from their dotted paths the first time they're used
+    api_settings.DEFAULT_PARSER_CLASSES
+    api_settings.DEFAULT_RENDERER_CLASSES
+
+    for connection in connections.all():
+        connection.ensure_connection()
+    # Forked workers can't share the connections or their pools, so each opens its own
+    # when needed
+    connections.close_all()
+    for connection in connections.all():
+        if getattr(connection, "pool", None) is not None:
+            connection.close_pool()
+
+    logger.info("Warmed up %d endpoints.", len(endpoints))
@@ -6,7 +6,7 @@ module.exports = {
             name: "plancake-api",
             cwd: __dirname,
             script: "./.venv/bin/python",
-            args: "-m gunicorn api.wsgi --bind 127.0.0.1:8000",
+            args: "-m gunicorn",
             instances: 1,
             autorestart: true,
             max_memory_restart: "250M",
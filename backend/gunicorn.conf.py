@@ -0,0 +1,125 @@
+# Gunicorn configuration for production, loaded automatically when Gunicorn is started
+# from this directory (see `ecosystem.config.js`)
+# https://docs.gunicorn.org/en/stable/settings.html
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+import environ
+from django.conf import settings
+
+# The settings are loaded through Django, since importing `api.settings` directly before
+# Django is set up leaves it half-initialized
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "api.settings")
+environ.Env.read_env(Path(__file__).resolve().parent / ".env")
+env = environ.Env()
+
+# Every process writes its metrics to files in this folder, so /metrics/ can combine
+# them. It has to be set before the metrics are created, and is emptied on every start
+# so counts from earlier runs aren't included.
+METRICS_DIR = env("PROMETHEUS_MULTIPROC_DIR", default="") or os.path.join(
+    tempfile.gettempdir(), "plancake-metrics"
+)
+os.environ["PROMETHEUS_MULTIPROC_DIR"] = METRICS_DIR
+shutil.rmtree(METRICS_DIR, ignore_errors=True)
+os.makedirs(METRICS_DIR)
+
+logger = logging.getLogger("api")
+
+bind = env("GUNICORN_BIND", default="127.0.0.1:8000")
+
+# Uvicorn workers serve the app through ASGI, any other worker class (like "gthread")
+# through WSGI
+worker_class = env("GUNICORN_WORKER_CLASS", default="uvicorn_worker.UvicornWorker")
+wsgi_app = "api.asgi" if worker_class.startswith("uvicorn") else "api.wsgi"
+if worker_class.startswith("uvicorn"):
+    # Like `api.asgi`, before the settings are loaded below
+    os.environ.setdefault("DB_CONN_MAX_AGE", "0")
+
+# Workers only share cached availability and availability streams through Redis, so
+# without REDIS_CACHE_URL a single worker is run (see `on_starting`). A single worker
+# runs every sync view and database query in one thread, so a slow request holds up all
+# others.
+REQUESTED_WORKERS = env.int(
+    "GUNICORN_WORKERS",
+    default=multiprocessing.cpu_count() * 2 + 1 if settings.REDIS_CACHE_URL else 1,
+)
+workers = REQUESTED_WORKERS if settings.REDIS_CACHE_URL else 1
+
+# Only used by gthread workers. Without DB_POOL, every thread keeps its own database
+# connection open for DB_CONN_MAX_AGE seconds, so by default the threads are sized so
+# that all workers together stay within GUNICORN_DB_CONNECTIONS.
+DB_CONNECTIONS = env.int("GUNICORN_DB_CONNECTIONS", default=20)
+threads = env.int(
+    "GUNICORN_THREADS",
+    default=8 if settings.DB_POOL else max(1, min(8, DB_CONNECTIONS // workers)),
+)
+
+# Load the app once in the master process, so workers share its memory and start ready
+preload_app = True
+
+# Workers are replaced after this many requests (plus up to 10% to stagger restarts) to
+# keep any slow memory growth in check, finishing their current requests first
+max_requests = env.int("GUNICORN_MAX_REQUESTS", default=1000)
+max_requests_jitter = max_requests // 10
+
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    if REQUESTED_WORKERS > workers:
+        # Each worker would cache availability and send stream changes on its own, so
+        # workers would keep serving availability that another one changed
+        logger.warning(
+            "Running %d workers needs REDIS_CACHE_URL, so cached availability and "
+            "availability streams are shared between them. Running a single worker "
+            "instead.",
+            REQUESTED_WORKERS,
+        )
+    if workers == 1:
+        logger.warning(
+            "Running a single worker. Slow requests will hold up every other request."
+        )
+    if settings.DB_POOL:
+        connections = workers * settings.DB_POOL_MAX_SIZE
+        if connections > DB_CONNECTIONS:
+            logger.warning(
+                "%d workers with pools of %d connections can keep up to %d database "
+                "connections open, more than GUNICORN_DB_CONNECTIONS (%d).",
+                workers,
+                settings.DB_POOL_MAX_SIZE,
+                connections,
+                DB_CONNECTIONS,
+            )
+    elif worker_class == "gthread" and settings.DATABASES["default"].get(
+        "CONN_MAX_AGE"
+    ):
+        connections = workers * threads
+        if connections > DB_CONNECTIONS:
+            logger.warning(
+                "%d workers with %d threads can keep up to %d database connections "
+                "open, more than GUNICORN_DB_CONNECTIONS (%d).",
+                workers,
+                threads,
+                connections,
+                DB_CONNECTIONS,
+            )
+
+
+def when_ready(server):
+    # Runs in the master process after the app is loaded, before any workers are forked
+    from api.warmup import warm_up
+
+    warm_up()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    # Drops the worker's connection pool gauges, which only count running processes
+    multiprocess.mark_process_dead(worker.pid)